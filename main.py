@@ -1,12 +1,40 @@
-import requests
+import time
+startup_t0 = time.perf_counter()
 import os
 import json
 import sys
-from datetime import datetime
-import curses
-import textwrap
-import base64
-import mimetypes
+import importlib
+import threading
+
+class lazyImport:
+    # stands in for a module (or a name in one) and only imports it the first time it's used,
+    # so startup doesn't pay for requests etc before anything is drawn
+    def __init__(self,module,attr=None):
+        self._module = module
+        self._attr = attr
+        self._obj = None
+
+    def _load(self):
+        if self._obj is None:
+            obj = importlib.import_module(self._module)
+            self._obj = getattr(obj,self._attr) if self._attr else obj
+        return self._obj
+
+    def __getattr__(self,name):
+        return getattr(self._load(),name)
+
+    def __call__(self,*args,**kwargs):
+        return self._load()(*args,**kwargs)
+
+requests = lazyImport('requests')
+curses = lazyImport('curses')
+textwrap = lazyImport('textwrap')
+base64 = lazyImport('base64')
+mimetypes = lazyImport('mimetypes')
+datetime = lazyImport('datetime','datetime')
+timedelta = lazyImport('datetime','timedelta')
+
+DEFAULT_BASE_URL = "https://ai.hackclub.com/proxy/v1"
 
 def load_env():
     env_path = os.path.join(os.path.dirname(__file__), '.env')
@@ -58,93 +86,2108 @@ def print_sep():
     # print separator
     print_c('-' * 80, Colours.DIM)
 
+def msg_text(content):
+    # message content is either a string or a list of parts (attached files, text, images).
+    # attached files carry their own framing, so they go in front as they are
+    if isinstance(content,list):
+        attached = "".join(part['text'] for part in content if part.get('attach'))
+        return attached + prompt_text(content)
+    return content or ""
+
+def prompt_text(content):
+    # what the user typed, without any attached file / workspace text
+    if isinstance(content,list):
+        return " ".join(part.get('text','') for part in content if part.get('type') == 'text' and not part.get('attach'))
+    return content or ""
+
+class attachBlob:
+    __slots__ = ('data','__weakref__')
+
+    def __init__(self,data):
+        self.data = data
+
+attach_blobs = None # sha1 of the data -> attachBlob, weak so deleted chats free their attachments
+
+class attachRef:
+    # an attachment part of a message: an image, or an attached file / workspace text when it
+    # has a name. the data: url or text is kept once in attach_blobs however many messages (or
+    # copies of a chat) hold it. reads like the {"type": "image_url", ...} or
+    # {"type": "text", "text": ..., "attach": name} dict it stands for
+    __slots__ = ('blob','name')
+
+    def __init__(self,data,name=None):
+        global attach_blobs
+        import hashlib,weakref
+        if attach_blobs is None:
+            attach_blobs = weakref.WeakValueDictionary()
+        key = hashlib.sha1(data.encode('utf-8')).digest()
+        blob = attach_blobs.get(key)
+        if blob is None:
+            blob = attach_blobs[key] = attachBlob(data)
+        self.blob = blob
+        self.name = name
+
+    @classmethod
+    def from_part(cls,part):
+        # the attachRef for a stored content part, None for anything else (typed text etc)
+        if not isinstance(part,dict):
+            return None
+        if part.get('type') == 'image_url' and part.keys() == {'type','image_url'} and part['image_url'].keys() == {'url'}:
+            return cls(part['image_url']['url'])
+        if part.get('type') == 'text' and part.keys() == {'type','text','attach'}:
+            return cls(part['text'],part['attach'])
+        return None
+
+    def __getitem__(self,key):
+        if self.name is None:
+            if key == 'type':
+                return 'image_url'
+            if key == 'image_url':
+                return {'url': self.blob.data}
+        else:
+            if key == 'type':
+                return 'text'
+            if key == 'text':
+                return self.blob.data
+            if key == 'attach':
+                return self.name
+        raise KeyError(key)
+
+    def get(self,key,default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __eq__(self,other):
+        if isinstance(other,attachRef):
+            return self.blob is other.blob and self.name == other.name
+        return self.to_json() == other
+
+    __hash__ = None
+
+    def to_json(self):
+        if self.name is None:
+            return {'type': 'image_url','image_url': {'url': self.blob.data}}
+        return {'type': 'text','text': self.blob.data,'attach': self.name}
+
+class chatMsg:
+    # one message of a chat. long histories hold a lot of these, so it's __slots__ rather than
+    # a dict, roles are interned, images are attachRefs, and the lowercased text (search) and
+    # token estimate are worked out once and dropped when the content changes. it reads and
+    # writes like the dict it replaces (msg['role'], msg.get('content'), 'incomplete' in msg,
+    # msg['content'] += ...), and to_json()/from_json() are what goes to disk and the wire
+    __slots__ = ('role','_content','extra','_low','_tokens','wrap')
+
+    def __init__(self,role,content,**extra):
+        self.role = sys.intern(role)
+        self.extra = extra or None # anything else, e.g. incomplete
+        self.content = content
+
+    @property
+    def content(self):
+        return self._content
+
+    @content.setter
+    def content(self,content):
+        if isinstance(content,list):
+            content = [attachRef.from_part(p) or p for p in content]
+        self._content = content
+        self._low = None
+        self._tokens = None
+        self.wrap = None # (width, wrapped lines) for the response pane
+
+    @property
+    def low(self):
+        if self._low is None:
+            self._low = msg_text(self._content).lower()
+        return self._low
+
+    @property
+    def tokens(self):
+        if self._tokens is None:
+            self._tokens = len(msg_text(self._content)) // 4
+        return self._tokens
+
+    def __getitem__(self,key):
+        if key == 'role':
+            return self.role
+        if key == 'content':
+            return self._content
+        if self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def get(self,key,default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self,key):
+        return key in ('role','content') or bool(self.extra) and key in self.extra
+
+    def __setitem__(self,key,val):
+        if key == 'role':
+            self.role = sys.intern(val)
+        elif key == 'content':
+            self.content = val
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = val
+
+    def pop(self,key,default=None):
+        if not self.extra or key not in self.extra:
+            return default
+        val = self.extra.pop(key)
+        if not self.extra:
+            self.extra = None
+        return val
+
+    def __eq__(self,other):
+        if isinstance(other,chatMsg):
+            return self.role == other.role and self._content == other._content and self.extra == other.extra
+        if isinstance(other,dict):
+            return self.to_json() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"chatMsg({self.to_json()!r})"
+
+    def to_json(self):
+        content = self._content
+        if isinstance(content,list):
+            content = [p.to_json() if isinstance(p,attachRef) else p for p in content]
+        rec = {'role': self.role,'content': content}
+        if self.extra:
+            rec.update(self.extra)
+        return rec
+
+    @classmethod
+    def from_json(cls,rec):
+        if isinstance(rec,chatMsg):
+            return rec
+        extra = {key: val for key,val in rec.items() if key not in ('role','content')}
+        return cls(rec.get('role','user'),rec.get('content'),**extra)
+
+def as_msgs(msgs):
+    # stored / imported / posted messages -> chatMsgs, in place so anything holding the list sees it
+    msgs[:] = [chatMsg.from_json(m) for m in msgs]
+    return msgs
+
+def wire_msg(msg):
+    # a message as the API wants it: plain json, without our own bookkeeping fields. attached
+    # files go in front of the typed text in one text part, the way they're framed for the model
+    rec = msg.to_json() if isinstance(msg,chatMsg) else msg
+    content = rec.get('content')
+    if isinstance(content,list):
+        if any(p.get('attach') for p in content):
+            images = [p for p in content if p.get('type') != 'text']
+            text = msg_text(content)
+            rec = dict(rec,content=images + [{"type": "text","text": text}] if images else text)
+    if 'incomplete' in rec or 'route' in rec:
+        rec = {key: val for key,val in rec.items() if key not in ('incomplete','route')}
+    return rec
+
+def json_default(obj):
+    # json.dump(s) hook for anything holding chatMsgs
+    if isinstance(obj,(chatMsg,attachRef)):
+        return obj.to_json()
+    raise TypeError(f"{type(obj).__name__} is not JSON serializable")
+
+def msg_low(msg):
+    return msg.low if isinstance(msg,chatMsg) else msg_text(msg.get('content')).lower()
+
+def chat_title(msgs,limit=30):
+    # first user message, minus any attached file / workspace text in front of it
+    for msg in msgs:
+        if msg['role'] == 'user':
+            text = " ".join(prompt_text(msg.get('content')).split())
+            if not text:
+                return None
+            return text[:limit] + "..." if len(text) > limit else text
+    return None
+
+def data_path(name=''):
+    # chats, history, caches etc live next to main.py unless SHELLLLM_HOME points somewhere else
+    home = os.environ.get('SHELLLLM_HOME') or os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(home,name)
+
+def as_branches(branches):
+    for branch in branches:
+        as_msgs(branch['messages'])
+        as_branches(branch.get('branches',[]))
+    return branches
+
+def fork_chat(chat,at):
+    # keeps chat['messages'][at:] as a side branch before the active path changes from `at` on.
+    # only that tail is stored (the same message objects, not copies): everything before `at`
+    # is shared with every branch, in memory and in chats.json. forks further along that tail
+    # go with it
+    tail = chat['messages'][at:]
+    if not tail:
+        return False
+    branches = chat.get('branches',[])
+    branch = {'at': at,'messages': tail,'base': chat_hash(chat['messages'][:at])[:16]}
+    nested = [b for b in branches if b['at'] > at]
+    if nested:
+        branch['branches'] = nested
+    chat['branches'] = [b for b in branches if b['at'] <= at] + [branch]
+    return True
+
+def branch_fits(chat,branch):
+    # a branch only goes back onto the messages it was forked from (branches stored before
+    # 'base' was kept are only checked for length)
+    msgs = chat.get('messages',[])
+    if branch['at'] > len(msgs):
+        return False
+    return 'base' not in branch or chat_hash(msgs[:branch['at']])[:16] == branch['base']
+
+def drop_stale(chat):
+    # after the messages were cleared or swapped for another list: branches and a summary
+    # of what was there before don't belong to the chat any more
+    msgs = chat.get('messages',[])
+    if not msgs:
+        chat.pop('branches',None)
+        chat.pop('summary',None)
+        return
+    branches = [b for b in chat.get('branches',[]) if branch_fits(chat,b)]
+    if branches:
+        chat['branches'] = branches
+    else:
+        chat.pop('branches',None)
+    summary = chat.get('summary')
+    if summary and apply_summary(msgs,summary) is msgs:
+        chat.pop('summary')
+
+def rebase_branches(branches,path,drop=0,head=()):
+    # after the first `drop` messages of `path` went to cold storage (or `head` came back
+    # in front of it): branch positions and base hashes count from the new start
+    for branch in branches:
+        prefix = path[:branch['at']]
+        branch['at'] += len(head) - drop
+        branch['base'] = chat_hash(list(head) + prefix[drop:])[:16]
+        if branch.get('branches'):
+            rebase_branches(branch['branches'],prefix + branch['messages'],drop,head)
+
+def chat_forks(chat):
+    # message index -> how many versions of the conversation go on from there
+    forks = {}
+    for branch in chat.get('branches',[]):
+        if branch_fits(chat,branch):
+            forks[branch['at']] = forks.get(branch['at'],1) + 1
+    return forks
+
+def switch_branch(chat,at):
+    # swaps the active path from `at` on for the oldest other version there, the current one
+    # goes to the back, so switching again and again cycles through all of them
+    branches = chat.get('branches',[])
+    pick = next((b for b in branches if b['at'] == at and branch_fits(chat,b)),None)
+    if pick is None:
+        return False
+    branches.remove(pick)
+    fork_chat(chat,at)
+    chat['messages'][at:] = pick['messages'] # in place, mainChat holds the same list
+    chat['branches'] = chat['branches'] + pick.get('branches',[])
+    if not chat['branches']:
+        chat.pop('branches')
+    return True
+
+def new_chat_id():
+    return os.urandom(6).hex()
+
+def chat_hash(messages):
+    # content hash of a chat's messages, used to spot duplicates when importing
+    import hashlib
+    blob = json.dumps(messages,sort_keys=True,separators=(',',':'),ensure_ascii=False,default=json_default)
+    return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+def chat_msg_count(chat,role=None):
+    # archived chats only keep their counts in the hot index
+    if chat.get('archived'):
+        stats = chat.get('stats',{})
+        return stats.get(role,0) if role else chat.get('msg_count',0)
+    msgs = chat.get('messages',[])
+    if role:
+        return sum(1 for m in msgs if m['role'] == role)
+    return len(msgs)
+
+# per-thread network timings, filled in by the timed connection classes below
+net_timing = threading.local()
+
+def reset_net_timing():
+    net_timing.tcp = 0.0
+    net_timing.tls = 0.0
+    net_timing.reused = True
+
+def make_session(pool_size=10):
+    # a requests session whose connections record how long dns+tcp and tls took,
+    # so slow requests can be pinned on the network vs the server
+    from urllib3.connection import HTTPConnection, HTTPSConnection
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+    class timedHTTPConn(HTTPConnection):
+        def _new_conn(self):
+            t0 = time.perf_counter()
+            sock = super()._new_conn()
+            net_timing.tcp = getattr(net_timing,'tcp',0.0) + time.perf_counter() - t0
+            net_timing.reused = False
+            return sock
+
+    class timedHTTPSConn(HTTPSConnection):
+        def _new_conn(self):
+            t0 = time.perf_counter()
+            sock = super()._new_conn()
+            net_timing.tcp = getattr(net_timing,'tcp',0.0) + time.perf_counter() - t0
+            net_timing.reused = False
+            return sock
+
+        def connect(self):
+            t0 = time.perf_counter()
+            tcp_before = getattr(net_timing,'tcp',0.0)
+            super().connect()
+            # connect() = _new_conn() + tls handshake
+            tcp_spent = getattr(net_timing,'tcp',0.0) - tcp_before
+            net_timing.tls = getattr(net_timing,'tls',0.0) + time.perf_counter() - t0 - tcp_spent
+
+    class timedHTTPPool(HTTPConnectionPool):
+        ConnectionCls = timedHTTPConn
+
+    class timedHTTPSPool(HTTPSConnectionPool):
+        ConnectionCls = timedHTTPSConn
+
+    class timedAdapter(requests.adapters.HTTPAdapter):
+        def init_poolmanager(self,*args,**kwargs):
+            super().init_poolmanager(*args,**kwargs)
+            self.poolmanager.pool_classes_by_scheme = {'http': timedHTTPPool, 'https': timedHTTPSPool}
+
+    session = requests.Session()
+    session.mount('http://', timedAdapter(pool_maxsize=pool_size))
+    session.mount('https://', timedAdapter(pool_maxsize=pool_size))
+    return session
+
+class traceSpan:
+    def __init__(self,kind,**meta):
+        self.t0 = time.perf_counter()
+        self.rec = {'kind': kind, 'ts': datetime.now().isoformat()}
+        self.rec.update(meta)
+        self.last_chunk = None
+        self.gaps = []
+        self.frames = []
+        self.chunks = 0 # streamed pieces, a few tokens each or one, depending on the server
+        self.done = False
+
+    def elapsed(self):
+        return time.perf_counter() - self.t0
+
+    def mark(self,name):
+        self.rec[name] = round(self.elapsed(),4)
+
+    def chunk(self):
+        now = time.perf_counter()
+        if self.last_chunk is None:
+            self.rec['ttft'] = round(now - self.t0,4)
+        else:
+            self.gaps.append(now - self.last_chunk)
+        self.last_chunk = now
+        self.chunks += 1
+
+    def frame(self,dur):
+        self.frames.append(dur)
+
+    def gen_time(self):
+        # first chunk to last
+        if self.chunks < 2 or 'ttft' not in self.rec:
+            return 0.0
+        return (self.last_chunk - self.t0) - self.rec['ttft']
+
+    def chunk_rate(self):
+        gen_time = self.gen_time()
+        return (self.chunks - 1) / gen_time if gen_time > 0 else 0.0
+
+    def tok_rate(self):
+        # real tokens, only known once the server has reported usage
+        gen_time = self.gen_time()
+        if not self.rec.get('completion_tokens') or gen_time <= 0:
+            return 0.0
+        return self.rec['completion_tokens'] / gen_time
+
+    def finish(self,error=None):
+        self.done = True
+        self.rec['total'] = round(self.elapsed(),4)
+        self.rec['chunks'] = self.chunks
+        self.rec['chunk_s'] = round(self.chunk_rate(),2)
+        if self.tok_rate():
+            self.rec['tok_s'] = round(self.tok_rate(),2)
+        if self.gaps:
+            gaps = sorted(self.gaps)
+            self.rec['gap_mean'] = round(sum(gaps) / len(gaps),4)
+            self.rec['gap_p95'] = round(gaps[int(len(gaps) * 0.95)],4)
+            self.rec['gap_max'] = round(gaps[-1],4)
+        if self.frames:
+            self.rec['frames'] = len(self.frames)
+            self.rec['frame_mean'] = round(sum(self.frames) / len(self.frames),5)
+            self.rec['frame_max'] = round(max(self.frames),5)
+        if error:
+            self.rec['error'] = str(error)
+        return self.rec
+
+class perfTracer:
+    # writes one json line per traced event to a small rotating log (trace.jsonl, trace.jsonl.1, ...)
+    def __init__(self,path=None,max_bytes=512*1024,backups=3):
+        self.path = path or os.environ.get('SHELLLLM_TRACE') or data_path('trace.jsonl')
+        self.enabled = self.path not in ('0','off')
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.cur = None
+        self.last = None
+        self.last_save = None
+        self.ttfts = {} # route -> the last 100 time-to-first-token of replies that went that way
+
+    def begin(self,kind,**meta):
+        span = traceSpan(kind,**meta)
+        if kind == 'stream':
+            self.cur = span
+        return span
+
+    def end(self,span,error=None):
+        if span.done:
+            return
+        rec = span.finish(error)
+        if span is self.cur:
+            self.cur = None
+            self.last = span
+            if 'ttft' in rec:
+                import collections
+                self.ttfts.setdefault(rec.get('route','remote'),collections.deque(maxlen=100)).append(rec['ttft'])
+        self.write(rec)
+
+    def ttft_stats(self,route):
+        # (median, p95, replies) for one route, None before its first reply
+        times = sorted(self.ttfts.get(route,()))
+        if not times:
+            return None
+        return times[len(times) // 2],times[int(len(times) * 0.95)],len(times)
+
+    def frame(self,dur):
+        span = self.cur or self.last
+        if span is not None:
+            span.frame(dur)
+
+    def timed_save(self,dur,size):
+        self.last_save = dur
+        self.write({'kind': 'save', 'ts': datetime.now().isoformat(), 'dur': round(dur,4), 'bytes': size})
+
+    def summary(self):
+        span = self.cur or self.last
+        if span is None:
+            return ""
+        parts = []
+        if span.rec.get('route') == 'local':
+            parts.append("local")
+        if 'ttft' in span.rec:
+            parts.append(f"ttft {span.rec['ttft']:.2f}s")
+        elif not span.done:
+            parts.append(f"waiting {span.elapsed():.1f}s")
+        if span.tok_rate():
+            parts.append(f"{span.tok_rate():.0f} tok/s")
+        elif span.chunk_rate():
+            parts.append(f"{span.chunk_rate():.0f} chunks/s")
+        if span.rec.get('prompt_tokens'):
+            parts.append(f"cached {span.rec.get('cached_tokens',0)}/{span.rec['prompt_tokens']}")
+        if span.frames:
+            parts.append(f"draw {max(span.frames) * 1000:.0f}ms")
+        if self.last_save is not None:
+            parts.append(f"save {self.last_save * 1000:.0f}ms")
+        return " | ".join(parts)
+
+    def rotate(self):
+        for i in range(self.backups - 1,0,-1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src,f"{self.path}.{i+1}")
+        os.replace(self.path,f"{self.path}.1")
+
+    def write(self,rec):
+        if not self.enabled:
+            return
+        try:
+            if os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+                self.rotate()
+            with open(self.path,'a') as f:
+                f.write(json.dumps(rec) + "\n")
+        except OSError:
+            pass # read-only fs etc, tracing is best effort
+
+def provider_caps(base_url,model):
+    # what the endpoint/model can do beyond plain chat completions. guessed from the model
+    # name, and overridable with SHELLLLM_CAPS, e.g. "cache_control=1,usage=0"
+    name = model.lower()
+    caps = {
+        'usage': True, # stream_options.include_usage, gives us cached token counts
+        'cache_control': name.startswith(('anthropic/','google/gemini')) or 'claude' in name,
+        'cache_key': name.startswith('openai/') or 'api.openai.com' in base_url,
+        'responses': False # POST /responses with previous_response_id, opt in only
+    }
+    for item in os.environ.get('SHELLLLM_CAPS','').split(','):
+        if '=' in item:
+            key,val = item.split('=',1)
+            caps[key.strip()] = val.strip().lower() in ('1','true','yes','on')
+    return caps
+
+class modelCatalog:
+    # the endpoint's /models list with what we care about per model (context length, image
+    # input, pricing), fetched in the background and cached in models.json for a day
+    # (SHELLLLM_MODELS_TTL seconds). anything unknown is None, so a missing catalogue
+    # never blocks a request. start() only reads the cache, the network refresh() is left
+    # until after first paint so startup doesn't pull in requests
+    def __init__(self,api_key,base_url,path=None,ttl=None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.path = path or data_path('models.json')
+        self.ttl = ttl if ttl is not None else float(os.environ.get('SHELLLLM_MODELS_TTL','86400'))
+        self.models = {}
+        self.fetched = 0
+        self.cached = threading.Event() # models.json has been read
+        self.loaded = threading.Event() # ... and refreshed from the endpoint if it was stale
+        self.refreshing = False
+
+    def start(self):
+        threading.Thread(target=self.load,name='shellLLM-models',daemon=True).start()
+
+    def load(self):
+        try:
+            with open(self.path,'r',encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached.get('base_url') == self.base_url:
+                self.models = cached.get('models',{})
+                self.fetched = cached.get('fetched',0)
+        except (OSError,ValueError):
+            pass
+        finally:
+            self.cached.set()
+
+    def refresh(self):
+        # once, in the background: fetch /models if the cache is missing or stale
+        if self.refreshing:
+            return
+        self.refreshing = True
+        threading.Thread(target=self._refresh,name='shellLLM-models',daemon=True).start()
+
+    def _refresh(self):
+        try:
+            self.cached.wait()
+            if time.time() - self.fetched >= self.ttl:
+                self.fetch()
+        except Exception:
+            pass # keep whatever the cache had
+        finally:
+            self.loaded.set()
+
+    def fetch(self):
+        res = requests.get(f"{self.base_url}/models",headers={"Authorization": f"Bearer {self.api_key}"},timeout=10)
+        res.raise_for_status()
+        models = {}
+        for entry in res.json().get('data',[]):
+            arch = entry.get('architecture') or {}
+            inputs = arch.get('input_modalities') or []
+            if inputs:
+                vision = 'image' in inputs
+            elif arch.get('modality'):
+                vision = 'image' in arch['modality'].split('->')[0]
+            else:
+                vision = None
+            pricing = entry.get('pricing') or {}
+            params = entry.get('supported_parameters')
+            models[entry['id']] = {
+                'context': entry.get('context_length') or (entry.get('top_provider') or {}).get('context_length'),
+                'vision': vision,
+                'tools': 'tools' in params if params else None,
+                'pricing': {k: pricing[k] for k in ('prompt','completion') if k in pricing}
+            }
+        self.models = models
+        self.fetched = time.time()
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path,'w',encoding='utf-8') as f:
+            json.dump({'base_url': self.base_url,'fetched': self.fetched,'models': models},f)
+        os.replace(tmp_path,self.path)
+
+    def get(self,model):
+        return self.models.get(model) or {}
+
+    def context(self,model):
+        return self.get(model).get('context')
+
+    def vision(self,model):
+        return self.get(model).get('vision')
+
+    def tools(self,model):
+        return self.get(model).get('tools')
+
+    def match(self,query,limit=10):
+        # fuzzy: the query's characters have to appear in order. runs of consecutive
+        # characters and matches at the start of a name part score higher
+        query = query.lower().replace(' ','')
+        if not query:
+            return sorted(self.models)[:limit]
+        scored = []
+        for name in self.models:
+            low = name.lower()
+            pos = -1
+            score = 0
+            for ch in query:
+                nxt = low.find(ch,pos + 1)
+                if nxt == -1:
+                    break
+                if nxt == pos + 1:
+                    score += 3
+                if nxt == 0 or low[nxt - 1] in '/-_.:':
+                    score += 2
+                score -= min(nxt - pos - 1,5) * 0.1
+                pos = nxt
+            else:
+                if query in low:
+                    score += 10
+                scored.append((-score,len(name),name))
+        return [name for _,_,name in sorted(scored)[:limit]]
+
+def is_local_url(url):
+    from urllib.parse import urlparse
+    return (urlparse(url).hostname or '') in ('localhost','127.0.0.1','::1')
+
+class localBackend:
+    # an OpenAI compatible server on this machine (llama.cpp's llama-server, ollama, lm studio, ...).
+    # SHELLLLM_LOCAL_URL points at one, otherwise the usual ports are tried. it needs no api key
+    # (SHELLLLM_LOCAL_KEY if yours checks one). SHELLLLM_LOCAL picks what goes there: auto (short
+    # plain prompts, see wants()), always, or off. SHELLLLM_LOCAL_MODEL, otherwise the first model it lists
+    default_urls = ('http://127.0.0.1:8080/v1','http://127.0.0.1:11434/v1','http://127.0.0.1:1234/v1')
+
+    def __init__(self,urls=None,model=None):
+        url = os.environ.get('SHELLLLM_LOCAL_URL')
+        self.urls = urls or ([url.rstrip('/')] if url else list(self.default_urls))
+        self.model = model or os.environ.get('SHELLLLM_LOCAL_MODEL')
+        self.mode = os.environ.get('SHELLLLM_LOCAL','auto').lower()
+        self.api_key = os.environ.get('SHELLLLM_LOCAL_KEY','local')
+        self.max_chars = int(os.environ.get('SHELLLLM_LOCAL_MAX_CHARS','400'))
+        self.max_tokens = int(os.environ.get('SHELLLLM_LOCAL_CTX','4096')) # history it's given, in rough tokens
+        self.base_url = None
+        self.models = []
+        self.ready = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self.detect,name='shellLLM-local',daemon=True).start()
+
+    def detect(self):
+        # the first url whose /models answers quickly wins
+        try:
+            for url in self.urls:
+                try:
+                    res = requests.get(f"{url}/models",headers={"Authorization": f"Bearer {self.api_key}"},timeout=0.5)
+                    res.raise_for_status()
+                    models = [entry['id'] for entry in res.json().get('data',[]) if entry.get('id')]
+                except Exception:
+                    continue
+                if models or self.model:
+                    self.models = models
+                    self.model = self.model or models[0]
+                    self.base_url = url
+                    return
+        finally:
+            self.ready.set()
+
+    def available(self):
+        return self.mode != 'off' and self.base_url is not None
+
+    def wants(self,prompt,history_tokens):
+        # a short prompt with no files, images or code in it, and a history that fits a small
+        # local context: quicker to start locally than to go over the network
+        if self.mode == 'always':
+            return True
+        if not isinstance(prompt,str) or len(prompt) > self.max_chars or '```' in prompt:
+            return False
+        return history_tokens <= self.max_tokens
+
+def fit_context(msgs,limit):
+    # drop the oldest turns (a pinned summary stays) until the rough token count fits
+    if not limit or est_tokens(msgs) <= limit:
+        return msgs
+    head = msgs[:1] if msgs and msgs[0]['role'] == 'system' else []
+    rest = msgs[len(head):]
+    budget = limit - est_tokens(head)
+    total = est_tokens(rest)
+    start = 0
+    while start < len(rest) - 1 and total > budget:
+        total -= est_tokens(rest[start:start + 1])
+        start += 1
+    while start < len(rest) - 1 and rest[start]['role'] == 'tool':
+        # a tool result without the assistant turn that asked for it is rejected
+        start += 1
+    return head + rest[start:]
+
+def stream_timeouts():
+    # seconds to wait for the connection, for the first line of the reply, and between lines
+    # after that. overridable with SHELLLLM_TIMEOUTS, e.g. "connect=5,first_token=120,stall=20"
+    timeouts = {'connect': 10.0, 'first_token': 90.0, 'stall': 30.0}
+    for item in os.environ.get('SHELLLLM_TIMEOUTS','').split(','):
+        if '=' in item:
+            key,val = item.split('=',1)
+            try:
+                timeouts[key.strip()] = float(val)
+            except ValueError:
+                pass
+    return timeouts
+
+def est_tokens(msgs):
+    # rough token count, ~4 characters per token
+    return sum(m.tokens if isinstance(m,chatMsg) else len(msg_text(m.get('content'))) // 4 for m in msgs)
+
+def apply_summary(msgs,summary):
+    # swap the turns a summary covers for the summary itself, as long as those turns
+    # are still exactly what was summarised
+    if not summary or summary['upto'] > len(msgs) or chat_hash(msgs[:summary['upto']]) != summary['hash']:
+        return msgs
+    pinned = {"role": "system", "content": f"summary of the earlier conversation:\n{summary['content']}"}
+    return [pinned] + msgs[summary['upto']:]
+
+def unfold(msgs,summary):
+    # a copy of the messages taken before the last fold still starts with the turns that
+    # went to cold storage, drop them so they aren't there twice
+    cut = (summary or {}).get('cut')
+    if cut and len(msgs) >= cut['n'] and chat_hash(msgs[:cut['n']])[:16] == cut['hash']:
+        return msgs[cut['n']:]
+    return msgs
+
+class chatCompactor:
+    # background worker that summarises the older turns of long chats with a cheap model.
+    # the summarised turns move out of chats.json into cold storage (chatMgr.cold),
+    # requests send summary + recent turns
+    prompt = ("summarise the conversation below so it can replace the original messages as context "
+              "for the rest of the chat. keep facts, decisions, names, code and open questions, drop pleasantries. "
+              "write it as concise notes.")
+
+    def __init__(self,chat_mgr,api_key,base_url,threshold=None,model=None,keep=6,tracer=None,session=None):
+        self.chat_mgr = chat_mgr
+        self.api_key = api_key
+        self.base_url = base_url
+        self.threshold = threshold if threshold is not None else int(os.environ.get('SHELLLLM_COMPACT_AT','0'))
+        self.model = model or os.environ.get('SHELLLLM_SUMMARY_MODEL','openai/gpt-5-mini')
+        self.keep = keep
+        self.tracer = tracer
+        self.session = session
+        self.pending = set()
+        self.done = []
+        self.queue = None
+
+    def consider(self,chat,force=False):
+        if (self.threshold <= 0 and not force) or chat['id'] in self.pending:
+            return False
+        msgs = chat.get('messages',[])
+        if not force and est_tokens(apply_summary(msgs,chat.get('summary'))) < self.threshold:
+            return False
+        if self.queue is None:
+            import queue
+            self.queue = queue.Queue()
+            threading.Thread(target=self.run,name='shellLLM-compactor',daemon=True).start()
+        self.pending.add(chat['id'])
+        self.queue.put(chat['id'])
+        return True
+
+    def run(self):
+        while True:
+            chat_id = self.queue.get()
+            try:
+                self.compact(chat_id)
+            except Exception:
+                pass # it'll be retried next time the chat grows
+            finally:
+                self.pending.discard(chat_id)
+
+    def compact(self,chat_id):
+        idx,chat = self.chat_mgr.find_chat(chat_id)
+        if chat is None:
+            return
+        msgs = list(chat.get('messages',[]))
+        summary = chat.get('summary')
+        start = summary['upto'] if apply_summary(msgs,summary) is not msgs else 0
+        upto = len(msgs) - self.keep
+        if upto - start < 2:
+            return
+        lines = []
+        if apply_summary(msgs,summary) is not msgs:
+            lines.append(f"(earlier summary)\n{summary['content']}")
+        for msg in msgs[start:upto]:
+            lines.append(f"{msg['role']}: {msg_text(msg.get('content'))}")
+        request = f"{self.prompt}\n\n" + "\n\n".join(lines)
+        worker = mainChat(self.api_key,self.base_url,self.model,tracer=self.tracer,session=self.session)
+        worker.background = True
+        while True:
+            worker.engine.wait_idle()
+            worker.convo_history = [{"role": "user", "content": request}]
+            text = ""
+            gen = worker._stream_res()
+            interrupted = False
+            try:
+                for chunk in gen:
+                    text += chunk
+                    if worker.engine.busy():
+                        interrupted = True # the user started a request, back off and retry after
+                        break
+            finally:
+                gen.close()
+            if not interrupted:
+                break
+        if text.strip():
+            self.chat_mgr.set_summary(chat,{'content': text.strip(), 'upto': upto, 'hash': chat_hash(msgs[:upto]), 'model': self.model, 'timestamp': datetime.now().isoformat()})
+            self.done.append(chat_id)
+
+class chatTitler:
+    # background worker that names a chat with a cheap model once it has its first reply.
+    # off unless SHELLLLM_TITLE_MODEL is set, until then chats keep the first-message title
+    prompt = ("write a short title (at most 6 words) for the conversation below. reply with the title only, "
+              "no quotes or trailing punctuation.")
+
+    def __init__(self,chat_mgr,api_key,base_url,model=None,tracer=None,session=None):
+        self.chat_mgr = chat_mgr
+        self.api_key = api_key
+        self.base_url = base_url
+        self.model = model if model is not None else os.environ.get('SHELLLLM_TITLE_MODEL','')
+        self.tracer = tracer
+        self.session = session
+        self.pending = set()
+        self.done = []
+        self.queue = None
+
+    def consider(self,chat):
+        if not self.model or chat.get('titled') != 'first message' or chat['id'] in self.pending:
+            return False
+        if not any(msg['role'] == 'assistant' for msg in chat.get('messages',[])):
+            return False
+        if self.queue is None:
+            import queue
+            self.queue = queue.Queue()
+            threading.Thread(target=self.run,name='shellLLM-titler',daemon=True).start()
+        self.pending.add(chat['id'])
+        self.queue.put(chat['id'])
+        return True
+
+    def run(self):
+        while True:
+            chat_id = self.queue.get()
+            try:
+                self.name(chat_id)
+            except Exception:
+                pass # keeps the first-message title
+            finally:
+                self.pending.discard(chat_id)
+
+    def name(self,chat_id):
+        idx,chat = self.chat_mgr.find_chat(chat_id)
+        if chat is None:
+            return
+        lines = []
+        for msg in chat.get('messages',[])[:2]:
+            lines.append(f"{msg['role']}: {msg_text(msg.get('content'))[:1500]}")
+        worker = mainChat(self.api_key,self.base_url,self.model,tracer=self.tracer,session=self.session)
+        worker.background = True
+        worker.engine.wait_idle()
+        worker.convo_history = [{"role": "user", "content": f"{self.prompt}\n\n" + "\n\n".join(lines)}]
+        title = " ".join(worker._get_res().split()).strip('"\'. ')
+        if title and chat.get('titled') == 'first message':
+            self.chat_mgr.set_title(chat,title[:60])
+            self.done.append(chat_id)
+
+def responses_input(msgs):
+    # chat completions messages -> responses API input items
+    items = []
+    for msg in msgs:
+        content = wire_msg(msg)['content']
+        if isinstance(content,list):
+            parts = []
+            for part in content:
+                if part.get('type') == 'text':
+                    parts.append({"type": "input_text", "text": part['text']})
+                elif part.get('type') == 'image_url':
+                    parts.append({"type": "input_image", "image_url": part['image_url']['url']})
+            content = parts
+        items.append({"role": msg['role'], "content": content})
+    return items
+
+def header_wait(value):
+    # seconds to wait according to a Retry-After / x-ratelimit-reset style header: plain
+    # seconds, durations like "6m0s" or "20ms", an epoch time (s or ms) or an HTTP date
+    import re
+    value = value.strip()
+    try:
+        num = float(value)
+    except ValueError:
+        num = None
+    if num is not None:
+        if num > 1e12:
+            return max(0.0,num / 1000 - time.time())
+        if num > 1e9:
+            return max(0.0,num - time.time())
+        return max(0.0,num)
+    parts = re.findall(r'([\d.]+)(ms|h|m|s)',value)
+    if parts and "".join(a + b for a,b in parts) == value:
+        scale = {'ms': 0.001,'s': 1,'m': 60,'h': 3600}
+        return sum(float(a) * scale[b] for a,b in parts)
+    try:
+        from email.utils import parsedate_to_datetime
+        return max(0.0,parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError,ValueError):
+        return None
+
+class requestGate:
+    # sits in front of every POST on the engine loop: at most max_streams at once, a token
+    # bucket for the request rate, and a pause whenever the server says to back off.
+    # waiting requests go out in priority order, so the user's own turns get ahead of
+    # background work like summaries. only touched from the engine loop, so no locking
+    def __init__(self,max_streams,per_min=None,burst=5):
+        self.max_streams = max_streams
+        self.max_rate = (per_min or float(os.environ.get('SHELLLLM_RATE_LIMIT','60'))) / 60
+        self.ceiling = self.max_rate
+        self.rate = self.max_rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.stamp = time.monotonic()
+        self.active = 0
+        self.paused_until = 0.0
+        self.strikes = 0
+        self.waiting = [] # heap of (priority, seq, future)
+        self.seq = 0
+        self.timer = None
+
+    async def acquire(self,priority=0):
+        import asyncio, heapq
+        fut = asyncio.get_running_loop().create_future()
+        self.seq += 1
+        heapq.heappush(self.waiting,(priority,self.seq,fut))
+        self.pump()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release() # got the slot just as we were cancelled
+            raise
+
+    def release(self):
+        self.active -= 1
+        self.pump()
+
+    def pump(self):
+        import asyncio, heapq
+        if self.timer is not None:
+            self.timer.cancel() # one wake-up at a time, armed again below if it's still needed
+            self.timer = None
+        now = time.monotonic()
+        self.tokens = min(self.burst,self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        while self.waiting and self.active < self.max_streams:
+            if self.waiting[0][2].done(): # cancelled while waiting
+                heapq.heappop(self.waiting)
+                continue
+            wait = max(self.paused_until - now,(1 - self.tokens) / self.rate if self.tokens < 1 else 0)
+            if wait > 0:
+                self.timer = asyncio.get_running_loop().call_later(wait,self.pump)
+                return
+            fut = heapq.heappop(self.waiting)[2]
+            self.tokens -= 1
+            self.active += 1
+            fut.set_result(None)
+
+    def note(self,status,headers):
+        # adapt to what the server told us: Retry-After on 429/503, x-ratelimit-* on anything
+        wait = None
+        if status in (429,503) and headers.get('retry-after'):
+            wait = header_wait(headers['retry-after'])
+        remaining = headers.get('x-ratelimit-remaining-requests',headers.get('x-ratelimit-remaining'))
+        reset = headers.get('x-ratelimit-reset-requests',headers.get('x-ratelimit-reset'))
+        if wait is None and reset and remaining is not None and remaining.strip() in ('0','0.0'):
+            wait = header_wait(reset)
+        limit = headers.get('x-ratelimit-limit-requests')
+        if limit:
+            try:
+                self.ceiling = min(self.max_rate,float(limit) / 60)
+                self.rate = min(self.rate,self.ceiling)
+            except ValueError:
+                pass
+        if status == 429:
+            self.rate = max(0.05,self.rate / 2)
+            if wait is None:
+                wait = min(60,2 ** self.strikes)
+            self.strikes += 1
+        elif status < 400:
+            self.strikes = 0
+            self.rate = min(self.ceiling,self.rate * 1.1)
+        if wait:
+            self.paused_until = max(self.paused_until,time.monotonic() + wait)
+
+class chatEngine:
+    # one asyncio loop on a background thread that every mainChat streams through. the sync API
+    # (send_msg etc) and the async one (asend_msg etc) both end up here, so limits and
+    # cancellation behave the same for the TUI and for anything embedding shellLLM
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self,max_streams=None):
+        self.max_streams = max_streams or int(os.environ.get('SHELLLLM_MAX_STREAMS','4'))
+        self._loop = None
+        self.gate = None
+        self.tape = None # sessionRecorder / sessionReplay
+        self._lock = threading.Lock()
+        self.interactive = 0
+        self.idle = threading.Condition()
+
+    def stream_started(self,background):
+        if not background:
+            with self.idle:
+                self.interactive += 1
+
+    def stream_ended(self,background):
+        if not background:
+            with self.idle:
+                self.interactive -= 1
+                self.idle.notify_all()
+
+    def wait_idle(self):
+        # blocks background work while one of the user's own requests is streaming
+        with self.idle:
+            self.idle.wait_for(lambda: self.interactive == 0)
+
+    def busy(self):
+        return self.interactive > 0
+
+    @classmethod
+    def shared(cls):
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    @property
+    def loop(self):
+        with self._lock:
+            if self._loop is None:
+                import asyncio
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever,name='shellLLM-engine',daemon=True).start()
+            return self._loop
+
+    @staticmethod
+    async def _next(agen,running):
+        import asyncio
+        running[:] = [asyncio.current_task()]
+        return await agen.__anext__()
+
+    @staticmethod
+    async def _close(agen,running):
+        # cancels a pending __anext__ and lets it unwind here on the engine loop before the
+        # generator is closed, aclose() on a generator that's still running raises. cancelling
+        # the caller's future isn't enough for that: it's marked cancelled straight away
+        import asyncio
+        task = running[0] if running else None
+        if task is not None and not task.done():
+            task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError,StopAsyncIteration,Exception):
+                pass
+        await agen.aclose()
+
+    def run(self,coro,timeout=None):
+        import asyncio
+        return asyncio.run_coroutine_threadsafe(coro,self.loop).result(timeout)
+
+    def iter_sync(self,agen):
+        # drives an async generator on the engine loop from plain sync code. closing
+        # this generator (or ctrl+c while waiting) cancels the stream straight away
+        import asyncio
+        running = []
+        try:
+            while True:
+                try:
+                    chunk = asyncio.run_coroutine_threadsafe(self._next(agen,running),self.loop).result()
+                except StopAsyncIteration:
+                    return
+                yield chunk
+        finally:
+            self.run(self._close(agen,running),timeout=5)
+
+    async def aiter(self,agen):
+        # same idea as iter_sync but for callers running their own event loop
+        import asyncio
+        if asyncio.get_running_loop() is self.loop:
+            async for chunk in agen:
+                yield chunk
+            return
+        running = []
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self._next(agen,running),self.loop))
+                except StopAsyncIteration:
+                    return
+                yield chunk
+        finally:
+            await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self._close(agen,running),self.loop))
+
+    async def post_lines(self,session,url,headers,data,span,timeouts=None,background=False,retries=3):
+        # POSTs on a worker thread and yields the decoded non-empty response lines.
+        # cancelling the consumer closes the response (and its socket) immediately
+        # instead of leaving it for the GC. raises TimeoutError if the first line or
+        # the next one takes longer than the first_token/stall timeout. requests wait
+        # their turn at the gate, and a 429/503 is retried once the server allows it
+        import asyncio
+        tape = self.tape
+        if tape is not None and tape.replaying:
+            async for line in tape.play(span,background):
+                yield line
+            return
+        loop = asyncio.get_running_loop()
+        if self.gate is None:
+            self.gate = requestGate(self.max_streams)
+        timeouts = timeouts or stream_timeouts()
+
+        def do_post():
+            reset_net_timing()
+            res = session.post(url, headers=headers, json=data, stream=True, timeout=(timeouts['connect'],timeouts['first_token']))
+            return res,net_timing.tcp,net_timing.tls,net_timing.reused
+
+        attempt = 0
+        while True:
+            await self.gate.acquire(1 if background else 0)
+            post_fut = loop.run_in_executor(None,do_post)
+            try:
+                res,tcp,tls,reused = await asyncio.shield(post_fut)
+            except asyncio.CancelledError:
+                # the request is still in flight on the worker thread, close it when it lands
+                post_fut.add_done_callback(lambda f: f.exception() is None and f.result()[0].close())
+                self.gate.release()
+                raise
+            except BaseException:
+                self.gate.release()
+                raise
+            self.gate.note(res.status_code,res.headers)
+            if res.status_code in (429,503) and attempt < retries:
+                res.close()
+                self.gate.release()
+                attempt += 1
+                span.rec['retries'] = attempt
+                continue
+            break
+        rec_id = None
+        try:
+            # ttfb = time until response headers, whatever isn't dns/tcp/tls is the server queueing
+            span.mark('ttfb')
+            span.rec['tcp'] = round(tcp,4)
+            span.rec['tls'] = round(tls,4)
+            span.rec['wait'] = round(max(0.0,span.rec['ttfb'] - tcp - tls),4)
+            span.rec['reused'] = reused
+            span.rec['status'] = res.status_code
+            if tape is not None:
+                rec_id = tape.stream_begin(background,res.status_code,span.rec['ttfb'])
+            if res.status_code == 429:
+                raise requests.exceptions.HTTPError(f"rate limited by the server (429), gave up after {attempt} retries",response=res)
+            res.raise_for_status()
+            lines = res.iter_lines()
+            wait,what = timeouts['first_token'],"first token"
+            while True:
+                try:
+                    line = await asyncio.wait_for(loop.run_in_executor(None,next,lines,None),wait)
+                except asyncio.TimeoutError:
+                    raise TimeoutError(f"no {what} for {wait:g}s") from None
+                if line is None:
+                    break
+                if line:
+                    wait,what = timeouts['stall'],"data"
+                    line = line.decode('utf-8')
+                    if rec_id is not None:
+                        tape.stream_line(rec_id,span.elapsed(),line)
+                    yield line
+        except Exception as e:
+            if rec_id is not None:
+                tape.stream_error(rec_id,e)
+            raise
+        finally:
+            res.close()
+            self.gate.release()
+
+class sessionProfiler:
+    # cProfile + tracemalloc for a whole session, turned on with --profile or ::profile.
+    # replies stream on the engine loop thread, which gets a profiler of its own (merged
+    # into the report) unless this python's cProfile already sees every thread (3.12+)
+    hot_paths = ('draw_res','perf_search','save_chats','main_tui','_astream_res','_astream_round','_arun_tools','post_lines',r'\(loads\)')
+
+    def __init__(self,out_dir=None):
+        self.out_dir = out_dir or data_path()
+        self.prof = None
+        self.engine_prof = None
+        self.active = False
+        self.snap0 = None
+        self.census0 = None
+        self.chat = None
+        self.chat_mgr = None
+        self.reports = []
+
+    def attach(self,chat,chat_mgr):
+        self.chat = chat
+        self.chat_mgr = chat_mgr
+        if self.active and self.census0 is None:
+            self.census0 = self.census()
+
+    def start(self):
+        import cProfile
+        import tracemalloc
+        if self.active:
+            return
+        self.prof = cProfile.Profile()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+        self.snap0 = tracemalloc.take_snapshot()
+        self.census0 = self.census() if self.chat else None
+        self.active = True
+        self.prof.enable()
+
+        def enable():
+            prof = cProfile.Profile()
+            try:
+                prof.enable()
+            except ValueError:
+                return None # one profiler at a time, and the one above covers this thread
+            return prof
+        self.engine_prof = self.on_engine(enable)
+
+    def on_engine(self,fn):
+        # runs fn on the engine loop thread and returns what it returned
+        done = threading.Event()
+        out = []
+
+        def call():
+            try:
+                out.append(fn())
+            finally:
+                done.set()
+        chatEngine.shared().loop.call_soon_threadsafe(call)
+        done.wait(5)
+        return out[0] if out else None
+
+    def stop(self):
+        if not self.active:
+            return None
+        import tracemalloc
+        self.prof.disable()
+        if self.engine_prof is not None:
+            self.on_engine(self.engine_prof.disable)
+        self.active = False
+        snap1 = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        path = self.dump(snap1)
+        self.snap0 = None
+        self.census0 = None
+        return path
+
+    def census(self):
+        # rough sizes of the structures we usually suspect when memory grows
+        def b64_bytes(msgs):
+            total = 0
+            for msg in msgs:
+                if isinstance(msg.get('content'),list):
+                    for part in msg['content']:
+                        if part.get('type') == 'image_url':
+                            total += len(part['image_url']['url'])
+            return total
+        hist = self.chat.convo_history if self.chat else []
+        chats = self.chat_mgr.chats if self.chat_mgr else []
+        return {
+            'convo_history messages': len(hist),
+            'convo_history json bytes': len(json.dumps(hist,default=json_default)),
+            'chats': len(chats),
+            'chats json bytes': len(json.dumps(chats,default=json_default)),
+            'base64 bytes in chats': sum(b64_bytes(c.get('messages',[])) for c in chats),
+            'attachment bytes held (deduplicated)': sum(len(blob.data) for blob in list((attach_blobs or {}).values())),
+            'base64 bytes in attachments': sum(len(f['content']) for f in (self.chat.attached_files if self.chat else []) if f['type'] == 'image')
+        }
+
+    def dump(self,snap1):
+        import io
+        import pstats
+        out = io.StringIO()
+        out.write(f"shellLLM profile - {datetime.now().isoformat()}\n\n")
+        out.write("== hot paths (cumulative) ==\n")
+        stats = pstats.Stats(self.prof,stream=out)
+        if self.engine_prof is not None:
+            stats.add(self.engine_prof)
+            self.engine_prof = None
+        stats.sort_stats('cumulative').print_stats('|'.join(self.hot_paths))
+        out.write("== top 25 by own time ==\n")
+        stats.sort_stats('tottime').print_stats(25)
+        out.write("== heap growth by line (top 20) ==\n")
+        for stat in snap1.compare_to(self.snap0,'lineno')[:20]:
+            out.write(f"{stat}\n")
+        if self.chat:
+            out.write("\n== structure sizes (start -> end) ==\n")
+            before = self.census0 or {}
+            for key,val in self.census().items():
+                was = before.get(key)
+                grew = f" (+{val - was})" if was is not None and val > was else ""
+                out.write(f"{key}: {was if was is not None else '?'} -> {val}{grew}\n")
+        path = os.path.join(self.out_dir,f"profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}.txt")
+        try:
+            with open(path,'w') as f:
+                f.write(out.getvalue())
+        except OSError:
+            import tempfile
+            path = os.path.join(tempfile.gettempdir(),os.path.basename(path))
+            with open(path,'w') as f:
+                f.write(out.getvalue())
+        self.reports.append(path)
+        return path
+
+class tapeWin:
+    # a curses window that also writes every key it hands out to the session tape
+    def __init__(self,win,tape):
+        self._win = win
+        self._tape = tape
+
+    def __getattr__(self,name):
+        return getattr(self._win,name)
+
+    def getch(self,*args):
+        ch = self._win.getch(*args)
+        if ch != -1:
+            self._tape.key(ch)
+        return ch
+
+class sessionRecorder:
+    # --record FILE: a jsonl tape of the keys you press and every streamed reply with its timing,
+    # plus the chats / prompt history / settings the session started from, so `main.py replay FILE`
+    # can play it back offline
+    replaying = False
+    env_skip = ('SHELLLLM_HOME','SHELLLLM_TRACE','SHELLLLM_HISTORY','SHELLLLM_WORKSPACE','SHELLLLM_TOOLS','SHELLLLM_EMBED_MODEL')
+
+    def __init__(self,path):
+        self.path = path
+        self.f = open(path,'w',encoding='utf-8')
+        self.lock = threading.Lock()
+        self.t0 = time.perf_counter()
+        self.skip = 0
+        self.streams = 0
+
+    def write(self,rec):
+        with self.lock:
+            if not self.f.closed:
+                self.f.write(json.dumps(rec) + "\n")
+                self.f.flush()
+
+    def close(self):
+        with self.lock:
+            self.f.close()
+
+    def wrap(self,win):
+        return tapeWin(win,self)
+
+    def begin(self,ui):
+        # waits for the chats (and briefly the model list) so the snapshot is what you actually saw
+        ui.chat_mgr.wait_loaded()
+        ui.chat.catalog.loaded.wait(10)
+        ui.history.load()
+        env = {key: val for key,val in os.environ.items() if key.startswith('SHELLLLM_') and key not in self.env_skip}
+        with ui.chat_mgr.save_lock:
+            snap = json.loads(json.dumps({'chats': ui.chat_mgr.chats,'current': ui.chat_mgr.cur_chat_idx},default=json_default))
+        self.write({'tape': 1,'size': [ui.height,ui.width],'env': env,
+                    'chats': snap['chats'],'current': snap['current'],
+                    'history': list(ui.history.items or ()),'models': ui.chat.catalog.models})
+        self.t0 = time.perf_counter()
+
+    def key(self,ch):
+        if self.skip:
+            self.skip -= 1 # pushed back with ungetch, it's already on the tape
+            return
+        self.write({'t': round(time.perf_counter() - self.t0,4),'k': ch})
+
+    def unkey(self,ch):
+        self.skip += 1
+
+    def stream_begin(self,background,status,ttfb):
+        with self.lock:
+            self.streams += 1
+            n = self.streams
+        self.write({'s': n,'bg': background,'status': status,'ttfb': ttfb})
+        return n
+
+    def stream_line(self,n,dt,line):
+        self.write({'s': n,'dt': round(dt,4),'l': line})
+
+    def stream_error(self,n,e):
+        self.write({'s': n,'err': str(e),'etype': type(e).__name__})
+
+class sessionReplay:
+    # plays a --record tape back: keys come off the tape (at their recorded times, scaled by speed,
+    # 0 = as fast as possible) into a virtualScreen, and replies stream from the tape instead of the
+    # network, in the order they were asked for. the UI runs for real against a throwaway copy of
+    # the recorded chats, so its timing is what gets measured
+    replaying = True
+
+    def __init__(self,path,speed=1.0):
+        self.speed = speed
+        self.header = None
+        self.keys = []
+        self.streams = {False: [],True: []} # background? -> recorded replies in order
+        by_id = {}
+        with open(path,'r',encoding='utf-8') as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue # recording cut off mid-line
+                if 'tape' in rec:
+                    self.header = rec
+                elif 'k' in rec:
+                    self.keys.append((rec['t'],rec['k']))
+                elif 'status' in rec:
+                    by_id[rec['s']] = {'status': rec['status'],'ttfb': rec.get('ttfb') or 0.0,'lines': [],'err': None}
+                    self.streams[bool(rec.get('bg'))].append(by_id[rec['s']])
+                elif rec.get('s') in by_id:
+                    if 'err' in rec:
+                        by_id[rec['s']]['err'] = (rec.get('etype'),rec['err'])
+                    else:
+                        by_id[rec['s']]['lines'].append((rec['dt'],rec['l']))
+        if self.header is None:
+            raise ValueError(f"{path} is not a shellLLM session tape")
+        self.pos = 0
+        self.pushback = []
+        self.t0 = None
+        self.handed = None
+        self.latencies = []
+        self.played = {False: 0,True: 0}
+        self.missing = 0
+
+    def wrap(self,win):
+        return win
+
+    def begin(self,ui):
+        self.t0 = time.perf_counter()
+
+    def unkey(self,ch):
+        pass
+
+    def seed_catalog(self,catalog):
+        catalog.models = self.header.get('models') or {}
+        catalog.refreshing = True # nothing to fetch in a replay
+        catalog.cached.set()
+        catalog.loaded.set()
+
+    def next_key(self,delay):
+        # getch() for the virtual screen; delay is the window's timeout in ms (-1 blocks).
+        # the gap between handing out a key and the UI asking for the next one is its handling time
+        now = time.perf_counter()
+        if self.handed is not None:
+            self.latencies.append(now - self.handed)
+            self.handed = None
+        if self.pushback:
+            self.handed = time.perf_counter()
+            return self.pushback.pop()
+        if self.pos >= len(self.keys):
+            if delay == 0:
+                return -1
+            raise KeyboardInterrupt # end of the tape and the UI is waiting for a key
+        if self.t0 is None:
+            self.t0 = now
+        t,ch = self.keys[self.pos]
+        # keys that arrived together (escape sequences, pastes) are handed over together. at
+        # speed 0 anything else still isn't "there yet" for a nodelay poll, or typing would
+        # look like a paste
+        burst = self.pos and t - self.keys[self.pos - 1][0] < 0.01
+        if not self.speed and not burst and delay == 0:
+            return -1
+        wait = self.t0 + t / self.speed - now if self.speed and not burst else 0
+        if wait > 0:
+            if delay == 0:
+                return -1
+            if 0 < delay < wait * 1000:
+                time.sleep(delay / 1000)
+                return -1
+            time.sleep(wait)
+        self.pos += 1
+        self.handed = time.perf_counter()
+        return ch
+
+    async def sleep_until(self,span,t):
+        import asyncio
+        wait = t / self.speed - span.elapsed() if self.speed else 0
+        await asyncio.sleep(max(0.0,wait))
+
+    async def play(self,span,background):
+        queue = self.streams[background]
+        n = self.played[background]
+        if n >= len(queue):
+            self.missing += 1
+            raise requests.exceptions.ConnectionError("replay went off the tape: no recorded reply left for this request")
+        self.played[background] += 1
+        rec = queue[n]
+        await self.sleep_until(span,rec['ttfb'])
+        span.mark('ttfb')
+        span.rec['status'] = rec['status']
+        span.rec['replayed'] = True
+        for dt,line in rec['lines']:
+            await self.sleep_until(span,dt)
+            yield line
+        if rec['err']:
+            etype,msg = rec['err']
+            if etype == 'TimeoutError':
+                raise TimeoutError(msg)
+            if etype == 'HTTPError':
+                raise requests.exceptions.HTTPError(msg)
+            raise requests.exceptions.ConnectionError(msg)
+
+    def report(self,wall,trace_path):
+        def ms(xs,q):
+            return sorted(xs)[min(len(xs) - 1,int(len(xs) * q))] * 1000
+        out = [f"replayed {self.pos}/{len(self.keys)} keys and {self.played[False]} replies in {wall:.2f}s (speed {self.speed:g}x)"]
+        if self.latencies:
+            out.append(f"key handling: p50 {ms(self.latencies,0.5):.1f}ms  p95 {ms(self.latencies,0.95):.1f}ms  max {max(self.latencies) * 1000:.1f}ms")
+        streams,saves = [],[]
+        try:
+            with open(trace_path,'r') as f:
+                for line in f:
+                    rec = json.loads(line)
+                    if rec.get('kind') == 'stream' and rec.get('frames'):
+                        streams.append(rec)
+                    elif rec.get('kind') == 'save':
+                        saves.append(rec['dur'])
+        except (OSError,ValueError):
+            pass
+        if streams:
+            frames = sum(rec['frames'] for rec in streams)
+            mean = sum(rec['frame_mean'] * rec['frames'] for rec in streams) / frames
+            out.append(f"stream redraws: {frames} frames, mean {mean * 1000:.2f}ms  max {max(rec['frame_max'] for rec in streams) * 1000:.2f}ms")
+        if saves:
+            out.append(f"saves: {len(saves)}, mean {sum(saves) / len(saves) * 1000:.1f}ms  max {max(saves) * 1000:.1f}ms")
+        if self.missing:
+            out.append(f"{self.missing} request(s) had no recorded reply - the replay went off the tape")
+        return "\n".join(out)
+
+class virtualWin:
+    def __init__(self,screen,h,w,y,x):
+        self.screen = screen
+        self.h,self.w = max(h,1),max(w,1)
+        self.y,self.x = y,x
+        self.rows = [[' '] * self.w for _ in range(self.h)]
+        self.cy = self.cx = 0
+        self.delay = -1
+        self.scroll = False
+
+    def getmaxyx(self):
+        return self.h,self.w
+
+    def clear(self):
+        self.rows = [[' '] * self.w for _ in range(self.h)]
+        self.cy = self.cx = 0
+
+    erase = clear
+
+    def move(self,y,x):
+        if not (0 <= y < self.h and 0 <= x < self.w):
+            raise self.screen.error("move() returned ERR")
+        self.cy,self.cx = y,x
+
+    def addstr(self,*args):
+        if isinstance(args[0],str):
+            y,x,text = self.cy,self.cx,args[0]
+        else:
+            y,x,text = args[0],args[1],args[2]
+        if not (0 <= y < self.h and 0 <= x < self.w):
+            raise self.screen.error("addstr() returned ERR")
+        for ch in text:
+            if ch == '\n':
+                self.rows[y][x:] = [' '] * (self.w - x)
+                y,x = y + 1,0
+            else:
+                self.rows[y][x] = ch
+                x += 1
+                if x >= self.w:
+                    y,x = y + 1,0
+            if y >= self.h:
+                if not self.scroll:
+                    self.cy,self.cx = self.h - 1,self.w - 1
+                    raise self.screen.error("addstr() returned ERR")
+                self.rows.pop(0)
+                self.rows.append([' '] * self.w)
+                y = self.h - 1
+        self.cy,self.cx = y,x
+
+    def border(self,*args):
+        for row in (0,self.h - 1):
+            self.rows[row] = ['+'] + ['-'] * (self.w - 2) + ['+']
+        for row in range(1,self.h - 1):
+            self.rows[row][0] = self.rows[row][-1] = '|'
+
+    def attron(self,attr):
+        pass
+
+    def attroff(self,attr):
+        pass
+
+    def scrollok(self,flag):
+        self.scroll = flag
+
+    def keypad(self,flag):
+        pass
+
+    def nodelay(self,flag):
+        self.delay = 0 if flag else -1
+
+    def timeout(self,delay):
+        self.delay = delay
+
+    def noutrefresh(self):
+        self.screen.blit(self)
+
+    refresh = noutrefresh
+
+    def getch(self):
+        self.screen.blit(self)
+        return self.screen.tape.next_key(self.delay)
+
+class virtualScreen:
+    # enough of the curses module for the UI to run without a terminal: windows draw into text
+    # buffers, refresh() copies them onto one screen, keys come from a session tape. it's put in
+    # place of the real module for `main.py replay`
+    class error(Exception):
+        pass
+
+    def __init__(self,height,width,tape):
+        real = importlib.import_module('curses')
+        for name in dir(real):
+            if name.startswith(('KEY_','A_','COLOR_')):
+                setattr(self,name,getattr(real,name))
+        self.tape = tape
+        self.height,self.width = height,width
+        self.grid = [[' '] * width for _ in range(height)]
+        self.stdscr = virtualWin(self,height,width,0,0)
+
+    def blit(self,win):
+        for i,row in enumerate(win.rows):
+            y = win.y + i
+            if 0 <= y < self.height:
+                for j,ch in enumerate(row):
+                    if 0 <= win.x + j < self.width:
+                        self.grid[y][win.x + j] = ch
+
+    def text(self):
+        return "\n".join("".join(row).rstrip() for row in self.grid)
+
+    def newwin(self,h,w,y,x):
+        return virtualWin(self,h,w,y,x)
+
+    def color_pair(self,n):
+        return n << 8
+
+    def ungetch(self,ch):
+        self.tape.pushback.append(ch)
+
+    def napms(self,ms):
+        if self.tape.speed:
+            time.sleep(ms / 1000 / self.tape.speed)
+
+    def init_pair(self,*args):
+        pass
+
+    def curs_set(self,visibility):
+        pass
+
+    def doupdate(self):
+        pass
+
+    def echo(self):
+        pass
+
+    def noecho(self):
+        pass
+
 class mainChat:
-    def __init__(self,api_key=None, base_url="https://ai.hackclub.com/proxy/v1", model="openai/gpt-5.1"):
+    def __init__(self,api_key=None, base_url=DEFAULT_BASE_URL, model="openai/gpt-5.1", tracer=None, engine=None, session=None):
         self.api_key = api_key or os.environ.get("API_KEY")
+        if not self.api_key and is_local_url(base_url):
+            self.api_key = os.environ.get('SHELLLLM_LOCAL_KEY','local') # on-box servers don't check it
         if not self.api_key:
             raise ValueError("api key not found, is the API key in .env?")
         self.base_url = base_url
         self.model = model
         self.convo_history = []
         self.attached_files = []
+        self.workspace = None
+        self.catalog = None # modelCatalog, when there is one
+        self.local = None # localBackend that short prompts go to, when there is one
+        self.journal = None # replyJournal that streaming replies are checkpointed to
+        self.tracer = tracer or perfTracer()
+        self.engine = engine or chatEngine.shared()
+        self._session = session
+        self.last_usage = None
+        self.resp_state = None # previous_response_id bookkeeping for the responses API
+        self.chat_rec = None # the stored chat this history belongs to, if any
+        self.turn_context = None # (user message, workspace text) for the turn being answered
+        self.data_lock = threading.RLock() # chatMgr.data_lock when chat_rec is one of its chats
+        self.background = False
+        self.timeouts = stream_timeouts()
+        self.tools = None # toolRegistry, when the model may use tools
+        self.confirm_tools = False # the reader of the stream answers toolConfirms (the UI does)
+        self.max_tool_rounds = int(os.environ.get('SHELLLLM_TOOL_ROUNDS','8'))
+
+    @property
+    def session(self):
+        # made on first request so importing requests stays off the startup path
+        if self._session is None:
+            self._session = make_session()
+        return self._session
     
+    def open(self,chat_rec):
+        # point at a stored chat, its messages list is shared with chatMgr
+        self.chat_rec = chat_rec
+        self.convo_history = chat_rec.get('messages',[])
+        self.resp_state = None
+        self.turn_context = None
+
+    def context_msgs(self,turn=True):
+        # what actually gets sent: a pinned summary stands in for the turns it covers, and
+        # the prompt being answered gets the workspace text found for it (turn=False leaves
+        # that out, it's only ever sent with this one request)
+        summary = self.chat_rec.get('summary') if self.chat_rec else None
+        msgs = apply_summary(self.convo_history,summary)
+        if turn and self.turn_context:
+            msgs = self.with_turn_context(msgs)
+        limit = self.catalog.context(self.model) if self.catalog else None
+        if limit:
+            msgs = fit_context(msgs,int(limit * 0.8)) # the rest is left for the reply
+        return msgs
+
+    def with_turn_context(self,msgs):
+        msg,context = self.turn_context
+        for i in range(len(msgs) - 1,-1,-1):
+            if msgs[i] is msg:
+                parts = msg['content'] if isinstance(msg['content'],list) else [{"type": "text","text": msg['content']}]
+                # after any attached files, in front of the typed text
+                with_context = chatMsg("user",parts[:-1] + [attachRef(context,"workspace")] + parts[-1:])
+                return msgs[:i] + [with_context] + msgs[i + 1:]
+        return msgs
+
+    def workspace_context(self,user_msg):
+        if not self.workspace:
+            return None
+        try:
+            return self.workspace.context(user_msg) or None
+        except Exception:
+            return None # the message still goes, just without workspace context
+
     def send_msg(self,user_msg,stream=True):
-        if self.attached_files:
-            for f in self.attached_files:
-                if f['type'] == 'text':
-                    file_context = f"\n\n--- file: {f['name']} --- \n{f['content']}\n--- end of {f['name']} --- \n"
-                    user_msg = file_context + user_msg
-            has_imgs = any(f['type'] == 'image' for f in self.attached_files)
-            if has_imgs:
-                content_parts = [{"type":"text","text":user_msg}]
-                for f in self.attached_files:
-                    if f['type'] == 'image':
-                        content_parts.append({
-                            "type":"image_url",
-                            "image_url": {
-                                "url": f"data:{f['mime_type']};base64,{f['content']}"
-                            }
-                        })
-                self.convo_history.append({
-                    "role": "user",
-                    "content": content_parts
-                })
-            else:
-                self.convo_history.append({
-                    "role": "user",
-                    "content": user_msg
-                })
-            self.clear_attch()
-        else:
-            self.convo_history.append({
-                "role": "user",
-                "content": user_msg
-            })
+        self._add_user_msg(user_msg)
         if stream:
             return self._stream_res()
         else:
             return self._get_res()
 
+    def _add_user_msg(self,user_msg):
+        if self.catalog and self.catalog.vision(self.model) is False and any(f['type'] == 'image' for f in self.attached_files):
+            raise ValueError(f"{self.model} can't read images, switch model or '::clear-attach'")
+        # attachments are parts of their own in front of the typed text, so the text can be
+        # edited (or made a title) without digging it back out. wire_msg joins the text ones up
+        # workspace text isn't stored with it: it's looked up per prompt and only sent with
+        # this turn's requests (turn_context), not saved and re-sent with every later turn
+        attached = []
+        for f in self.attached_files:
+            if f['type'] == 'text':
+                file_context = f"\n\n--- file: {f['name']} --- \n{f['content']}\n--- end of {f['name']} --- \n"
+                attached.insert(0,attachRef(file_context,f"file: {f['name']}"))
+        for f in reversed(self.attached_files):
+            if f['type'] == 'image':
+                attached.insert(0,attachRef(f"data:{f['mime_type']};base64,{f['content']}"))
+        if attached:
+            msg = chatMsg("user",attached + [{"type": "text","text": user_msg}])
+        else:
+            msg = chatMsg("user",user_msg)
+        self.convo_history.append(msg)
+        context = self.workspace_context(user_msg)
+        self.turn_context = (msg,context) if context else None
+        self.clear_attch()
+
     def _stream_res(self):
-        url = f"{self.base_url}/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
+        return self.engine.iter_sync(self._astream_res())
+
+    def _get_res(self):
+        return "".join(self._stream_res())
+
+    def asend_msg(self,user_msg):
+        # async version of send_msg, use with `async for chunk in chat.asend_msg(...)`
+        self._add_user_msg(user_msg)
+        return self.engine.aiter(self._astream_res())
+
+    def continue_last(self,stream=True):
+        # finish a reply that was cut off: the partial text goes back as an assistant prefix
+        # and whatever comes back is appended to it
+        if not self.can_continue():
+            return None
+        gen = self.engine.iter_sync(self._astream_res(cont=True))
+        return gen if stream else "".join(gen)
+
+    def acontinue_last(self):
+        if not self.can_continue():
+            return None
+        return self.engine.aiter(self._astream_res(cont=True))
+
+    def can_continue(self):
+        return bool(self.convo_history) and self.convo_history[-1]['role'] == 'assistant' and bool(self.convo_history[-1].get('incomplete'))
+
+    def aregen_last(self):
+        if not self._pop_for_regen():
+            return None
+        return self.engine.aiter(self._astream_res())
+
+    def caps(self):
+        return provider_caps(self.base_url,self.model)
+
+    def wire_messages(self,caps):
+        # history as sent. earlier messages are never rewritten, so every turn starts with
+        # the exact bytes of the last one and the provider's prompt cache can reuse them.
+        # for cache_control providers, breakpoints go on the newest message (caches this
+        # prompt) and on the previous user turn (where the last request's cache ended)
+        msgs = [wire_msg(m) for m in self.context_msgs()]
+        if not caps.get('cache_control') or not msgs:
+            return msgs
+        marks = {len(msgs) - 1}
+        users = [i for i,m in enumerate(msgs[:-1]) if m['role'] == 'user']
+        if users:
+            marks.add(users[-1])
+        wire = list(msgs)
+        for i in marks:
+            content = msgs[i]['content']
+            if isinstance(content,str):
+                if not content:
+                    continue
+                parts = [{"type": "text", "text": content}]
+            else:
+                parts = [dict(p) for p in content]
+            for part in reversed(parts):
+                if part.get('type') == 'text':
+                    part['cache_control'] = {"type": "ephemeral"}
+                    break
+            wire[i] = dict(msgs[i],content=parts)
+        return wire
+
+    def pick_route(self):
+        # 'local' when the prompt just added is one for the local server, otherwise 'remote'
+        local = self.local
+        if local is None or not local.available() or not self.convo_history:
+            return 'remote'
+        last = self.convo_history[-1]
+        if last['role'] == 'assistant' and last.get('incomplete'):
+            # finishing a cut off reply: the model that started it
+            return 'local' if last.get('route') == 'local' else 'remote'
+        if self.tools is not None and local.mode != 'always':
+            return 'remote'
+        prompt = last['content'] if last['role'] == 'user' else None
+        return 'local' if local.wants(prompt,est_tokens(self.context_msgs())) else 'remote'
+
+    def build_request(self,route='remote'):
+        if route == 'local':
+            base_url,model = self.local.base_url,self.local.model
+            caps = {'usage': True}
+        else:
+            base_url,model = self.base_url,self.model
+            caps = self.caps()
+        if caps.get('responses'):
+            # server-side conversation state: only send what the server hasn't seen yet. the
+            # state is kept against what was sent (summary pinned, old turns trimmed), so a new
+            # summary or more trimming starts over with the whole context
+            data = {"model": model, "stream": True}
+            st = self.resp_state
+            hist = self.context_msgs()
+            kept = self.context_msgs(turn=False) # the state is kept against what's stored
+            if st and st['model'] == model and len(kept) == len(hist) and st['upto'] <= len(hist) and chat_hash(kept[:st['upto']]) == st['hash']:
+                data['previous_response_id'] = st['id']
+                data['input'] = responses_input(hist[st['upto']:])
+            else:
+                data['input'] = responses_input(hist)
+            return f"{base_url}/responses",data,'responses'
         data = {
-            "model": self.model,
-            "messages": self.convo_history,
+            "model": model,
+            "messages": self.wire_messages(caps),
             "stream": True
         }
+        if caps.get('usage'):
+            data['stream_options'] = {"include_usage": True}
+        if self.tools is not None and (route == 'local' or self.catalog is None or self.catalog.tools(self.model) is not False):
+            data['tools'] = self.tools.schemas()
+        if caps.get('cache_key') and self.convo_history:
+            # same key for every turn of a chat so they land on the same cache
+            data['prompt_cache_key'] = "shellLLM-" + chat_hash(self.convo_history[:1])[:16]
+        return f"{base_url}/chat/completions",data,'chat'
+
+    def note_usage(self,usage,span):
+        details = usage.get('prompt_tokens_details') or usage.get('input_tokens_details') or {}
+        prompt = usage.get('prompt_tokens',usage.get('input_tokens',0)) or 0
+        cached = details.get('cached_tokens') or usage.get('cache_read_input_tokens') or 0
+        completion = usage.get('completion_tokens',usage.get('output_tokens',0)) or 0
+        self.last_usage = {'prompt': prompt, 'cached': cached, 'completion': completion}
+        span.rec['prompt_tokens'] = prompt
+        span.rec['cached_tokens'] = cached
+        span.rec['completion_tokens'] = completion
+
+    async def _astream_res(self,cont=False):
+        # the reply, plus another request after each round of tool calls the model makes.
+        # the whole reply goes to the one server picked for it
+        route = self.pick_route()
+        for rounds in range(self.max_tool_rounds + 1):
+            calls = {}
+            # each part is closed as soon as we are (ctrl+c, the reader stopping), so its cleanup,
+            # keeping the partial reply, runs then and not whenever it's garbage collected
+            part = self._astream_round(cont,calls,route)
+            try:
+                async for chunk in part:
+                    yield chunk
+            finally:
+                await part.aclose()
+            if not calls:
+                return
+            part = self._arun_tools([calls[i] for i in sorted(calls)])
+            try:
+                async for chunk in part:
+                    yield chunk
+            finally:
+                await part.aclose()
+            cont = False
+        yield f"\n\n(stopped after {self.max_tool_rounds} rounds of tool calls)"
+
+    async def _arun_tools(self,calls):
+        # one turn's tool calls: the ones that need it are confirmed first (the stream yields a
+        # toolConfirm and waits for the reader to answer), then the rest run at the same time on
+        # the registry's pool. results go into the history in the order the model asked
+        import asyncio
+        loop = asyncio.get_running_loop()
+        results = {}
+        todo = []
+        for call in calls:
+            args,err = self.tools.prepare(call)
+            label = self.tools.label(call['name'],args)
+            yield f"\n\n> {label}"
+            if err:
+                results[call['id']] = f"error: {err}"
+                continue
+            if self.tools.needs_confirm(call['name']):
+                req = toolConfirm(label)
+                if self.confirm_tools:
+                    yield req
+                if not req.allowed:
+                    results[call['id']] = "error: the user didn't allow this"
+                    yield " (not allowed)"
+                    continue
+            todo.append((call,args))
+
+        async def job(call,args):
+            return call,await loop.run_in_executor(self.tools.executor(),self.tools.run,call['name'],args)
+
+        for done in asyncio.as_completed([job(call,args) for call,args in todo]):
+            call,out = await done
+            results[call['id']] = out
+            yield f"\n> {call['name']} done ({len(out)} chars)"
+        for call in calls:
+            self.convo_history.append(chatMsg("tool",results[call['id']],tool_call_id=call['id']))
+        yield "\n\n"
+
+    async def _astream_round(self,cont,calls,route='remote'):
+        url,data,mode = self.build_request(route)
+        headers = {
+            "Authorization": f"Bearer {self.local.api_key if route == 'local' else self.api_key}",
+            "Content-Type": "application/json"
+        }
         full_res = ""
+        resp_id = None
+        jid = self.chat_rec['id'] if self.journal is not None and self.chat_rec is not None and self.chat_rec.get('messages') is self.convo_history else None
+        if jid:
+            self.journal.begin(jid,self.convo_history,len(self.convo_history) - 1 if cont else len(self.convo_history),cont,route)
+        span = self.tracer.begin('stream',model=data['model'],msgs=len(self.convo_history),route='local' if is_local_url(url) else 'remote')
+        err = None
+        self.engine.stream_started(self.background)
 
         try:
-            res = requests.post(url, headers=headers, json=data, stream=True, timeout=30)
-            res.raise_for_status()
-            for line in res.iter_lines():
-                if line:
-                    line = line.decode('utf-8')
-                    if line.startswith('data: '):
-                        line = line[6:]
-                        if line.strip() == '[DONE]':
-                            break
-                        try:
-                            chunk = json.loads(line)
-                            if 'choices' in chunk and len(chunk['choices']) > 0:
-                                delta = chunk['choices'][0].get('delta', {})
-                                content = delta.get('content', '')
-                                if content:
-                                    full_res += content
-                                    yield content
-                        except json.JSONDecodeError:
-                            continue
-            self.convo_history.append({
-                "role": "assistant",
-                "content": full_res
-            })
-        except requests.exceptions.RequestException as e:
-            return f"error: {str(e)}"
+            async for line in self.engine.post_lines(self.session,url,headers,data,span,self.timeouts,self.background):
+                if line.startswith('data: '):
+                    line = line[6:]
+                    if line.strip() == '[DONE]':
+                        break
+                    try:
+                        chunk = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if mode == 'responses':
+                        kind = chunk.get('type','')
+                        content = chunk.get('delta','') if kind == 'response.output_text.delta' else ''
+                        if kind == 'response.completed':
+                            resp_id = chunk.get('response',{}).get('id')
+                            if chunk.get('response',{}).get('usage'):
+                                self.note_usage(chunk['response']['usage'],span)
+                    else:
+                        if chunk.get('usage'):
+                            self.note_usage(chunk['usage'],span)
+                        content = ''
+                        if 'choices' in chunk and len(chunk['choices']) > 0:
+                            delta = chunk['choices'][0].get('delta', {})
+                            content = delta.get('content', '')
+                            for tc in delta.get('tool_calls') or []:
+                                # the name and id come first, the arguments arrive in pieces
+                                idx = tc.get('index',len(calls))
+                                call = calls.setdefault(idx,{'id': f"call_{idx}",'name': '','arguments': ''})
+                                fn = tc.get('function') or {}
+                                if tc.get('id'):
+                                    call['id'] = tc['id']
+                                call['name'] += fn.get('name') or ''
+                                call['arguments'] += fn.get('arguments') or ''
+                    if content:
+                        span.chunk()
+                        full_res += content
+                        if jid:
+                            self.journal.add(jid,content)
+                        yield content
+            self.keep_reply(full_res,cont,done=True,route=route)
+            if calls:
+                self.convo_history[-1]['tool_calls'] = [{"id": c['id'],"type": "function","function": {"name": c['name'],"arguments": c['arguments']}}
+                                                        for _,c in sorted(calls.items())]
+            if resp_id:
+                sent = self.context_msgs(turn=False)
+                self.resp_state = {'id': resp_id, 'model': data['model'], 'upto': len(sent), 'hash': chat_hash(sent)}
+        except BaseException as e:
+            # dropped connection, timeout, or the caller stopped reading: whatever already
+            # arrived is kept (marked incomplete) so it can be continued, then the error goes up
+            if isinstance(e,Exception):
+                err = e
+            if full_res:
+                self.keep_reply(full_res,cont,done=False,route=route)
+            raise
+        finally:
+            if jid:
+                self.journal.end(jid)
+            self.engine.stream_ended(self.background)
+            self.tracer.end(span,err)
     
+    def keep_reply(self,text,cont,done,route='remote'):
+        if cont:
+            last = self.convo_history[-1]
+            last['content'] += text
+        else:
+            last = chatMsg("assistant",text)
+            self.convo_history.append(last)
+        if done:
+            last.pop('incomplete',None)
+            last.pop('route',None)
+        else:
+            last['incomplete'] = True
+            if route == 'local':
+                last['route'] = route # so ::continue goes back to the same model
+            else:
+                last.pop('route',None)
+
     def clear_hist(self):
         self.convo_history = []
     
@@ -155,10 +2198,42 @@ class mainChat:
         return self.convo_history
     
     def regen_last(self,stream=True):
-        if len(self.convo_history) < 2:
+        if not self._pop_for_regen():
             return None
+        if stream:
+            return self._stream_res()
+        else:
+            return self._get_res()
+
+    def _pop_for_regen(self):
+        if len(self.convo_history) < 2:
+            return False
         if self.convo_history[-1]['role'] == 'assistant':
+            self.fork(len(self.convo_history) - 1) # the old reply stays as another version
             self.convo_history.pop()
+        return True
+
+    def fork(self,at):
+        # only for a stored chat whose messages list this is (the server works on copies)
+        if self.chat_rec is not None and self.chat_rec.get('messages') is self.convo_history:
+            with self.data_lock:
+                return fork_chat(self.chat_rec,at)
+        return False
+
+    def edit_msg(self,idx,text,stream=True):
+        # sends an earlier prompt again with new text. the old prompt and everything after it
+        # become a side branch, attached files and images are kept, workspace text is looked
+        # up again for the new text
+        old = self.convo_history[idx]
+        content = text
+        if isinstance(old['content'],list):
+            content = [p for p in old['content'] if p.get('type') != 'text' or p.get('attach') not in (None,'workspace')] + [{"type": "text","text": text}]
+        self.fork(idx)
+        del self.convo_history[idx:]
+        msg = chatMsg("user",content)
+        self.convo_history.append(msg)
+        context = self.workspace_context(text)
+        self.turn_context = (msg,context) if context else None
         if stream:
             return self._stream_res()
         else:
@@ -180,6 +2255,8 @@ class mainChat:
             })
             return True, f"attached text file: {os.path.basename(filepath)}"
         elif file_type == 'image':
+            if self.catalog and self.catalog.vision(self.model) is False:
+                return False, f"{self.model} can't read images"
             content = fileHandler.read_img_file(filepath)
             if content is None:
                 return False, "couldn't read image"
@@ -204,9 +2281,222 @@ class mainChat:
             summary.append(f"{f['name']} ({f['type']})")
         return ", ".join(summary)
 
+class gapBuffer:
+    # the text being typed. edits happen at the gap (the cursor), so typing or deleting in
+    # the middle of a long prompt doesn't copy the whole thing on every keypress
+    def __init__(self,text=""):
+        self.buf = list(text) + [None] * 64
+        self.gap_start = len(text)
+        self.gap_end = len(self.buf)
+        self._text = text
+
+    def __len__(self):
+        return len(self.buf) - (self.gap_end - self.gap_start)
+
+    @property
+    def cursor(self):
+        return self.gap_start
+
+    def text(self):
+        if self._text is None:
+            self._text = "".join(self.buf[:self.gap_start]) + "".join(self.buf[self.gap_end:])
+        return self._text
+
+    def move_to(self,pos):
+        pos = max(0,min(pos,len(self)))
+        if pos < self.gap_start:
+            n = self.gap_start - pos
+            self.buf[self.gap_end - n:self.gap_end] = self.buf[pos:self.gap_start]
+            self.gap_start -= n
+            self.gap_end -= n
+        elif pos > self.gap_start:
+            n = pos - self.gap_start
+            self.buf[self.gap_start:self.gap_start + n] = self.buf[self.gap_end:self.gap_end + n]
+            self.gap_start += n
+            self.gap_end += n
+
+    def insert(self,text):
+        if not text:
+            return
+        if len(text) > self.gap_end - self.gap_start:
+            grow = max(len(text),len(self.buf))
+            self.buf[self.gap_end:self.gap_end] = [None] * grow
+            self.gap_end += grow
+        self.buf[self.gap_start:self.gap_start + len(text)] = list(text)
+        self.gap_start += len(text)
+        self._text = None
+
+    def backspace(self,n=1):
+        n = min(n,self.gap_start)
+        self.gap_start -= n
+        if n:
+            self._text = None
+
+    def delete(self,n=1):
+        n = min(n,len(self.buf) - self.gap_end)
+        self.gap_end += n
+        if n:
+            self._text = None
+
+    def set(self,text):
+        self.__init__(text)
+
+    def line_start(self):
+        return self.text().rfind('\n',0,self.cursor) + 1
+
+    def line_end(self):
+        end = self.text().find('\n',self.cursor)
+        return len(self) if end == -1 else end
+
+    def word_left(self):
+        text,pos = self.text(),self.cursor
+        while pos > 0 and not text[pos-1].isalnum():
+            pos -= 1
+        while pos > 0 and text[pos-1].isalnum():
+            pos -= 1
+        return pos
+
+    def word_right(self):
+        text,pos = self.text(),self.cursor
+        while pos < len(text) and not text[pos].isalnum():
+            pos += 1
+        while pos < len(text) and text[pos].isalnum():
+            pos += 1
+        return pos
+
+    def move_line(self,step):
+        # up/down inside a multiline prompt, keeping the column. False when there's no line there
+        text,pos = self.text(),self.cursor
+        start = self.line_start()
+        col = pos - start
+        if step < 0:
+            if start == 0:
+                return False
+            prev = text.rfind('\n',0,start - 1) + 1
+            self.move_to(min(prev + col,start - 1))
+        else:
+            end = self.line_end()
+            if end == len(text):
+                return False
+            nxt_end = text.find('\n',end + 1)
+            nxt_end = len(text) if nxt_end == -1 else nxt_end
+            self.move_to(min(end + 1 + col,nxt_end))
+        return True
+
+class promptHistory:
+    # everything you've typed, oldest first, one json line per prompt in history.jsonl. shared
+    # by every shellLLM using this folder. it's only read the first time you use it (up arrow
+    # or ctrl+r), new prompts are just appended
+    def __init__(self,path=None,cap=None):
+        self.path = path or os.environ.get('SHELLLLM_HISTORY') or data_path('history.jsonl')
+        self.cap = cap or int(os.environ.get('SHELLLLM_HISTORY_SIZE','10000'))
+        self.items = None # text -> seq, oldest first; re-adding moves an entry to the end
+        self.seq = 0
+        self.index = None # sorted (word, text) pairs for ctrl+r
+        self.dead = 0
+
+    def load(self):
+        if self.items is not None:
+            return
+        import collections
+        self.items = collections.OrderedDict()
+        lines = 0
+        try:
+            with open(self.path,'r',encoding='utf-8') as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        self.remember(json.loads(line)['text'])
+                    except (ValueError,KeyError,TypeError):
+                        continue
+        except FileNotFoundError:
+            pass
+        except OSError:
+            return
+        if lines > 2 * self.cap:
+            self.rewrite()
+
+    def remember(self,text):
+        if text in self.items:
+            del self.items[text]
+        self.seq += 1
+        self.items[text] = self.seq
+        while len(self.items) > self.cap:
+            self.items.popitem(last=False)
+            self.dead += 1
+
+    def rewrite(self):
+        # drop duplicates and evicted prompts from the file once it's twice the cap
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with store_lock(self.path):
+                with open(tmp_path,'w',encoding='utf-8') as f:
+                    for text in self.items:
+                        f.write(json.dumps({'text': text}) + '\n')
+                os.replace(tmp_path,self.path)
+        except OSError:
+            pass
+
+    def add(self,text):
+        if not text.strip():
+            return
+        try:
+            with open(self.path,'a',encoding='utf-8') as f:
+                f.write(json.dumps({'text': text}) + '\n')
+        except OSError:
+            pass
+        if self.items is not None:
+            fresh = text not in self.items
+            self.remember(text)
+            if fresh and self.index is not None:
+                import bisect
+                for word in self.words(text):
+                    bisect.insort(self.index,(word,text))
+
+    def entries(self):
+        self.load()
+        return list(self.items)
+
+    @staticmethod
+    def words(text):
+        return set(text.lower().split())
+
+    def build_index(self):
+        self.index = sorted((word,text) for text in self.items for word in self.words(text))
+        self.dead = 0
+
+    def search(self,query,before=None):
+        # newest prompt containing query that's older than `before` (a seq). the query has to
+        # start at the start of a word in the prompt; candidates come from a prefix range of
+        # the word index, so this doesn't scan every prompt
+        self.load()
+        q = query.lower().lstrip()
+        if not q:
+            return None
+        if self.index is None or self.dead > len(self.items):
+            self.build_index()
+        import bisect
+        first = q.split()[0]
+        lo = bisect.bisect_left(self.index,(first,""))
+        best,best_seq = None,0
+        for word,text in self.index[lo:]:
+            if not word.startswith(first):
+                break
+            seq = self.items.get(text)
+            if seq is None or seq <= best_seq or (before is not None and seq >= before):
+                continue
+            low = text.lower()
+            at = low.find(q)
+            while at > 0 and not low[at-1].isspace():
+                at = low.find(q,at + 1)
+            if at != -1:
+                best,best_seq = text,seq
+        return (best,best_seq) if best is not None else None
+
 class UI:
-    def __init__(self,stdscr,chat,chat_mgr):
+    def __init__(self,stdscr,chat,chat_mgr,tape=None):
         self.stdscr = stdscr
+        self.tape = tape
         self.chat = chat
         self.chat_mgr = chat_mgr
         self.current_res = ""
@@ -218,8 +2508,11 @@ class UI:
         self.v_msg_idx = -1
 
         self.show_help = False
+        self.help_scroll = 0
         self.show_model_sel = False
         self.model_in_buffer = ""
+        self.model_sel = 0
+        self.model_note = ""
 
         self.show_file_atch = False 
         self.file_path_buffer = ""
@@ -227,6 +2520,20 @@ class UI:
         self.show_search = False
         self.search_in_buffer = ""
         self.search_results = []
+
+        self.chats_ready = False
+        self.on_ready = None
+
+        self.streaming = False
+        self.wrap_cache = {}
+        self.wrap_tail = (0,"",[])
+        self.reply_cache = {}
+        self.res_msg = None # (message, its text) when the response pane shows a stored message
+        self.pending_open = False
+
+        self.input_top = 0
+        self.input_left = 0
+        self.history = promptHistory()
         # curses stuff, AI helped me a bit with this as I'm quite new to curses
         curses.init_pair(1, curses.COLOR_CYAN, curses.COLOR_BLACK)
         curses.init_pair(2, curses.COLOR_GREEN, curses.COLOR_BLACK)
@@ -236,19 +2543,28 @@ class UI:
         curses.init_pair(6, curses.COLOR_MAGENTA,curses.COLOR_BLACK)
         self.height, self.width = stdscr.getmaxyx()
 
-        self.header_win = curses.newwin(3,self.width, 0,0)
-        self.chats_win = curses.newwin(self.height - 6, self.width // 3, 3, 0)
-        self.input_win = curses.newwin(3, self.width, self.height - 3,0)
-        self.res_win = curses.newwin(self.height - 6, (self.width * 2) // 3, 3,self.width //3)
-        self.help_win = curses.newwin(32,60,(self.height - 32)//2, (self.width - 60)//2)
-        self.model_win = curses.newwin(7,60,(self.height - 7) // 2, (self.width - 60)//2)
-        self.search_win = curses.newwin(20,70,(self.height - 20) // 2, (self.width - 70)//2)
-        self.file_win = curses.newwin(10,70,(self.height - 10) //2, (self.width - 70) // 2)
-        self.stats_win = curses.newwin(20,70,(self.height - 20) //2, (self.width - 70) //2)
+        self.header_win = self.newwin(3,self.width, 0,0)
+        self.chats_win = self.newwin(self.height - 6, self.width // 3, 3, 0)
+        self.input_win = self.newwin(3, self.width, self.height - 3,0)
+        self.res_win = self.newwin(self.height - 6, (self.width * 2) // 3, 3,self.width //3)
+        self.help_win = self.newwin(32,60,(self.height - 32)//2, (self.width - 60)//2)
+        self.model_win = self.newwin(19,70,(self.height - 19) // 2, (self.width - 70)//2)
+        self.search_win = self.newwin(20,70,(self.height - 20) // 2, (self.width - 70)//2)
+        self.file_win = self.newwin(10,70,(self.height - 10) //2, (self.width - 70) // 2)
+        self.stats_win = self.newwin(24,70,(self.height - 24) //2, (self.width - 70) //2)
 
         self.res_win.scrollok(True)
         self.chats_win.scrollok(True)
 
+    def newwin(self,*args):
+        win = curses.newwin(*args)
+        return self.tape.wrap(win) if self.tape is not None else win
+
+    def ungetch(self,ch):
+        if self.tape is not None:
+            self.tape.unkey(ch)
+        curses.ungetch(ch)
+
     def draw_h(self):
         self.header_win.clear()
         self.header_win.attron(curses.color_pair(1) | curses.A_BOLD)
@@ -260,12 +2576,26 @@ class UI:
             self.header_win.addstr(1,self.width - len(mtxt) - 2, mtxt, curses.color_pair(4))
         except curses.error:
             pass
+        perf_txt = self.chat.tracer.summary()
+        if perf_txt:
+            try:
+                self.header_win.addstr(1,2,perf_txt[:max(0,(self.width - len(title)) // 2 - 4)],curses.color_pair(5) | curses.A_DIM)
+            except curses.error:
+                pass
         self.header_win.border()
         self.header_win.refresh()
     
     def draw_chats(self):
         self.chats_win.clear()
         self.chats_win.border()
+        if not self.chat_mgr.loaded.is_set():
+            self.chats_win.addstr(0,2,"chats",curses.color_pair(1) | curses.A_BOLD)
+            try:
+                self.chats_win.addstr(1,2,"loading chats\u2026",curses.color_pair(5) | curses.A_DIM)
+            except curses.error:
+                pass
+            self.chats_win.refresh()
+            return
         title = f"chats ({len(self.chat_mgr.chats)})"
         self.chats_win.addstr(0,2,title,curses.color_pair(1) | curses.A_BOLD)
         y = 1
@@ -274,12 +2604,14 @@ class UI:
             if y >= max_y:
                 break
             title = chat_data.get('title', 'New Chat')
-            msg_count = len(chat_data.get('messages', []))
+            msg_count = chat_msg_count(chat_data)
             if idx == self.chat_mgr.cur_chat_idx:
                 color = curses.color_pair(2) | curses.A_BOLD
                 prefix = "> "
             else:
                 color = curses.color_pair(5)
+                if chat_data.get('archived'):
+                    color |= curses.A_DIM
                 prefix = " "
             try:
                 display_text = f"{prefix}{title}"
@@ -296,6 +2628,116 @@ class UI:
         except curses.error:
             pass
 
+    def wrap_lines(self,text,msg=None):
+        # wrapped lines for the response pane. finished texts are cached (so redraws, scrolling
+        # and flipping between chats don't rewrap), and while streaming only the paragraph
+        # still being written gets rewrapped. a stored message keeps its own wrapped lines
+        width = (self.width * 2)//3 - 4
+        if msg is not None and msg.wrap is not None and msg.wrap[0] == width:
+            return msg.wrap[1]
+        lines = self.wrap_cache.get((width,text))
+        if lines is not None:
+            if msg is not None:
+                msg.wrap = (width,lines)
+            return lines
+        tail_w,tail_text,tail_lines = self.wrap_tail
+        if tail_w == width and tail_text and text.startswith(tail_text):
+            done_text,done_lines = tail_text,tail_lines
+        else:
+            done_text,done_lines = "",[]
+        cut = text.rfind('\n') + 1
+        lines = list(done_lines)
+        if cut > len(done_text):
+            for pg in text[len(done_text):cut-1].split('\n'):
+                lines.extend(textwrap.wrap(pg,width=width) if pg else [""])
+            self.wrap_tail = (width,text[:cut],list(lines))
+        rest = text[cut:]
+        lines.extend(textwrap.wrap(rest,width=width) if rest else [""])
+        if not self.streaming:
+            self.wrap_cache[(width,text)] = lines
+            if len(self.wrap_cache) > 16:
+                del self.wrap_cache[next(iter(self.wrap_cache))]
+            if msg is not None:
+                msg.wrap = (width,lines)
+        return lines
+
+    def alt_version(self,prompt_no=None):
+        # ::alt / b in nav mode: the next version of the chat from its newest fork, or from
+        # the fork at one prompt (its replies if they were regenerated, else the prompt's edits)
+        chat_rec = self.chat_mgr.get_cur_chat()
+        forks = chat_forks(chat_rec)
+        if prompt_no is None:
+            at = max(forks) if forks else None
+        else:
+            prompts = [i for i,msg in enumerate(chat_rec['messages']) if msg['role'] == 'user']
+            if not 1 <= prompt_no <= len(prompts):
+                return f"pick a prompt from 1 to {len(prompts)}"
+            idx = prompts[prompt_no - 1]
+            at = idx + 1 if idx + 1 in forks else idx if idx in forks else None
+        if at is None:
+            return "no other versions to switch to"
+        with self.chat_mgr.chat_lock(chat_rec['id']),self.chat_mgr.data_lock:
+            if not switch_branch(chat_rec,at):
+                return "no other versions to switch to"
+        self.chat_mgr.upd_cur_chat(self.chat.convo_history,self.chat.model)
+        self.v_msg_idx = -1
+        self.scroll_offset = 0
+        self.show_msg(self.last_reply(chat_rec))
+        return f"switched to another version from message {at + 1} ({forks[at]} versions there)"
+
+    def show_msg(self,msg):
+        # put a stored message (or nothing) in the response pane
+        self.current_res = msg_text(msg['content']) if msg is not None else ""
+        self.res_msg = (msg,self.current_res) if isinstance(msg,chatMsg) else None
+
+    def last_reply(self,chat_rec):
+        # newest assistant message of a chat (None if there isn't one), cached by message count + version
+        msgs = chat_rec.get('messages',[])
+        key = (len(msgs),chat_rec.get('version',0))
+        hit = self.reply_cache.get(chat_rec['id'])
+        if hit and hit[0] == key:
+            return hit[1]
+        found = None
+        for msg in reversed(msgs):
+            if msg['role'] == 'assistant':
+                found = msg
+                break
+        self.reply_cache[chat_rec['id']] = (key,found)
+        return found
+
+    def show_cur_chat(self):
+        # runs on every up/down in nav mode: no disk i/o and no full repaint. archived
+        # chats get unpacked once the keys stop coming (see finish_pending)
+        chat_rec = self.chat_mgr.chats[self.chat_mgr.cur_chat_idx]
+        self.v_msg_idx = -1
+        self.scroll_offset = 0
+        if chat_rec.get('archived'):
+            self.pending_open = True
+            self.current_res = "(archived chat, unpacking...)"
+        else:
+            self.pending_open = False
+            self.chat.open(chat_rec)
+            self.show_msg(self.last_reply(chat_rec))
+        self.status_msg = "switched chat"
+        self.draw_chats()
+        self.draw_res()
+        self.draw_input()
+
+    def finish_pending(self):
+        # work that waits until no keys are queued: opening an archived chat, then
+        # warming the caches for the chats either side of this one
+        if self.pending_open:
+            self.pending_open = False
+            self.chat.open(self.chat_mgr.get_cur_chat())
+            self.show_msg(self.last_reply(self.chat.chat_rec))
+            self.draw_res()
+        idx = self.chat_mgr.cur_chat_idx
+        for n in (idx - 1,idx + 1):
+            if 0 <= n < len(self.chat_mgr.chats) and not self.chat_mgr.chats[n].get('archived'):
+                reply = self.last_reply(self.chat_mgr.chats[n])
+                if isinstance(reply,chatMsg):
+                    self.wrap_lines(msg_text(reply['content']),reply)
+
     def draw_res(self):
         self.res_win.clear()
         self.res_win.border()
@@ -303,13 +2745,8 @@ class UI:
         self.res_win.addstr(0,2,title,curses.color_pair(3)|curses.A_BOLD)
         if self.current_res:
             max_width = (self.width * 2)//3 - 4
-            lines = []
-            for pg in self.current_res.split('\n'):
-                if pg:
-                    wrapped = textwrap.wrap(pg,width=max_width)
-                    lines.extend(wrapped)
-                else:
-                    lines.append("")
+            shown = self.res_msg[0] if self.res_msg and self.res_msg[1] is self.current_res else None
+            lines = self.wrap_lines(self.current_res,shown)
             max_y = self.res_win.getmaxyx()[0] -2
             start = self.scroll_offset
             end = min(start + max_y, len(lines))
@@ -335,6 +2772,26 @@ class UI:
                 pass
         self.res_win.refresh()
 
+    def model_matches(self):
+        catalog = self.chat.catalog
+        if not catalog or not catalog.models:
+            return []
+        return catalog.match(self.model_in_buffer)
+
+    def model_info(self,name):
+        meta = self.chat.catalog.get(name) if self.chat.catalog else {}
+        bits = []
+        if meta.get('context'):
+            bits.append(f"{meta['context'] // 1000}k")
+        if meta.get('vision'):
+            bits.append("images")
+        try:
+            price = meta.get('pricing',{})
+            bits.append(f"${float(price['prompt']) * 1e6:.2f}/${float(price['completion']) * 1e6:.2f}")
+        except (KeyError,ValueError,TypeError):
+            pass
+        return " ".join(bits)
+
     def draw_model_sel(self):
         if not self.show_model_sel:
             return
@@ -344,43 +2801,74 @@ class UI:
         self.model_win.addstr(0,2," select model ", curses.color_pair(6))
         self.model_win.attroff(curses.color_pair(6) | curses.A_BOLD)
         try:
-            self.model_win.addstr(2,2,"enter model name:", curses.color_pair(5))
+            self.model_win.addstr(2,2,"type to filter models:", curses.color_pair(5))
             self.model_win.addstr(3,2,"> ", curses.color_pair(2) | curses.A_BOLD)
-            display_text = self.model_in_buffer if self.model_in_buffer else "openai/gpt-5.1"
+            display_text = self.model_in_buffer if self.model_in_buffer else self.chat.model
             text_attr = curses.color_pair(5) if self.model_in_buffer else curses.color_pair(5) | curses.A_DIM
-            self.model_win.addstr(3,4,display_text[:52],text_attr)
-            self.model_win.addstr(5,2,"press ENTER to confirm, ESC to cancel", curses.color_pair(4) | curses.A_DIM)
+            self.model_win.addstr(3,4,display_text[:62],text_attr)
+            matches = self.model_matches()
+            for i,name in enumerate(matches):
+                attr = curses.color_pair(2) | curses.A_REVERSE if i == self.model_sel else curses.color_pair(2)
+                self.model_win.addstr(5 + i,2,f" {name[:44]:<44} ",attr)
+                self.model_win.addstr(5 + i,49,self.model_info(name)[:19],curses.color_pair(4) | curses.A_DIM)
+            if self.model_note:
+                self.model_win.addstr(16,2,self.model_note[:66],curses.color_pair(4))
+            elif not self.chat.catalog or not self.chat.catalog.loaded.is_set():
+                self.model_win.addstr(16,2,"loading the model list...",curses.color_pair(4) | curses.A_DIM)
+            elif self.model_in_buffer and not matches:
+                self.model_win.addstr(16,2,"no model matches that",curses.color_pair(4) | curses.A_DIM)
+            self.model_win.addstr(17,2,"up/down to pick, ENTER to confirm, ESC to cancel", curses.color_pair(4) | curses.A_DIM)
         except curses.error:
             pass
         self.model_win.refresh()
     
     def get_model_in(self):
+        if self.chat.catalog is not None:
+            self.chat.catalog.refresh()
         self.model_in_buffer = ""
+        self.model_sel = 0
+        self.model_note = ""
         curses.curs_set(1)
         self.model_win.nodelay(False)
         try:
             while True:
-                self.model_win.move(3,4)
-                self.model_win.addstr(3,4," " * 52)
-                self.model_win.move(3,4)
-                if self.model_in_buffer:
-                    self.model_win.addstr(3,4,self.model_in_buffer[:52],curses.color_pair(5))
-                else:
-                    self.model_win.addstr(3,4,"openai/gpt-5.1",curses.color_pair(5) | curses.A_DIM)
-                cursor_pos = min(len(self.model_in_buffer),52)
-                self.model_win.move(3,4 + cursor_pos)
+                self.draw_model_sel()
+                self.model_win.move(3,4 + min(len(self.model_in_buffer),62))
                 self.model_win.refresh()
+                self.model_win.timeout(-1 if self.chat.catalog is None or self.chat.catalog.loaded.is_set() else 200)
                 ch = self.model_win.getch()
+                if ch == -1:
+                    continue # catalogue still loading, redraw when it lands
+                matches = self.model_matches()
                 if ch == 27:
-                    return None
+                    seq = self.read_escape(self.model_win)
+                    if seq == "":
+                        return None
+                    if seq in ("[A","OA"):
+                        self.model_sel = max(0,self.model_sel - 1)
+                    elif seq in ("[B","OB"):
+                        self.model_sel = min(max(0,len(matches) - 1),self.model_sel + 1)
+                    continue
                 elif ch == 10 or ch == curses.KEY_ENTER:
-                    return self.model_in_buffer if self.model_in_buffer else None
+                    if matches:
+                        return matches[min(self.model_sel,len(matches) - 1)]
+                    if not self.model_in_buffer:
+                        return None
+                    if self.chat.catalog and self.chat.catalog.models and not self.model_note:
+                        # probably a typo, make them confirm it
+                        self.model_note = "not in the endpoint's model list, ENTER again to use it anyway"
+                        continue
+                    return self.model_in_buffer
                 elif ch == curses.KEY_BACKSPACE or ch == 127 or ch == 8:
                     if self.model_in_buffer:
                         self.model_in_buffer = self.model_in_buffer[:-1]
                 elif 32 <= ch <= 126:
-                    if len(self.model_in_buffer) < 52:
+                    if len(self.model_in_buffer) < 62:
                         self.model_in_buffer += chr(ch)
+                else:
+                    continue
+                self.model_sel = 0
+                self.model_note = ""
         except KeyboardInterrupt:
             return None
         finally:
@@ -445,7 +2933,7 @@ class UI:
                     return None
                 elif ch == 10 or ch == curses.KEY_ENTER:
                     if self.search_in_buffer:
-                        self.perf_search()
+                        self.perf_search(semantic=True) # related chats too, not just exact matches
                         self.draw_search()
                 elif ch >= ord('1') and ch <= ord('9'):
                     result_num = ch - ord('1')
@@ -471,35 +2959,13 @@ class UI:
             self.search_in_buffer = ""
             self.search_results = []
     
-    def perf_search(self):
-        query = self.search_in_buffer.lower()
-        self.search_results = []
-        for idx,chat in enumerate(self.chat_mgr.chats):
-            title = chat.get('title', '').lower()
-            if query in title:
-                self.search_results.append((idx,title[:50]))
-                continue
-            for msg in chat.get('messages', []):
-                content = msg.get('content','').lower()
-                if query in content:
-                    match_pos = content.find(query)
-                    start = max(0,match_pos - 20)
-                    end = min(len(content),match_pos + 30)
-                    snippet = content[start:end]
-                    self.search_results.append((idx,snippet))
-                    break
+    def perf_search(self,semantic=False):
+        self.search_results = self.chat_mgr.search(self.search_in_buffer,semantic=semantic)
     
     def handle_scroll(self,direction):
         if not self.current_res:
             return
-        max_width = (self.width * 2)//3 - 4
-        lines = []
-        for pg in self.current_res.split('\n'):
-            if pg:
-                wrapped = textwrap.wrap(pg,width=max_width)
-                lines.extend(wrapped)
-            else:
-                lines.append(wrapped)
+        lines = self.wrap_lines(self.current_res)
         max_y = self.res_win.getmaxyx()[0]-2
         max_scroll = max(0,len(lines) - max_y)
         if direction == 'up':
@@ -550,102 +3016,376 @@ class UI:
         if self.show_file_atch:
             self.draw_file_atch()
     
-    def get_input(self):
+    def sync_loaded(self):
+        # hook the current chat's history up once chatMgr finishes loading in the background
+        if self.chats_ready or not self.chat_mgr.loaded.is_set():
+            return False
+        self.chats_ready = True
+        self.chat.open(self.chat_mgr.get_cur_chat())
+        self.draw_chats()
+        if self.on_ready:
+            self.on_ready()
+        return True
+
+    def idle_tick(self):
+        # runs whenever we're waiting for keys and the poll timeout expires
+        if self.sync_loaded():
+            if self.chat_mgr.load_error:
+                self.status_msg = self.chat_mgr.load_error
+            elif self.chat_mgr.recovered:
+                n = self.chat_mgr.recovered
+                self.status_msg = f"put back {n} unfinished {'reply' if n == 1 else 'replies'} from last time - '::continue' finishes it"
+            return True
+        compactor = self.chat_mgr.compactor
+        if compactor and compactor.done:
+            compactor.done.clear()
+            self.status_msg = "older messages summarised and moved to cold storage, the summary is pinned to the chat"
+            self.v_msg_idx = -1 # the messages before the one being viewed may have gone
+            self.draw_res()
+            self.draw_input()
+        titler = self.chat_mgr.titler
+        if titler and titler.done:
+            titler.done.clear()
+            self.draw_chats()
+        self.chat_mgr.flush_cur()
+        if self.chat_mgr.poll_changes():
+            # another shellLLM saved, pick up new chats/messages without a reload
+            self.chat.open(self.chat_mgr.get_cur_chat())
+            if self.v_msg_idx == -1:
+                for msg in reversed(self.chat.convo_history):
+                    if msg['role'] == 'assistant':
+                        self.show_msg(msg)
+                        break
+            self.draw_chats()
+            self.draw_res()
+            return True
+        return False
+
+    def set_input_rows(self,rows):
+        # the input box grows upwards (over the bottom of the chat/response panes) for multiline prompts
+        h = rows + 2
+        if self.input_win.getmaxyx()[0] == h:
+            return
+        shrunk = h < self.input_win.getmaxyx()[0]
+        self.input_win = self.newwin(h,self.width,self.height - h,0)
+        if shrunk:
+            self.draw_chats()
+            self.draw_res()
+
+    def read_escape(self,win=None):
+        # the rest of an escape sequence, as a string ('' for a lone esc). the input window
+        # has no keypad() so arrows etc. arrive raw, e.g. '[D' or '[1;5C'
+        win = win or self.input_win
+        win.nodelay(True)
+        try:
+            ch = win.getch()
+            if ch == -1:
+                return ""
+            seq = chr(ch)
+            if ch in (ord('['),ord('O')):
+                while True:
+                    ch = win.getch()
+                    if ch == -1:
+                        break
+                    seq += chr(ch)
+                    if 0x40 <= ch <= 0x7e:
+                        break
+            return seq
+        finally:
+            win.nodelay(False)
+
+    def read_paste(self):
+        # everything up to the terminal's end-of-paste marker, decoded in one go
+        data = bytearray()
+        self.input_win.timeout(200)
+        while not data.endswith(b'\x1b[201~'):
+            ch = self.input_win.getch()
+            if ch == -1:
+                break
+            if 0 <= ch < 256:
+                data.append(ch)
+        if data.endswith(b'\x1b[201~'):
+            del data[-6:]
+        text = data.decode('utf-8','replace')
+        return text.replace('\r\n','\n').replace('\r','\n')
+
+    def read_burst(self,first):
+        # terminals without bracketed paste send a paste as a stream of keys. take all the
+        # plain keys that are already waiting so they're inserted with one repaint; an enter
+        # with more text right behind it is part of the paste, not a submit
+        chars = [chr(first)]
+        self.input_win.nodelay(True)
+        try:
+            while True:
+                ch = self.input_win.getch()
+                if ch == -1:
+                    break
+                if ch in (10,13):
+                    nxt = self.input_win.getch()
+                    if nxt == -1:
+                        self.ungetch(ch)
+                        break
+                    chars.append('\n')
+                    ch = nxt
+                if 32 <= ch <= 126 or ch == 9:
+                    chars.append(chr(ch))
+                else:
+                    self.ungetch(ch)
+                    break
+        finally:
+            self.input_win.nodelay(False)
+        return "".join(chars)
+
+    def draw_prompt(self,buf):
+        text = buf.text()
+        lines = text.split('\n')
+        before = text[:buf.cursor]
+        row = before.count('\n')
+        col = len(before) - before.rfind('\n') - 1
+        rows = max(1,min(len(lines),(self.height - 6) // 2))
+        self.set_input_rows(rows)
+        max_in_width = self.width - 10
+        if row < self.input_top:
+            self.input_top = row
+        elif row >= self.input_top + rows:
+            self.input_top = row - rows + 1
+        self.input_top = max(0,min(self.input_top,len(lines) - rows))
+        if col < self.input_left:
+            self.input_left = col
+        elif col >= self.input_left + max_in_width:
+            self.input_left = col - max_in_width + 1
+        left = self.input_left
+        win = self.input_win
+        win.erase()
+        win.border()
+        try:
+            win.addstr(0,2,f"{self.status_msg} ",curses.color_pair(4))
+        except curses.error:
+            pass
+        try:
+            win.addstr(1,2,"You: ",curses.color_pair(2)|curses.A_BOLD)
+            for y,line in enumerate(lines[self.input_top:self.input_top + rows]):
+                vis_txt = line[left:left + max_in_width].replace('\t',' ')
+                win.addstr(1 + y,7,vis_txt)
+                if left > 0 and line:
+                    win.addstr(1 + y,6,"<",curses.color_pair(4))
+                if len(line) > left + max_in_width:
+                    win.addstr(1 + y,7 + len(vis_txt),">",curses.color_pair(4))
+            if len(lines) > rows:
+                win.addstr(rows + 1,self.width - 14,f" {row + 1}/{len(lines)} ",curses.color_pair(4))
+        except curses.error:
+            pass
+        win.move(1 + row - self.input_top,7 + col - left)
+        win.refresh()
+
+    def reverse_search(self,buf):
+        # ctrl+r: search back through history as you type, ctrl+r again for an older match.
+        # enter or an arrow key keeps the match for editing, esc puts back what was there
+        orig = buf.text()
+        status = self.status_msg
+        query = ""
+        found = None # (text, seq)
+        try:
+            while True:
+                self.status_msg = f"history search: '{query}'" + (" (no match)" if query and not found else "")
+                self.draw_prompt(gapBuffer(found[0] if found else orig))
+                ch = self.input_win.getch()
+                while ch == -1:
+                    ch = self.input_win.getch()
+                if ch == 18:
+                    older = self.history.search(query,before=found[1]) if found else None
+                    found = older or found
+                elif ch == curses.KEY_BACKSPACE or ch == 127 or ch == 8:
+                    query = query[:-1]
+                    found = self.history.search(query)
+                elif 32 <= ch <= 126:
+                    query += chr(ch)
+                    found = self.history.search(query)
+                elif ch == 7 or (ch == 27 and self.read_escape() == ""): # ctrl+g / esc
+                    return
+                else:
+                    break
+            if found:
+                buf.set(found[0])
+        finally:
+            self.status_msg = status
+
+    def get_input(self,text=""):
         self.input_buffer = ""
         self.status_msg = "type a message and press enter, or type '::nav' to enter navigation mode. type '::help' for help."
-        max_in_width = self.width - 10
-        view_offset = 0
-        auto_scroll = True
+        buf = gapBuffer(text)
+        recall = None # history entries, only fetched once you press up
+        recall_pos = 0
+        draft = ""
+        self.input_top = 0
+        self.input_left = 0
+        paste_mode = sys.stdout.isatty()
+        if paste_mode:
+            sys.stdout.write("\x1b[?2004h") # bracketed paste
+            sys.stdout.flush()
         curses.curs_set(1)
         try:
+            redraw = True
             while True:
-                cursor_pos = len(self.input_buffer)
-                vis_start = view_offset
-                vis_end = view_offset + max_in_width
-                vis_txt = self.input_buffer[vis_start:vis_end]
-                self.input_win.clear()
-                self.input_win.border()
-                try:
-                    self.input_win.addstr(0,2,f"{self.status_msg} ",curses.color_pair(4))
-                except curses.error:
-                    pass
-                prompt = "You: "
-                try:
-                    self.input_win.addstr(1,2,prompt,curses.color_pair(2)|curses.A_BOLD)
-                    self.input_win.addstr(1,7,vis_txt)
-                    if view_offset > 0:
-                        self.input_win.addstr(1,6,"<",curses.color_pair(4))
-                    if len(self.input_buffer) > vis_end:
-                        self.input_win.addstr(1,7 + len(vis_txt), ">",curses.color_pair(4))
-                except curses.error:
-                    pass
-                cursor_scr_pos = min(7 + len(vis_txt), 7 + max_in_width - 1)
-                self.input_win.move(1,cursor_scr_pos)
-                self.input_win.refresh()
+                if redraw:
+                    self.draw_prompt(buf)
+                redraw = True
+                self.input_win.timeout(1000 if self.chats_ready else 50)
                 ch = self.input_win.getch()
-                if ch == 10 or ch == curses.KEY_ENTER:
+                if ch == -1:
+                    redraw = self.idle_tick()
+                    continue
+                if ch in (10,13) or ch == curses.KEY_ENTER:
                     break
                 elif ch == 27:
-                    self.input_win.nodelay(True)
-                    next_ch = self.input_win.getch()
-                    if next_ch == -1:
-                        self.input_win.nodelay(False)
+                    seq = self.read_escape()
+                    if seq == "":
                         return None
-                    elif next_ch == ord('['):
-                        third_ch = self.input_win.getch()
-                        self.input_win.nodelay(False)
-                        if third_ch == ord('D'): # left arrow
-                            view_offset = max(0,view_offset - 10)
-                            auto_scroll = False
-                        elif third_ch == ord('C'): # right arrow
-                            max_offset = max(0,len(self.input_buffer) - max_in_width)
-                            view_offset = min(view_offset + 10,max_offset)
-                            if view_offset >= max_offset:
-                                auto_scroll = True
-                        continue
+                    if seq == "[200~":
+                        buf.insert(self.read_paste())
+                    elif seq in ("\n","\r"): # alt+enter
+                        buf.insert("\n")
+                    elif seq == "\x7f": # alt+backspace
+                        buf.backspace(buf.cursor - buf.word_left())
+                    elif seq in ("[D","OD"):
+                        buf.move_to(buf.cursor - 1)
+                    elif seq in ("[C","OC"):
+                        buf.move_to(buf.cursor + 1)
+                    elif seq in ("b","[1;5D","[1;3D"):
+                        buf.move_to(buf.word_left())
+                    elif seq in ("f","[1;5C","[1;3C"):
+                        buf.move_to(buf.word_right())
+                    elif seq in ("[A","OA"):
+                        if not buf.move_line(-1): # already on the top line, go back through history
+                            if recall is None:
+                                recall = self.history.entries()
+                                recall_pos = len(recall)
+                            if recall_pos == len(recall):
+                                draft = buf.text()
+                            if recall_pos > 0:
+                                recall_pos -= 1
+                                buf.set(recall[recall_pos])
+                    elif seq in ("[B","OB"):
+                        if not buf.move_line(1) and recall is not None and recall_pos < len(recall):
+                            recall_pos += 1
+                            buf.set(recall[recall_pos] if recall_pos < len(recall) else draft)
+                    elif seq in ("[H","OH","[1~","[7~"):
+                        buf.move_to(buf.line_start())
+                    elif seq in ("[F","OF","[4~","[8~"):
+                        buf.move_to(buf.line_end())
+                    elif seq == "[3~":
+                        buf.delete()
                     else:
-                        self.input_win.nodelay(False)
-                        continue
+                        redraw = False
                 elif ch == curses.KEY_BACKSPACE or ch == 127 or ch == 8:
-                    if len(self.input_buffer) > 0:
-                        self.input_buffer = self.input_buffer[:-1]
-                        if auto_scroll:
-                            view_offset = max(0,len(self.input_buffer) - max_in_width)
-                elif 32 <= ch <= 126:
-                    self.input_buffer += chr(ch)
-                    if auto_scroll:
-                        if len(self.input_buffer) > max_in_width:
-                            view_offset = len(self.input_buffer) - max_in_width
+                    buf.backspace()
+                elif ch == 1: # ctrl+a
+                    buf.move_to(buf.line_start())
+                elif ch == 5: # ctrl+e
+                    buf.move_to(buf.line_end())
+                elif ch == 4: # ctrl+d
+                    buf.delete()
+                elif ch == 11: # ctrl+k
+                    buf.delete(buf.line_end() - buf.cursor)
+                elif ch == 21: # ctrl+u
+                    buf.backspace(buf.cursor - buf.line_start())
+                elif ch == 23: # ctrl+w
+                    buf.backspace(buf.cursor - buf.word_left())
+                elif ch == 18: # ctrl+r
+                    self.reverse_search(buf)
+                elif 32 <= ch <= 126 or ch == 9:
+                    buf.insert(self.read_burst(ch))
+                else:
+                    redraw = False
+            self.input_buffer = buf.text()
+            self.history.add(self.input_buffer.strip())
             return self.input_buffer.strip()
         except KeyboardInterrupt:
             return None
         finally:
+            if paste_mode:
+                sys.stdout.write("\x1b[?2004l")
+                sys.stdout.flush()
+            self.set_input_rows(1)
             curses.curs_set(0)
          
-    def show_streaming(self,msg_gen):
-        self.current_res = ""
+    def show_streaming(self,msg_gen,prefix=""):
+        # returns the error if the reply failed or was cut off, after putting it in the status line
+        self.current_res = prefix
         self.status_msg = "AI is responding..."
-        for chunk in msg_gen:
-            self.current_res += chunk
-            self.draw_res()
-            self.draw_input()
-        self.status_msg = "Ready"
+        self.streaming = True
+        last_h = 0
+        err = None
+        try:
+            for chunk in msg_gen:
+                if isinstance(chunk,toolConfirm):
+                    # the full call is the end of the reply so far (wrapped), scroll so it's on screen
+                    lines = self.wrap_lines(self.current_res,None)
+                    self.scroll_offset = max(0,len(lines) - (self.res_win.getmaxyx()[0] - 2))
+                    self.draw_res()
+                    chunk.allowed = self.ask_yes(f"allow the {chunk.label.split()[0]} call shown above? (y/n)")
+                    self.status_msg = "AI is responding..."
+                    continue
+                self.current_res += chunk
+                t0 = time.perf_counter()
+                self.draw_res()
+                self.draw_input()
+                self.chat.tracer.frame(time.perf_counter() - t0)
+                # live stats in the header, but not every frame
+                if t0 - last_h > 0.25:
+                    self.draw_h()
+                    last_h = t0
+        except Exception as e:
+            err = e
+        finally:
+            self.streaming = False
+        self.draw_h()
+        if err is None:
+            self.status_msg = "Ready"
+        elif self.chat.can_continue():
+            self.status_msg = f"reply cut off ({err}) - type '::continue' to finish it"
+        else:
+            self.status_msg = f"error: {err}"
         self.draw_input()
+        return err
     
+    def ask_yes(self,question):
+        # y/n in the status line, anything other than y is a no
+        self.status_msg = question
+        self.draw_input()
+        self.input_win.timeout(-1)
+        try:
+            ch = self.input_win.getch()
+        except KeyboardInterrupt:
+            ch = -1
+        return ch in (ord('y'),ord('Y'))
+
     def handle_sinput(self):
         #self.status_msg = "arrow keys: navigate chats, ESC: exit nav mode, enter: select, n: new, d: delete, q: quit"
         #self.draw_input()
+        self.stdscr.timeout(0)
         key = self.stdscr.getch()
+        if key == -1 or key not in (curses.KEY_UP,curses.KEY_DOWN):
+            self.finish_pending()
+        self.stdscr.timeout(1000)
+        while key == -1:
+            if self.idle_tick():
+                return 'refresh'
+            key = self.stdscr.getch()
+        self.stdscr.timeout(-1)
+        if self.show_help and key in (ord('j'),ord('k')):
+            self.scroll_help(1 if key == ord('j') else -1)
+            return 'toggle_help'
         if key == curses.KEY_UP:
             if self.chat_mgr.cur_chat_idx > 0:
                 self.chat_mgr.cur_chat_idx -= 1
-                self.chat_mgr.save_chats()
+                self.chat_mgr.note_cur_changed()
                 self.v_msg_idx = -1
                 return 'switch'
         elif key == curses.KEY_DOWN:
             if self.chat_mgr.cur_chat_idx < len(self.chat_mgr.chats) -1:
                 self.chat_mgr.cur_chat_idx += 1
-                self.chat_mgr.save_chats()
+                self.chat_mgr.note_cur_changed()
                 self.v_msg_idx = -1
                 return 'switch'
         elif key == ord('u') or key == ord('U'):
@@ -674,10 +3414,13 @@ class UI:
             return 'scroll'
         elif key == ord('r') or key == ord('R'):
             return 'regen'
+        elif key == ord('b') or key == ord('B'):
+            return 'branch'
         elif key == ord('i') or key == ord('I'):
             return 'toggle_stats'
         elif key == ord('h') or key == ord('H'):
             self.show_help = not self.show_help
+            self.help_scroll = 0
             return 'toggle_help'
         elif key == ord('n'):
             return 'new'
@@ -701,43 +3444,10 @@ class UI:
         self.help_win.clear()
         self.help_win.border()
         self.help_win.attron(curses.color_pair(6) | curses.A_BOLD)
-        self.help_win.addstr(0,2," HELP - press 'h' to toggle", curses.color_pair(6))
+        self.help_win.addstr(0,2," HELP - press 'h' to toggle, j/k to scroll", curses.color_pair(6))
         self.help_win.attroff(curses.color_pair(6) | curses.A_BOLD)
-        help_txt = [ # fancy shmancy am i right
-            "normal mode:",
-            " - type your message and press enter",
-            " - type '::nav' to enter navigation mode",
-            " - type '::clear' to clear chat history",
-            " - type '::model' to change model",
-            " - type '::n' to make a new chat",
-            " - type '::d' to delete the selected chat",
-            " - type '::search' or '::search <query>' to search",
-            " - type '::regen' to regenerate last response",
-            " - type '::stats' to view convo stats (wrapped fr)",
-            " - type '::attach' or '::a' to attach a file",
-            " - type '::clear-attach' to clear attachments",
-            " - type '::help' for help",
-            "",
-            "navigation mode:",
-            " - up/down arrow keys: navigate chats",
-            " - j/k keys: scroll response by line",
-            " - w/s keys: scroll response by page",
-            " - g/G keys: jump to top/bottom of response",
-            " - n: new chat",
-            " - m: change model",
-            " - d: delete selected chat",
-            " - ESC: exit nav mode",
-            " - h: show help window",
-            " - f: search through chats",
-            " - a: attach file",
-            " - r: regenerate last response",
-            " - i: show convo stats (wrapped fr)",
-            " - u/p keys: navigate through response history",
-            " - q: quit shellLLM"
-        ]
-        for i, line in enumerate(help_txt, start=1):
-            if i > 30:
-                break
+        max_lines = self.help_win.getmaxyx()[0] - 2
+        for i, line in enumerate(self.help_txt[self.help_scroll:self.help_scroll + max_lines], start=1):
             try:
                 if line and not line.startswith(" "):
                     self.help_win.addstr(i,2,line,curses.color_pair(2)|curses.A_BOLD)
@@ -746,6 +3456,57 @@ class UI:
             except curses.error:
                 pass
         self.help_win.refresh()
+
+    def scroll_help(self,step):
+        max_scroll = max(0,len(self.help_txt) - (self.help_win.getmaxyx()[0] - 2))
+        self.help_scroll = min(max_scroll,max(0,self.help_scroll + step))
+
+    help_txt = [ # fancy shmancy am i right
+        "normal mode:",
+        " - type your message and press enter",
+        " - type '::nav' to enter navigation mode",
+        " - type '::clear' to clear chat history",
+        " - type '::model' to change model",
+        " - type '::n' to make a new chat",
+        " - type '::d' to delete the selected chat",
+        " - type '::search' or '::search <query>' to search",
+        " - type '::regen' to regenerate last response",
+        " - type '::edit' or '::edit <n>' to change a prompt",
+        " - type '::alt' or '::alt <n>' to switch versions",
+        " - type '::continue' to finish a cut off response",
+        " - type '::stats' to view convo stats (wrapped fr)",
+        " - type '::attach' or '::a' to attach a file",
+        " - type '::clear-attach' to clear attachments",
+        " - type '::workspace <folder>' to add relevant files",
+        " - type '::tools on|off|<folder>' to let the model",
+        "   read files and run commands there",
+        " - type '::compact' to summarise older messages",
+        " - type '::profile' to start/stop profiling",
+        " - type '::help' for help",
+        " - arrows, home/end: move the cursor",
+        " - ctrl+left/right or alt+b/f: jump by words",
+        " - ctrl+w: delete word, ctrl+u/k: delete to start/end",
+        " - alt+enter: new line",
+        " - up/down: previous prompts, ctrl+r: search them",
+        "",
+        "navigation mode:",
+        " - up/down arrow keys: navigate chats",
+        " - j/k keys: scroll response by line",
+        " - w/s keys: scroll response by page",
+        " - g/G keys: jump to top/bottom of response",
+        " - n: new chat",
+        " - m: change model",
+        " - d: delete selected chat",
+        " - ESC: exit nav mode",
+        " - h: show help window",
+        " - f: search through chats",
+        " - a: attach file",
+        " - r: regenerate last response",
+        " - b: switch to another version of the reply",
+        " - i: show convo stats (wrapped fr)",
+        " - u/p keys: navigate through response history",
+        " - q: quit shellLLM"
+    ]
     
     def draw_stats(self):
         if not self.show_stats:
@@ -756,18 +3517,19 @@ class UI:
         self.stats_win.addstr(0,2," conversation stats (wrapped?) ",curses.color_pair(6))
         self.stats_win.attroff(curses.color_pair(6) | curses.A_BOLD)
         t_chats = len(self.chat_mgr.chats)
-        t_msgs = sum(len(chat.get('messages',[])) for chat in self.chat_mgr.chats)
-        t_user_msgs = sum(len([m for m in chat.get('messages',[]) if m['role'] == 'user']) for chat in self.chat_mgr.chats)
-        t_ai_msgs = sum(len([m for m in chat.get('messages',[]) if m['role'] == 'assistant']) for chat in self.chat_mgr.chats)
+        t_msgs = sum(chat_msg_count(chat) for chat in self.chat_mgr.chats)
+        t_user_msgs = sum(chat_msg_count(chat,'user') for chat in self.chat_mgr.chats)
+        t_ai_msgs = sum(chat_msg_count(chat,'assistant') for chat in self.chat_mgr.chats)
+        t_archived = sum(1 for chat in self.chat_mgr.chats if chat.get('archived'))
         avg_msgs = t_msgs / t_chats if t_chats > 0 else 0
-        most_active = max(self.chat_mgr.chats,key=lambda c:len(c.get('messages',[])), default=None)
+        most_active = max(self.chat_mgr.chats,key=chat_msg_count, default=None)
         most_active_title = most_active.get('title','N/A')[:40] if most_active else 'N/A'
-        most_active_count = len(most_active.get('messages',[])) if most_active else 0
+        most_active_count = chat_msg_count(most_active) if most_active else 0
         sorted_chats = sorted([c for c in self.chat_mgr.chats if c.get('timestamp')],key=lambda c: c.get('timestamp',''))
         oldest = sorted_chats[0] if sorted_chats else None
         newest = sorted_chats[-1] if sorted_chats else None
         stats_txt = [
-            f"total chats: {t_chats}",
+            f"total chats: {t_chats} ({t_archived} archived)",
             f"total messages: {t_msgs}",
             f" - user messages: {t_user_msgs}",
             f" - AI messages: {t_ai_msgs}",
@@ -779,6 +3541,17 @@ class UI:
             "",
             f"current model: {self.chat.model}"
         ]
+        local = self.chat.local
+        if local is not None and local.available():
+            stats_txt.append(f"local model: {local.model} ({local.mode})")
+        for route in ('local','remote'):
+            ttft = self.chat.tracer.ttft_stats(route)
+            if ttft:
+                stats_txt.append(f"ttft {route}: {ttft[0]:.2f}s median, {ttft[1]:.2f}s p95 ({ttft[2]} replies)")
+        summary = self.chat.chat_rec.get('summary') if self.chat.chat_rec else None
+        if summary and apply_summary(self.chat.convo_history,summary) is not self.chat.convo_history:
+            folded = summary.get('folded',0)
+            stats_txt.append(f"summary: covers the first {folded + summary['upto']} messages, {folded} of them in cold storage")
         if oldest:
             oldest_date = oldest.get('timestamp','')[:10]
             stats_txt.extend([
@@ -789,7 +3562,7 @@ class UI:
             newest_date = newest.get('timestamp','')[:10]
             stats_txt.append(f"newest chat: {newest_date}")
         for i, line in enumerate(stats_txt,start=2):
-            if i > 17:
+            if i > 21:
                 break
             try:
                 if ':' in line and not line.startswith(' '):
@@ -802,7 +3575,7 @@ class UI:
             except curses.error:
                 pass
         try:
-            self.stats_win.addstr(18,2,"press any key to close", curses.color_pair(4) | curses.A_DIM)
+            self.stats_win.addstr(22,2,"press any key to close", curses.color_pair(4) | curses.A_DIM)
         except curses.error:
             pass
         self.stats_win.refresh()
@@ -889,72 +3662,1239 @@ class UI:
         if self.v_msg_idx == -1:
             for msg in reversed(self.chat.convo_history):
                 if msg['role'] == 'assistant':
-                    self.current_res = msg['content']
+                    self.show_msg(msg)
                     break
             self.status_msg = "viewing latest message"
         else:
             actual_idx,msg = ai_msgs[self.v_msg_idx]
-            self.current_res = msg['content']
+            self.show_msg(msg)
             self.status_msg = f"viewing message {self.v_msg_idx + 1}/{len(ai_msgs)} (up/down arrow keys to navigate)"
         self.scroll_offset = 0
 
+def store_lock(path,exclusive=True):
+    # advisory lock on <path>.lock so several shellLLM processes can share one chats.json
+    import contextlib
+
+    @contextlib.contextmanager
+    def locked():
+        try:
+            fd = os.open(f"{path}.lock",os.O_RDWR | os.O_CREAT,0o644)
+        except OSError:
+            yield # read-only directory, nothing could be writing here anyway
+            return
+        try:
+            try:
+                import fcntl
+                fcntl.flock(fd,fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            except ImportError:
+                import msvcrt # windows: no shared locks, always exclusive
+                msvcrt.locking(fd,msvcrt.LK_LOCK,1)
+            yield
+        finally:
+            os.close(fd) # closing the fd drops the lock
+    return locked()
+
+class chatArchive:
+    # append-only compressed segment for old chats, one json line per chat. uses zstd
+    # (chats.archive.zst) when the zstandard package is installed, gzip otherwise. both
+    # formats allow appending a new compressed frame/member without rewriting the file.
+    # the same format holds the turns summaries took out of long chats (chats.turns.zst)
+    def __init__(self,chats_file,name='archive'):
+        stem = os.path.splitext(chats_file)[0]
+        self.zst_path = f"{stem}.{name}.zst"
+        self.gz_path = f"{stem}.{name}.gz"
+
+    @staticmethod
+    def zstd():
+        try:
+            import zstandard
+            return zstandard
+        except ImportError:
+            return None
+
+    @property
+    def path(self):
+        if os.path.exists(self.zst_path):
+            return self.zst_path
+        if os.path.exists(self.gz_path) or self.zstd() is None:
+            return self.gz_path
+        return self.zst_path
+
+    def usable(self):
+        return self.path.endswith('.gz') or self.zstd() is not None
+
+    def write_lines(self,path,chats,mode):
+        data = "".join(json.dumps(chat,default=json_default) + "\n" for chat in chats).encode('utf-8')
+        if path.endswith('.zst'):
+            with open(path,mode) as raw:
+                with self.zstd().ZstdCompressor(level=10).stream_writer(raw,closefd=False) as w:
+                    w.write(data)
+        else:
+            import gzip
+            with gzip.open(path,mode) as f:
+                f.write(data)
+
+    def append(self,chats):
+        self.write_lines(self.path,chats,'ab')
+
+    def iter_chats(self):
+        # streams the segment one chat at a time, never holding the whole archive in memory
+        import io
+        path = self.path
+        if not os.path.exists(path) or not self.usable():
+            return
+        if path.endswith('.zst'):
+            with open(path,'rb') as raw:
+                reader = self.zstd().ZstdDecompressor().stream_reader(raw,read_across_frames=True)
+                for line in io.TextIOWrapper(reader,encoding='utf-8'):
+                    if line.strip():
+                        yield json.loads(line)
+        else:
+            import gzip
+            with gzip.open(path,'rt',encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+
+    def rewrite(self,keep,key=lambda c: c['id']):
+        # drops stale copies (chats restored to the hot file or archived again since), and
+        # of several copies of one chat keeps the newest
+        tmp_path = f"{self.path}.tmp"
+        kept = {}
+        for c in self.iter_chats():
+            if keep(c):
+                kept.pop(key(c),None)
+                kept[key(c)] = c
+        kept = list(kept.values())
+        self.write_lines(tmp_path,kept,'wb')
+        os.replace(tmp_path,self.path)
+        return len(kept)
+
+def text_chunks(text,size=800):
+    # (offset, piece) pairs of about `size` characters, cut at a newline or space where possible
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(len(text),start + size)
+        if end < len(text):
+            cut = text.rfind('\n',start + size // 2,end)
+            if cut == -1:
+                cut = text.rfind(' ',start + size // 2,end)
+            if cut != -1:
+                end = cut
+        piece = text[start:end].strip()
+        if piece:
+            chunks.append((start,piece))
+        start = end
+    return chunks
+
+def hashed_embedding(text,dim=256):
+    # offline stand-in for an embeddings model: hashed words plus their character trigrams,
+    # so "timeouts" still lands near "proxy_read_timeout". it knows no synonyms though
+    import re, zlib, math
+    vec = [0.0] * dim
+    for word in re.findall(r'[a-z0-9]+',text.lower()):
+        padded = f"#{word}#"
+        feats = [(word,1.0)] + [(padded[i:i+3],0.5) for i in range(len(word))]
+        for feat,weight in feats:
+            h = zlib.crc32(feat.encode())
+            vec[h % dim] += weight if h & 0x80000000 else -weight
+    norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+    return [v / norm for v in vec]
+
+class chatIndex:
+    # semantic search over message text. each message is chunked, each chunk embedded (through
+    # the endpoint's /embeddings when SHELLLLM_EMBED_MODEL is set, hashed locally otherwise) and
+    # appended as a float32 row to chats.vec, with a json line per row in chats.vec.jsonl saying
+    # which chat/message it came from. rows of edited, moved or deleted messages are marked dead
+    # with an {"x": [rows]} line and the files are rewritten once most rows are dead. with numpy
+    # the rows are memory-mapped and scored in one matrix-vector product, without it they're
+    # scored in plain python
+    def __init__(self,chat_mgr,api_key=None,base_url=None,model=None,session=None):
+        stem = os.path.splitext(chat_mgr.chats_file)[0]
+        self.vec_path = f"{stem}.vec"
+        self.meta_path = f"{stem}.vec.jsonl"
+        self.chat_mgr = chat_mgr
+        self.api_key = api_key
+        self.base_url = base_url
+        self.session = session
+        self.model = model if model is not None else os.environ.get('SHELLLLM_EMBED_MODEL','')
+        self.embedder = f"api:{self.model}" if self.model else "hashed-256"
+        self.dim = None if self.model else 256
+        self.min_score = 0.5 if self.model else 0.25
+        self.rows = [] # (chat id, message index, offset) per vector, None once it's dead
+        self.live = {} # chat id -> {(message index, offset, chunk hash): row}
+        self.dead = 0
+        self.gen = None # changes whenever the files are rewritten
+        self.meta_size = 0
+        self.lock = threading.Lock()
+        self.mat = None
+        self.queue = None
+        self.ready = threading.Event()
+
+    def start(self):
+        import queue
+        self.queue = queue.Queue()
+        threading.Thread(target=self.run,name='shellLLM-indexer',daemon=True).start()
+
+    def note(self,chat):
+        if self.queue is not None:
+            self.queue.put(chat['id'])
+
+    def run(self):
+        try:
+            self.chat_mgr.wait_loaded()
+            self.load()
+            seen = set()
+            for chat in self.chat_mgr.iter_all_chats():
+                seen.add(chat['id'])
+                self.index_chat(chat)
+            for chat_id in set(self.live) - seen:
+                self.drop(chat_id)
+            self.compact()
+        except Exception:
+            pass # search just stays lexical
+        finally:
+            self.ready.set()
+        while True:
+            chat_id = self.queue.get()
+            try:
+                idx,chat = self.chat_mgr.find_chat(chat_id)
+                if chat is None:
+                    self.drop(chat_id)
+                elif not chat.get('archived'):
+                    self.index_chat(chat)
+            except Exception:
+                pass # picked up again the next time the chat is saved
+
+    def load(self):
+        try:
+            with open(self.meta_path,'r',encoding='utf-8') as f:
+                head = json.loads(f.readline() or '{}')
+        except (OSError,ValueError):
+            head = {}
+        if head.get('embedder') != self.embedder:
+            self.reset()
+            return
+        self.dim = head['dim']
+        with store_lock(self.vec_path,exclusive=False):
+            self.sync_meta()
+
+    def reset(self):
+        # new index, or the embedder changed so the old vectors mean nothing
+        with store_lock(self.vec_path):
+            for path in (self.vec_path,self.meta_path):
+                if os.path.exists(path):
+                    os.remove(path)
+        with self.lock:
+            self.forget(None)
+
+    def forget(self,gen):
+        self.rows = []
+        self.live = {}
+        self.dead = 0
+        self.gen = gen
+        self.meta_size = 0
+        self.mat = None
+
+    def sync_meta(self):
+        # pick up lines appended since we last looked, ours or another shellLLM's. starts
+        # over if the files were rewritten in the meantime
+        try:
+            vec_rows = os.path.getsize(self.vec_path) // (4 * self.dim)
+            with open(self.meta_path,'rb') as f:
+                gen = json.loads(f.readline() or b'{}').get('gen')
+                if gen != self.gen:
+                    with self.lock:
+                        self.forget(gen)
+                f.seek(self.meta_size)
+                data = f.read()
+        except (OSError,ValueError):
+            return
+        entries = []
+        used = 0
+        for line in data.splitlines(keepends=True):
+            if not line.endswith(b'\n'):
+                break
+            used += len(line)
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue
+        with self.lock:
+            for entry in entries:
+                if 'c' in entry and len(self.rows) < vec_rows:
+                    self.live.setdefault(entry['c'],{})[(entry['m'],entry['o'],entry['h'])] = len(self.rows)
+                    self.rows.append((entry['c'],entry['m'],entry['o']))
+                elif 'x' in entry:
+                    for row in entry['x']:
+                        if 0 <= row < len(self.rows) and self.rows[row] is not None:
+                            chat_id,m,off = self.rows[row]
+                            live = self.live.get(chat_id,{})
+                            for key in [k for k,r in live.items() if r == row]:
+                                del live[key]
+                            if not live:
+                                self.live.pop(chat_id,None)
+                            self.rows[row] = None
+                            self.dead += 1
+            self.meta_size += used
+
+    def chunks(self,chat):
+        # {(message index, offset, chunk hash): text} for what the chat says now
+        import hashlib
+        want = {}
+        for m,msg in enumerate(chat.get('messages',[])):
+            for off,piece in text_chunks(msg_text(msg.get('content'))):
+                want[(m,off,hashlib.sha1(piece.encode()).hexdigest()[:16])] = piece
+        return want
+
+    def index_chat(self,chat):
+        # brings the chat's rows in line with its messages: chunks that were edited away or
+        # moved to another message index die, text that only moved keeps its old vector
+        want = self.chunks(chat)
+        with self.lock:
+            have = dict(self.live.get(chat['id'],{}))
+        known = {h for m,off,h in have}
+        todo = sorted({h: piece for (m,off,h),piece in want.items() if h not in known}.items())
+        vecs = {}
+        for i in range(0,len(todo),64):
+            batch = todo[i:i+64]
+            vecs.update(zip([h for h,piece in batch],self.embed([piece for h,piece in batch])))
+        if vecs or set(have) != set(want):
+            self.update(chat['id'],want,vecs)
+
+    def drop(self,chat_id):
+        # the chat is gone
+        self.update(chat_id,{},{})
+
+    def update(self,chat_id,want,vecs):
+        from array import array
+        with store_lock(self.vec_path):
+            if self.dim is None:
+                if not vecs:
+                    return
+                self.dim = len(next(iter(vecs.values())))
+            if not os.path.exists(self.meta_path):
+                with open(self.meta_path,'w',encoding='utf-8') as f:
+                    f.write(json.dumps({'embedder': self.embedder,'dim': self.dim,'gen': self.gen}) + '\n')
+            self.sync_meta() # under the lock now, so the rows can't shift under us
+            with self.lock:
+                have = dict(self.live.get(chat_id,{}))
+            stale = sorted(row for key,row in have.items() if key not in want)
+            reuse = {h: row for (m,off,h),row in have.items()}
+            add = []
+            out = array('f')
+            with open(self.vec_path,'ab+') as f:
+                for key in sorted(want):
+                    if key in have:
+                        continue
+                    h = key[2]
+                    if h in vecs:
+                        out.extend(vecs[h])
+                    elif h in reuse:
+                        f.seek(reuse[h] * 4 * self.dim)
+                        out.frombytes(f.read(4 * self.dim))
+                    else:
+                        continue # another shellLLM dropped the row we meant to copy, next save
+                    add.append(key)
+                if not add and not stale:
+                    return
+                out.tofile(f) # append mode, so this lands at the end whatever we read
+            with open(self.meta_path,'a',encoding='utf-8') as f:
+                for m,off,h in add:
+                    f.write(json.dumps({'c': chat_id,'m': m,'o': off,'h': h}) + '\n')
+                if stale:
+                    f.write(json.dumps({'x': stale}) + '\n')
+            self.sync_meta()
+
+    def compact(self):
+        # rewrites both files without the dead rows once they're most of the index
+        if self.dead < 256 or self.dead < len(self.rows) // 2:
+            return
+        from array import array
+        with store_lock(self.vec_path):
+            self.sync_meta()
+            with self.lock:
+                keep = [(key,chat_id,row) for chat_id,live in self.live.items() for key,row in live.items()]
+            keep.sort(key=lambda k: k[2])
+            out = array('f')
+            with open(self.vec_path,'rb') as f:
+                for key,chat_id,row in keep:
+                    f.seek(row * 4 * self.dim)
+                    out.frombytes(f.read(4 * self.dim))
+            gen = os.urandom(4).hex()
+            with open(f"{self.vec_path}.tmp",'wb') as f:
+                out.tofile(f)
+            with open(f"{self.meta_path}.tmp",'w',encoding='utf-8') as f:
+                f.write(json.dumps({'embedder': self.embedder,'dim': self.dim,'gen': gen}) + '\n')
+                for (m,off,h),chat_id,row in keep:
+                    f.write(json.dumps({'c': chat_id,'m': m,'o': off,'h': h}) + '\n')
+            # vectors first: a reader that sees the new meta must find the new rows too
+            os.replace(f"{self.vec_path}.tmp",self.vec_path)
+            os.replace(f"{self.meta_path}.tmp",self.meta_path)
+            self.sync_meta()
+
+    def embed(self,texts):
+        if not self.model:
+            return [hashed_embedding(t,self.dim) for t in texts]
+        import math
+        session = self.session or requests
+        res = session.post(f"{self.base_url}/embeddings",headers={"Authorization": f"Bearer {self.api_key}","Content-Type": "application/json"},
+                           json={"model": self.model,"input": texts},timeout=30)
+        res.raise_for_status()
+        vecs = [d['embedding'] for d in sorted(res.json()['data'],key=lambda d: d.get('index',0))]
+        out = []
+        for vec in vecs:
+            norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+            out.append([v / norm for v in vec])
+        return out
+
+    def scores(self,q,n,gen):
+        # (row, cosine similarity) for the best rows out of the first n
+        try:
+            import numpy as np
+        except ImportError:
+            np = None
+        if self.mat is not None and self.mat[0] != gen:
+            self.mat = None
+        if np is not None:
+            if self.mat is None or self.mat[1].shape[0] != n:
+                self.mat = (gen,np.memmap(self.vec_path,dtype=np.float32,mode='r',shape=(n,self.dim)))
+            sims = self.mat[1] @ np.asarray(q,dtype=np.float32)
+            top = np.argpartition(-sims,min(200,n - 1))[:200]
+            return [(int(i),float(sims[i])) for i in top]
+        from array import array
+        if self.mat is None or len(self.mat[1]) != n * self.dim:
+            mat = array('f')
+            with open(self.vec_path,'rb') as f:
+                mat.fromfile(f,n * self.dim)
+            self.mat = (gen,mat)
+        d = self.dim
+        mat = self.mat[1]
+        return [(i,sum(a * b for a,b in zip(mat[i*d:(i+1)*d],q))) for i in range(n)]
+
+    def query(self,text,limit=10):
+        # best (score, chat id, message index, offset) per chat, most similar first
+        with self.lock:
+            rows = list(self.rows)
+            gen = self.gen
+        if not rows or not text.strip():
+            return []
+        q = self.embed([text])[0]
+        best = {}
+        for i,score in self.scores(q,len(rows),gen):
+            if rows[i] is None:
+                continue
+            chat_id = rows[i][0]
+            if score >= self.min_score and score > best.get(chat_id,(0,))[0]:
+                best[chat_id] = (score,) + rows[i]
+        return sorted(best.values(),reverse=True)[:limit]
+
+class replyJournal:
+    # write-ahead files for replies that are still streaming (inflight/<chat id>.jsonl), so a crash,
+    # ctrl+c or a closed terminal loses at most the last moment of a reply. a reply starts its file
+    # with the turn it belongs to (the prompt, and any tool rounds before it), then appends what's
+    # arrived every SHELLLLM_CHECKPOINT tokens or milliseconds ("tokens=32,ms=500"): one small append
+    # per checkpoint, however long the chat. the file goes once a save has the reply, and anything
+    # left at the next start is put back into its chat, marked incomplete so '::continue' finishes it
+    def __init__(self,folder=None):
+        self.folder = folder or data_path('inflight')
+        self.every = {'tokens': 32.0, 'ms': 500.0}
+        for item in os.environ.get('SHELLLLM_CHECKPOINT','').split(','):
+            if '=' in item:
+                key,val = item.split('=',1)
+                try:
+                    self.every[key.strip()] = float(val)
+                except ValueError:
+                    pass
+        self.open = {} # chat id -> [file, pending text, chunks pending, time of last write]
+        self.ended = set() # chat ids whose reply is done streaming but maybe not saved yet
+        self.lock = threading.Lock()
+
+    def path(self,chat_id):
+        return os.path.join(self.folder,f"{chat_id}.jsonl")
+
+    @staticmethod
+    def try_lock(f):
+        # held for as long as the file is open, so another shellLLM doesn't recover a reply
+        # that's still streaming
+        try:
+            import fcntl
+        except ImportError:
+            return True
+        try:
+            fcntl.flock(f.fileno(),fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def begin(self,chat_id,msgs,at,cont,route='remote'):
+        # msgs[at] is the reply (already there when continuing one)
+        start = at
+        while start > 0 and msgs[start - 1]['role'] != 'user':
+            start -= 1
+        start = max(start - 1,0)
+        turn = msgs[start:at + 1 if cont else at]
+        head = {'chat': chat_id,'start': start,'at': at,'cont': cont,'route': route,'turn': turn}
+        with self.lock:
+            self._close(chat_id)
+            self.ended.discard(chat_id)
+            try:
+                os.makedirs(self.folder,exist_ok=True)
+                f = open(self.path(chat_id),'w',encoding='utf-8')
+                self.try_lock(f)
+                f.write(json.dumps(head,default=json_default) + "\n")
+                f.flush()
+            except OSError:
+                return # best effort, the reply still streams
+            self.open[chat_id] = [f,[],0,time.monotonic()]
+
+    def add(self,chat_id,text):
+        entry = self.open.get(chat_id)
+        if entry is None:
+            return
+        entry[1].append(text)
+        entry[2] += 1
+        if entry[2] >= self.every['tokens'] or (time.monotonic() - entry[3]) * 1000 >= self.every['ms']:
+            self.write(entry)
+
+    def write(self,entry):
+        if not entry[1]:
+            return
+        try:
+            entry[0].write(json.dumps({'d': ''.join(entry[1])}) + "\n")
+            entry[0].flush()
+        except (OSError,ValueError):
+            pass
+        entry[1] = []
+        entry[2] = 0
+        entry[3] = time.monotonic()
+
+    def end(self,chat_id):
+        # the reply stopped (finished, failed or cancelled) and is in memory, the file stays
+        # until a save has it
+        with self.lock:
+            entry = self.open.get(chat_id)
+            if entry is not None:
+                self.write(entry)
+                self.ended.add(chat_id)
+
+    def ended_now(self):
+        with self.lock:
+            return set(self.ended)
+
+    def saved(self,chat_ids):
+        # a save that started after these replies ended has them
+        with self.lock:
+            for chat_id in chat_ids:
+                if chat_id in self.ended:
+                    self.ended.discard(chat_id)
+                    self._close(chat_id)
+                    try:
+                        os.remove(self.path(chat_id))
+                    except OSError:
+                        pass
+
+    def _close(self,chat_id):
+        entry = self.open.pop(chat_id,None)
+        if entry is not None:
+            try:
+                entry[0].close()
+            except OSError:
+                pass
+
+    def recover(self,chats):
+        # replies a previous session didn't get to save, back into their chats (a chat that was
+        # never saved at all comes back as a new one). returns how many. a file is only deleted
+        # once its reply is in a chat; one that can't be put back is kept as <chat id>.jsonl.bad
+        try:
+            names = sorted(os.listdir(self.folder))
+        except OSError:
+            return 0
+        by_id = {chat['id']: chat for chat in chats}
+        count = 0
+        for name in names:
+            if not name.endswith('.jsonl'):
+                continue
+            path = os.path.join(self.folder,name)
+            try:
+                with open(path,'r+',encoding='utf-8') as f:
+                    if not self.try_lock(f):
+                        continue # another shellLLM is still streaming it
+                    head = None
+                    parts = []
+                    for line in f:
+                        try:
+                            rec = json.loads(line)
+                        except ValueError:
+                            break # the write that was cut off
+                        if head is None:
+                            head = rec
+                        else:
+                            parts.append(rec.get('d',''))
+                    result = 'stale'
+                    chat = by_id.get(head.get('chat')) if isinstance(head,dict) else None
+                    if chat is None and isinstance(head,dict) and head.get('start') == 0:
+                        chat = {"id": head['chat'],"title": "New Chat","messages": [],"timestamp": datetime.now().isoformat(),"version": 0}
+                        result = self.merge(chat,head,''.join(parts))
+                        if result == 'merged':
+                            chat['title'] = chat_title(chat['messages']) or "New Chat"
+                            chats.insert(0,chat)
+                    elif chat is not None and not chat.get('archived'):
+                        result = self.merge(chat,head,''.join(parts))
+                if result == 'merged':
+                    count += 1
+                if result == 'stale':
+                    os.replace(path,f"{path}.bad")
+                else:
+                    os.remove(path)
+            except (OSError,KeyError,TypeError,ValueError):
+                pass # left where it is, tried again next time
+        return count
+
+    @staticmethod
+    def merge(chat,head,text):
+        # 'merged' if what's saved is still the start of that turn (the reply wasn't saved after
+        # all, and nobody has moved the chat on since), 'saved' if the chat already has all of
+        # it, 'stale' if the chat has gone another way and the reply doesn't fit any more
+        msgs = chat['messages']
+        start,at = head['start'],head['at']
+        turn = as_msgs(list(head['turn']))
+        tail = msgs[start:]
+        before = turn[at - start]['content'] if head.get('cont') else ""
+        if len(msgs) > at and tail[:at - start] == turn[:at - start] and isinstance(msgs[at]['content'],str) \
+                and msgs[at]['content'].startswith(before + text):
+            return 'saved'
+        if len(msgs) < start or len(tail) > len(turn) or tail != turn[:len(tail)]:
+            return 'stale'
+        if not text and len(tail) == len(turn):
+            return 'saved' # nothing had arrived, and the prompt is there
+        msgs[start:] = turn
+        if text:
+            if not head.get('cont'):
+                msgs.append(chatMsg("assistant",""))
+            msgs[at]['content'] += text
+            msgs[at]['incomplete'] = True
+            if head.get('route') == 'local':
+                msgs[at]['route'] = 'local'
+        chat['version'] = chat.get('version',0) + 1
+        chat['timestamp'] = datetime.now().isoformat()
+        return 'merged'
+
 class chatMgr:
-    def __init__(self):
+    def __init__(self,tracer=None,background=False,chats_file=None,journal=None):
         self.chats = []
         self.cur_chat_idx = 0
-        self.chats_file = os.path.join(os.path.dirname(__file__), 'chats.json')
-        self.load_chats()
+        self.tracer = tracer
+        self.chats_file = chats_file or data_path('chats.json')
+        self.save_lock = threading.Lock()
+        # held for any change to self.chats or a chat dict, and while they're written out:
+        # json can't write a dict another thread is adding keys to. only ever held briefly
+        # and taken last, after save_lock/store_lock/chat_lock
+        self.data_lock = threading.RLock()
+        self.chat_locks = {}
+        self.chat_locks_guard = threading.Lock()
+        self.disk_stat = None
+        self.base = {} # chat id -> (version, message count) as last seen on disk
+        self.deleted = set()
+        self.last_poll = 0.0
+        self.load_error = None
+        self.archive = chatArchive(self.chats_file)
+        self.cold = chatArchive(self.chats_file,'turns') # turns summaries took out of long chats
+        self.archive_days = float(os.environ.get('SHELLLLM_ARCHIVE_DAYS','30'))
+        self.archive_text = None
+        self.compactor = None
+        self.titler = None
+        self.index = None
+        self.cur_changed_at = None
+        self.journal = journal # replyJournal, when replies are checkpointed while they stream
+        self.recovered = 0
+        self.loaded = threading.Event()
+        if background:
+            # lets the UI paint before a big chats.json is parsed
+            threading.Thread(target=self.load_chats,daemon=True).start()
+        else:
+            self.load_chats()
     
     def load_chats(self):
-        if os.path.exists(self.chats_file):
+        chats = []
+        cur_idx = 0
+        try:
+            with store_lock(self.chats_file,exclusive=False):
+                chats,cur_idx = self.read_disk()
+        except FileNotFoundError:
+            pass
+        except (OSError,ValueError) as e:
+            # don't quietly start over on top of a broken file, move it aside and say so
+            bad_path = f"{self.chats_file}.corrupt-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
             try:
-                with open(self.chats_file, 'r') as f:
-                    data = json.load(f)
-                    self.chats = data.get('chats',[])
-                    self.cur_chat_idx = data.get('cur',0)
-            except:
-                pass
-        if not self.chats:
-            self.chats = [{"title": "New Chat", "messages": [], "timestamp": datetime.now().isoformat()}]
+                os.replace(self.chats_file,bad_path)
+                self.load_error = f"chats.json was unreadable ({e}), moved to {os.path.basename(bad_path)}"
+            except OSError:
+                self.load_error = f"chats.json is unreadable: {e}"
+        if self.journal is not None and not self.load_error:
+            self.recovered = self.journal.recover(chats)
+        if not chats:
+            chats = [self.blank_chat()]
+        self.chats = chats
+        self.cur_chat_idx = min(max(0,cur_idx),len(chats) - 1)
+        if self.recovered:
+            self.save_chats()
+        if self.archive_days > 0 and not self.load_error:
+            self.archive_old(self.archive_days)
+        self.loaded.set()
+        if not self.load_error and os.path.exists(self.cold.path):
+            self.compact_cold()
+
+    def read_disk(self):
+        st = os.stat(self.chats_file)
+        with open(self.chats_file, 'r') as f:
+            data = json.load(f)
+        chats = data.get('chats',[])
+        for chat in chats:
+            chat.setdefault('id',new_chat_id())
+            chat.setdefault('version',0)
+            as_msgs(chat.setdefault('messages',[]))
+            as_branches(chat.get('branches',[]))
+        self.disk_stat = (st.st_mtime_ns,st.st_size)
+        self.base = {c['id']: (c['version'],len(c.get('messages',[]))) for c in chats}
+        return chats,data.get('current',data.get('cur',0))
+
+    def wait_loaded(self):
+        self.loaded.wait()
+
+    def merge_msgs(self,ours,theirs):
+        # message level merge: keep the shared prefix, then their new messages, then ours
+        common = 0
+        for a,b in zip(ours,theirs):
+            if a != b:
+                break
+            common += 1
+        return theirs + ours[common:]
+
+    def merge_disk(self,disk_chats):
+        # fold another instance's saved chats into ours. returns True if ours changed
+        with self.data_lock:
+            return self._merge_disk(disk_chats)
+
+    def _merge_disk(self,disk_chats):
+        changed = False
+        cur_id = self.chats[self.cur_chat_idx]['id'] if self.chats else None
+        ours = {c['id']: c for c in self.chats}
+        on_disk = set()
+        added = []
+        for d in disk_chats:
+            on_disk.add(d['id'])
+            if d['id'] in self.deleted:
+                continue
+            mine = ours.get(d['id'])
+            if mine is None:
+                added.append(d)
+                changed = True
+                continue
+            base_ver,_ = self.base.get(d['id'],(0,0))
+            if d['version'] <= base_ver:
+                continue # nobody else touched it
+            if mine.get('version',0) <= base_ver:
+                # only they changed it, update in place so anything holding the list sees it
+                mine['messages'][:] = d.get('messages',[])
+                for key in ('title','titled','timestamp','version','archived','msg_count','stats','content_hash','summary','branches'):
+                    if key in d:
+                        mine[key] = d[key]
+                    else:
+                        mine.pop(key,None)
+            else:
+                theirs = d.get('messages',[])
+                folded = (mine.get('summary') or {}).get('folded',0)
+                if (d.get('summary') or {}).get('folded',0) > folded:
+                    # they moved turns to cold storage, take their summary and drop those turns here
+                    mine['messages'][:] = unfold(mine['messages'],d['summary'])
+                    for key in ('summary','branches'):
+                        if key in d:
+                            mine[key] = d[key]
+                        else:
+                            mine.pop(key,None)
+                elif folded:
+                    theirs = unfold(theirs,mine['summary'])
+                mine['messages'][:] = self.merge_msgs(mine['messages'],theirs)
+                mine['version'] = max(mine['version'],d['version']) + 1
+            changed = True
+        for chat in list(self.chats):
+            # gone from disk since we last looked = deleted elsewhere, unless we've changed it since
+            if chat['id'] in self.base and chat['id'] not in on_disk and chat.get('version',0) <= self.base[chat['id']][0]:
+                if chat['id'] != cur_id or len(self.chats) > 1:
+                    self.chats.remove(chat)
+                    changed = True
+        if added:
+            self.chats[0:0] = added
+        if changed and self.chats:
+            ids = [c['id'] for c in self.chats]
+            self.cur_chat_idx = ids.index(cur_id) if cur_id in ids else min(self.cur_chat_idx,len(self.chats) - 1)
+        for d in disk_chats:
+            self.base[d['id']] = (d['version'],len(d.get('messages',[])))
+        return changed
+
+    def poll_changes(self,min_interval=1.0):
+        # cheap check for saves from another shellLLM instance, a stat() unless the file changed
+        now = time.monotonic()
+        if now - self.last_poll < min_interval or not self.loaded.is_set():
+            return False
+        self.last_poll = now
+        try:
+            st = os.stat(self.chats_file)
+        except OSError:
+            return False
+        if (st.st_mtime_ns,st.st_size) == self.disk_stat:
+            return False
+        try:
+            with self.save_lock:
+                with store_lock(self.chats_file,exclusive=False):
+                    base = dict(self.base)
+                    disk_chats,_ = self.read_disk()
+                self.base = base
+                return self.merge_disk(disk_chats)
+        except (OSError,ValueError):
+            return False
     
+    def blank_chat(self):
+        return {"id": new_chat_id(), "title": "New Chat", "messages": [], "timestamp": datetime.now().isoformat(), "version": 1}
+
+    def chat_lock(self,chat_id):
+        # one lock per chat, so the server can update different chats at the same time
+        with self.chat_locks_guard:
+            if chat_id not in self.chat_locks:
+                self.chat_locks[chat_id] = threading.RLock()
+            return self.chat_locks[chat_id]
+
+    def find_chat(self,chat_id):
+        for idx,chat in enumerate(self.chats):
+            if chat.get('id') == chat_id:
+                return idx,chat
+        return None,None
+
     def save_chats(self):
+        t0 = time.perf_counter()
         try:
-            with open(self.chats_file, 'w') as f:
-                json.dump({'chats': self.chats, 'current': self.cur_chat_idx}, f,indent=2)
-        except:
-            pass
+            with self.save_lock:
+                with store_lock(self.chats_file):
+                    try:
+                        st = os.stat(self.chats_file)
+                        if (st.st_mtime_ns,st.st_size) != self.disk_stat:
+                            # someone else saved since we last looked, merge their changes first
+                            base = dict(self.base)
+                            disk_chats,_ = self.read_disk()
+                            self.base = base
+                            self.merge_disk(disk_chats)
+                    except FileNotFoundError:
+                        pass
+                    ended = self.journal.ended_now() if self.journal is not None else ()
+                    # write to a temp file and swap it in, so a crash never leaves half a file
+                    with self.data_lock:
+                        blob = json.dumps({'chats': self.chats, 'current': self.cur_chat_idx},indent=2,default=json_default)
+                    tmp_path = f"{self.chats_file}.tmp"
+                    with open(tmp_path, 'w') as f:
+                        f.write(blob)
+                        size = f.tell()
+                    os.replace(tmp_path,self.chats_file)
+                    st = os.stat(self.chats_file)
+                    self.disk_stat = (st.st_mtime_ns,st.st_size)
+                    self.base = {c['id']: (c.get('version',0),len(c.get('messages',[]))) for c in self.chats}
+                    self.deleted.clear()
+                    self.cur_changed_at = None
+                    if ended:
+                        self.journal.saved(ended)
+        except (OSError,ValueError):
+            return
+        if self.tracer:
+            self.tracer.timed_save(time.perf_counter() - t0,size)
     
+    def note_cur_changed(self):
+        # the selected chat moved, save that later instead of once per keypress
+        self.cur_changed_at = time.monotonic()
+
+    def flush_cur(self,delay=1.0):
+        if self.cur_changed_at is not None and time.monotonic() - self.cur_changed_at >= delay:
+            self.save_chats()
+
     def get_cur_chat(self):
-        return self.chats[self.cur_chat_idx]
-    
-    def upd_cur_chat(self,msgs):
         chat = self.chats[self.cur_chat_idx]
+        self.ensure_loaded(chat)
+        return chat
+
+    def archive_old(self,days):
+        # moves chats nobody has touched in `days` days out of chats.json into the
+        # compressed archive, leaving a stub with the title and stats in the hot index
+        if not self.archive.usable():
+            return 0
+        cutoff = (datetime.now() - timedelta(days=days)).isoformat()
+        cur = self.chats[self.cur_chat_idx] if self.chats else None
+        old = [c for c in self.chats if c is not cur and not c.get('archived') and c.get('messages') and c.get('timestamp','') < cutoff]
+        if not old:
+            return 0
+        try:
+            with self.save_lock:
+                with store_lock(self.chats_file):
+                    self.archive.append(old)
+        except OSError:
+            return 0
+        with self.data_lock:
+            for chat in old:
+                chat['content_hash'] = chat_hash(chat['messages'])
+                chat['stats'] = {'user': chat_msg_count(chat,'user'), 'assistant': chat_msg_count(chat,'assistant')}
+                chat['msg_count'] = len(chat['messages'])
+                chat['archived'] = True
+                chat['messages'] = []
+                chat.pop('branches',None)
+        self.archive_text = None
+        self.save_chats()
+        self.compact_archive()
+        return len(old)
+
+    def compact_cold(self):
+        # drops the cold turns of chats deleted or cleared since, and copies left behind
+        # by folds that didn't go through
+        folded = {c['id']: (c.get('summary') or {}).get('folded',0) for c in self.chats}
+        live = lambda rec: rec['from'] < folded.get(rec['id'],0)
+        total = kept = 0
+        for rec in self.cold.iter_chats():
+            total += 1
+            kept += live(rec)
+        if total > 2 * kept: # more than half of it is dead weight
+            try:
+                with self.save_lock:
+                    with store_lock(self.chats_file):
+                        self.cold.rewrite(live,key=lambda rec: (rec['id'],rec['from']))
+            except OSError:
+                pass
+
+    def compact_archive(self):
+        live = {c['id']: c.get('version',0) for c in self.chats if c.get('archived')}
+        total = sum(1 for _ in self.archive.iter_chats())
+        if total > 2 * max(1,len(live)):
+            try:
+                with self.save_lock:
+                    with store_lock(self.chats_file):
+                        self.archive.rewrite(lambda c: live.get(c['id']) == c.get('version',0))
+            except OSError:
+                pass
+
+    def ensure_loaded(self,chat):
+        # pulls an archived chat's messages back out of the archive when it's opened
+        if not chat.get('archived'):
+            return True
+        found = None
+        for old in self.archive.iter_chats():
+            if old['id'] == chat['id'] and old.get('version',0) == chat.get('version',0):
+                found = old
+        if found is None:
+            return False
+        with self.data_lock:
+            chat['messages'] = as_msgs(found.get('messages',[]))
+            if found.get('branches'):
+                chat['branches'] = as_branches(found['branches'])
+            for key in ('archived','msg_count','stats','content_hash'):
+                chat.pop(key,None)
+            # opening it counts as touching it: it isn't archived again on the next start, and
+            # when it is, that copy is newer than the one already in the archive
+            chat['version'] = chat.get('version',0) + 1
+            chat['timestamp'] = datetime.now().isoformat()
+        if self.archive_text:
+            self.archive_text.pop(chat['id'],None)
+        return True
+    
+    def upd_cur_chat(self,msgs,model=None):
+        self.upd_chat(self.chats[self.cur_chat_idx],msgs,model)
+
+    def upd_chat(self,chat,msgs,model=None):
+        with self.chat_lock(chat['id']),self.data_lock:
+            self._upd_chat(chat,msgs,model)
+        self.save_chats()
+
+    def _upd_chat(self,chat,msgs,model=None):
+        replaced = msgs is not chat.get('messages')
+        if replaced:
+            msgs = unfold(msgs,chat.get('summary'))
         chat['messages'] = msgs
-        for msg in msgs:
-            if msg['role'] == 'user':
-                content = msg['content'][:30] + "..." if len(msg['content']) > 30 else msg['content']
-                chat['title'] = content
-                break
+        if replaced:
+            drop_stale(chat)
+        chat['version'] = chat.get('version',0) + 1
+        if model:
+            chat['model'] = model
+        if self.compactor:
+            self.compactor.consider(chat)
+        if self.index:
+            self.index.note(chat)
+        if not msgs:
+            chat['title'] = "New Chat"
+            chat.pop('titled',None)
+        elif not chat.get('titled'):
+            # worked out once from the first message, then stored with the chat
+            title = chat_title(msgs)
+            if title:
+                chat['title'] = title
+                chat['titled'] = 'first message'
+        if self.titler:
+            self.titler.consider(chat)
         chat['timestamp'] = datetime.now().isoformat()
-        self.save_chats()
     
     def new_chat(self):
-        self.chats.insert(0,{"title": "New Chat", "messages": [], "timestamp": datetime.now().isoformat()})
-        self.cur_chat_idx = 0
+        with self.data_lock:
+            self.chats.insert(0,self.blank_chat())
+            self.cur_chat_idx = 0
         self.save_chats()
     
     def switch_chat(self,idx):
         if 0 <= idx < len(self.chats):
             self.cur_chat_idx = idx
+            self.ensure_loaded(self.chats[idx])
             self.save_chats()
             return True
         return False
 
+    def archived_text(self):
+        # lowercased text of archived chats, built on the first search that needs it
+        if self.archive_text is None:
+            live = {c['id']: c.get('version',0) for c in self.chats if c.get('archived')}
+            text = {}
+            if live:
+                for old in self.archive.iter_chats():
+                    if live.get(old['id']) == old.get('version',0):
+                        text[old['id']] = [msg_text(m.get('content')).lower() for m in old.get('messages',[])]
+            self.archive_text = text
+        return self.archive_text
+
+    def search(self,query,semantic=False):
+        query = query.lower()
+        results = []
+        for idx,chat in enumerate(self.chats):
+            title = chat.get('title', '').lower()
+            if query in title:
+                results.append((idx,title[:50]))
+                continue
+            if chat.get('archived'):
+                texts = self.archived_text().get(chat['id'],[])
+            else:
+                texts = (msg_low(msg) for msg in chat.get('messages', []))
+            for content in texts:
+                if query in content:
+                    match_pos = content.find(query)
+                    start = max(0,match_pos - 20)
+                    end = min(len(content),match_pos + 30)
+                    snippet = content[start:end]
+                    results.append((idx,snippet))
+                    break
+        if semantic and self.index is not None:
+            results.extend(self.related(query,{idx for idx,snippet in results}))
+        return results
+
+    def related(self,query,skip=()):
+        # chats the semantic index thinks are about the query, for the ones substring search missed
+        try:
+            hits = self.index.query(query)
+        except Exception:
+            return []
+        results = []
+        for score,chat_id,m,off in hits:
+            idx,chat = self.find_chat(chat_id)
+            if chat is None or idx in skip:
+                continue
+            if chat.get('archived'):
+                texts = self.archived_text().get(chat_id,[])
+                text = texts[m] if m < len(texts) else ""
+            else:
+                msgs = chat.get('messages',[])
+                text = msg_low(msgs[m]) if m < len(msgs) else ""
+            results.append((idx,text[off:off + 50]))
+        return results
+
+    def set_title(self,chat,title):
+        with self.chat_lock(chat['id']),self.data_lock:
+            chat['title'] = title
+            chat['titled'] = 'model'
+            chat['version'] = chat.get('version',0) + 1
+        self.save_chats()
+
+    def set_summary(self,chat,summary):
+        # the turns a summary covers move out of chats.json (and memory) into cold storage,
+        # the chat keeps the summary and a count of the turns that went (summary['folded'])
+        msgs = list(chat.get('messages',[]))
+        upto = summary['upto']
+        if upto > len(msgs) or chat_hash(msgs[:upto]) != summary['hash']:
+            return False # the chat changed while it was being summarised
+        old = chat.get('summary') or {}
+        folded = old.get('folded',0)
+        # turns branches fork off from stay, they're shared with the other versions
+        n = min([upto] + [b['at'] for b in chat.get('branches',[])]) if self.cold.usable() else 0
+        if n:
+            try:
+                with self.save_lock:
+                    with store_lock(self.chats_file):
+                        self.cold.append([{'id': chat['id'],'from': folded,'messages': msgs[:n]}])
+            except OSError:
+                n = 0
+        with self.chat_lock(chat['id']),self.data_lock:
+            cur = chat['messages']
+            if n and len(cur) >= upto and cur[:upto] == msgs[:upto]:
+                rebase_branches(chat.get('branches',[]),cur,n)
+                del cur[:n] # in place, mainChat holds the same list
+                summary = dict(summary,upto=upto - n,hash=chat_hash(msgs[n:upto]),folded=folded + n,
+                               cut={'n': n,'hash': chat_hash(msgs[:n])[:16]})
+            elif apply_summary(cur,summary) is cur:
+                return False
+            elif folded:
+                summary = dict(summary,folded=folded,cut=old.get('cut'))
+            chat['summary'] = summary
+            chat['version'] = chat.get('version',0) + 1
+        self.save_chats()
+        return True
+
+    def cold_turns(self,chats):
+        # chat id -> the turns summaries moved out of it, oldest first, in one pass over the
+        # cold store
+        want = {c['id']: c['summary']['folded'] for c in chats if (c.get('summary') or {}).get('folded')}
+        parts = {}
+        if want:
+            for rec in self.cold.iter_chats():
+                if rec['from'] < want.get(rec['id'],0):
+                    parts.setdefault(rec['id'],{})[rec['from']] = rec['messages']
+        turns = {}
+        for chat_id,by_start in parts.items():
+            msgs = []
+            for start in sorted(by_start):
+                if start == len(msgs):
+                    msgs.extend(as_msgs(by_start[start]))
+            turns[chat_id] = msgs
+        return turns
+
+    def full_chat(self,chat,cold):
+        # the chat with its cold turns back in front, as if nothing had been moved out
+        if not cold:
+            return chat
+        import copy
+        full = dict(chat,messages=cold + chat.get('messages',[]))
+        summary = {k: v for k,v in chat['summary'].items() if k not in ('folded','cut')}
+        summary['upto'] += len(cold)
+        summary['hash'] = chat_hash(full['messages'][:summary['upto']])
+        full['summary'] = summary
+        if chat.get('branches'):
+            full['branches'] = copy.deepcopy(chat['branches'])
+            rebase_branches(full['branches'],chat['messages'],head=cold)
+        return full
+
+    def iter_all_chats(self):
+        # every chat with its messages: hot ones from memory, archived ones streamed
+        # out of the archive one at a time
+        live = {}
+        for chat in self.chats:
+            if chat.get('archived'):
+                live[chat['id']] = chat.get('version',0)
+            else:
+                yield chat
+        if live:
+            for old in self.archive.iter_chats():
+                if live.get(old['id']) == old.get('version',0):
+                    del live[old['id']] # stale copies can follow, only take the live one once
+                    yield old
+
+    def export_chats(self,out,since=None,until=None,model=None,query=None):
+        count = 0
+        query = query.lower() if query else None
+        cold = self.cold_turns(self.chats)
+        for chat in self.iter_all_chats():
+            chat = self.full_chat(chat,cold.get(chat['id']))
+            stamp = chat.get('timestamp','')
+            if since and stamp < since:
+                continue
+            if until and stamp[:len(until)] > until:
+                continue
+            if model and model.lower() not in chat.get('model','').lower():
+                continue
+            if query and query not in chat.get('title','').lower() and not any(query in msg_low(m) for m in chat.get('messages',[])):
+                continue
+            rec = dict(chat,content_hash=chat_hash(chat.get('messages',[])))
+            out.write(json.dumps(rec,ensure_ascii=False,default=json_default) + "\n")
+            count += 1
+        return count
+
+    def import_chats(self,lines,batch_size=100):
+        # imports exported chats line by line. chats already here (same content hash) are
+        # skipped, so importing the same export twice does nothing. old chats go straight
+        # into the archive in batches instead of piling up in memory
+        seen = {c['content_hash'] for c in self.chats if c.get('content_hash')}
+        # chats archived before hashes were kept need hashing from the archive itself
+        need_archive = any(c.get('archived') and not c.get('content_hash') for c in self.chats)
+        cold = self.cold_turns(self.chats)
+        for chat in (self.iter_all_chats() if need_archive else self.chats):
+            if not chat.get('archived'):
+                seen.add(chat_hash(cold.get(chat['id'],[]) + chat.get('messages',[])))
+        ids = {c['id'] for c in self.chats}
+        cutoff = (datetime.now() - timedelta(days=self.archive_days)).isoformat() if self.archive_days > 0 and self.archive.usable() else None
+        added = skipped = 0
+        to_archive = []
+
+        def flush():
+            if to_archive:
+                with self.save_lock:
+                    with store_lock(self.chats_file):
+                        self.archive.append(to_archive)
+                to_archive.clear()
+
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                chat = json.loads(line)
+            except json.JSONDecodeError:
+                skipped += 1
+                continue
+            msgs = chat.get('messages')
+            if not isinstance(msgs,list):
+                skipped += 1
+                continue
+            digest = chat_hash(msgs)
+            if digest in seen:
+                skipped += 1
+                continue
+            seen.add(digest)
+            chat.pop('content_hash',None)
+            if not chat.get('id') or chat['id'] in ids:
+                chat['id'] = new_chat_id()
+            ids.add(chat['id'])
+            chat['version'] = chat.get('version',0) or 1
+            chat.setdefault('title','New Chat')
+            chat.setdefault('timestamp',datetime.now().isoformat())
+            if cutoff and chat['timestamp'] < cutoff and msgs:
+                to_archive.append(dict(chat))
+                chat['content_hash'] = digest
+                chat['stats'] = {'user': chat_msg_count(chat,'user'), 'assistant': chat_msg_count(chat,'assistant')}
+                chat['msg_count'] = len(msgs)
+                chat['archived'] = True
+                chat['messages'] = []
+                chat.pop('branches',None)
+                if len(to_archive) >= batch_size:
+                    flush()
+            else:
+                as_msgs(msgs)
+                as_branches(chat.get('branches',[]))
+            self.chats.append(chat)
+            added += 1
+        flush()
+        if added:
+            self.archive_text = None
+            self.save_chats()
+        return added,skipped
+
     def del_cur_chat(self):
         if len(self.chats) > 1:
-            del self.chats[self.cur_chat_idx]
-            self.cur_chat_idx = min(self.cur_chat_idx,len(self.chats)-1)
+            chat = self.chats[self.cur_chat_idx]
+            self.deleted.add(chat['id'])
+            with self.data_lock:
+                del self.chats[self.cur_chat_idx]
+                self.cur_chat_idx = min(self.cur_chat_idx,len(self.chats)-1)
             self.save_chats()
+            if self.index:
+                self.index.note(chat) # its rows go
             return True
         return False
 
@@ -987,11 +4927,660 @@ class fileHandler:
             return 'text','text/plain'
         return 'unknown', None
     
-def main_tui(stdscr):
+class workspaceIndex:
+    # BM25 index over the text files of one folder, so each message can bring along the few
+    # pieces of it that look relevant instead of whole attached files. per-file term counts
+    # are kept in workspaces/<id>.json next to chats.json, and a file is only re-read when
+    # its mtime or size changed (and only re-chunked when its contents did). after the first
+    # pass the stat walk runs in the background, never on the way to sending a message
+    skip_dirs = {'node_modules','__pycache__','venv','dist','build','target','workspaces'}
+    max_bytes = 512 * 1024
+    chunk_lines = 40
+    max_chunk_chars = 4000 # files with very long lines
+
+    def __init__(self,root,top_k=4,store_dir=None):
+        import hashlib
+        self.root = os.path.abspath(os.path.expanduser(root))
+        self.top_k = top_k
+        store_dir = store_dir or data_path('workspaces')
+        self.path = os.path.join(store_dir,hashlib.sha1(self.root.encode()).hexdigest()[:12] + '.json')
+        self.files = None # relative path -> {'mtime','size','hash','chunks': [[start line, end line, length, {term: count}]]}
+        self.postings = None
+        self.checked = 0
+        self.lock = threading.Lock()
+        self.refreshing = threading.Lock()
+
+    @staticmethod
+    def terms(text):
+        import re
+        return re.findall(r'[a-z0-9]+',text.lower())
+
+    def load(self):
+        try:
+            with open(self.path,'r',encoding='utf-8') as f:
+                data = json.load(f)
+            return data['files'] if data.get('root') == self.root else {}
+        except (OSError,ValueError,KeyError):
+            return {}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path),exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path,'w',encoding='utf-8') as f:
+            json.dump({'root': self.root,'files': self.files},f)
+        os.replace(tmp_path,self.path)
+
+    def walk(self):
+        for dirpath,dirnames,filenames in os.walk(self.root):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.') and d not in self.skip_dirs]
+            for name in filenames:
+                if not name.startswith('.'):
+                    yield os.path.join(dirpath,name)
+
+    def refresh(self,min_gap=2.0):
+        # stat every file, re-read the changed ones. builds a new file map and swaps it in at
+        # the end, so searches keep using the old one meanwhile
+        import hashlib
+        from collections import Counter
+        with self.refreshing:
+            with self.lock:
+                if time.monotonic() - self.checked < min_gap and self.files is not None:
+                    return False
+                if self.files is None:
+                    files = self.load()
+                    if files:
+                        self.files = dict(files) # searchable while the first walk checks it
+                else:
+                    files = dict(self.files)
+            changed = False
+            seen = set()
+            for path in self.walk():
+                rel = os.path.relpath(path,self.root)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if st.st_size > self.max_bytes:
+                    continue
+                seen.add(rel)
+                old = files.get(rel)
+                if old and old['mtime'] == st.st_mtime and old['size'] == st.st_size:
+                    continue
+                try:
+                    with open(path,'rb') as f:
+                        data = f.read()
+                except OSError:
+                    continue
+                if b'\0' in data[:1024]:
+                    seen.discard(rel) # binary
+                    continue
+                digest = hashlib.sha1(data).hexdigest()
+                if old and old['hash'] == digest:
+                    files[rel] = dict(old,mtime=st.st_mtime,size=st.st_size)
+                    changed = True
+                    continue
+                lines = data.decode('utf-8','replace').split('\n')
+                chunks = []
+                for start in range(0,len(lines),self.chunk_lines):
+                    words = self.terms(f"{rel}\n" + "\n".join(lines[start:start + self.chunk_lines]))
+                    if words:
+                        chunks.append([start + 1,min(len(lines),start + self.chunk_lines),len(words),dict(Counter(words))])
+                files[rel] = {'mtime': st.st_mtime,'size': st.st_size,'hash': digest,'chunks': chunks}
+                changed = True
+            for rel in set(files) - seen:
+                del files[rel]
+                changed = True
+            with self.lock:
+                if changed or self.files is None:
+                    self.files = files
+                    self.postings = None
+                self.checked = time.monotonic()
+            if changed:
+                try:
+                    self.save()
+                except OSError:
+                    pass
+            return changed
+
+    def refresh_soon(self,min_gap=2.0):
+        # a background refresh if one's due and none is running
+        if time.monotonic() - self.checked < min_gap or self.refreshing.locked():
+            return
+        threading.Thread(target=self.refresh,args=(min_gap,),name='shellLLM-workspace',daemon=True).start()
+
+    def build_postings(self):
+        postings = {}
+        total = 0
+        chunks = []
+        for rel,entry in self.files.items():
+            for chunk in entry['chunks']:
+                cid = len(chunks)
+                chunks.append((rel,chunk[0],chunk[1],chunk[2]))
+                total += chunk[2]
+                for term,count in chunk[3].items():
+                    postings.setdefault(term,[]).append((cid,count))
+        self.postings = (postings,chunks,total / len(chunks) if chunks else 0)
+
+    def search(self,query,k=None):
+        # top chunks by BM25 as (score, relative path, first line, last line)
+        import math, heapq
+        if self.files is None:
+            self.refresh() # the first time there's nothing to search without it
+        else:
+            self.refresh_soon() # files changed since then are picked up by the next message
+        with self.lock:
+            if self.postings is None:
+                self.build_postings()
+            postings,chunks,avg_len = self.postings
+        scores = {}
+        n = len(chunks)
+        for term in set(self.terms(query)):
+            hits = postings.get(term)
+            if not hits:
+                continue
+            idf = math.log(1 + (n - len(hits) + 0.5) / (len(hits) + 0.5))
+            for cid,count in hits:
+                length = chunks[cid][3]
+                scores[cid] = scores.get(cid,0) + idf * count * 2.2 / (count + 1.2 * (0.25 + 0.75 * length / avg_len))
+        best = heapq.nlargest(k or self.top_k,scores.items(),key=lambda item: item[1])
+        return [(score,) + chunks[cid][:3] for cid,score in best]
+
+    def context(self,query):
+        # the relevant pieces of the workspace, formatted like attached files
+        out = ""
+        for score,rel,first,last in self.search(query):
+            try:
+                with open(os.path.join(self.root,rel),'r',encoding='utf-8',errors='replace') as f:
+                    lines = f.read().split('\n')[first - 1:last]
+            except OSError:
+                continue
+            text = "\n".join(lines)[:self.max_chunk_chars]
+            out += f"\n\n--- workspace: {rel} (lines {first}-{last}) --- \n{text}\n--- end of {rel} --- \n"
+        return out
+
+class toolConfirm:
+    # yielded by a tool-calling stream when a call needs the user's ok. whoever is reading the
+    # stream sets allowed before asking for the next chunk
+    __slots__ = ('label','allowed')
+
+    def __init__(self,label):
+        self.label = label
+        self.allowed = False
+
+class toolRegistry:
+    # local tools the model can call (OpenAI style `tools`): read a file, list a folder, grep,
+    # and run a command from an allow list. everything stays inside one folder (paths can't
+    # leave it, symlinks included), commands run without a shell, and output is capped.
+    # tools not in SHELLLLM_TOOLS_AUTO (by default: running commands) ask you first
+    max_output = 12000
+    skip_dirs = workspaceIndex.skip_dirs
+    default_commands = "ls,cat,head,tail,wc,grep,pwd,file,git status,git log,git diff,git show,git blame"
+    # options that run other programs or write files, refused even if the command is allowed
+    blocked_opts = {
+        'find': ('-exec','-execdir','-ok','-okdir','-delete','-fprint','-fprint0','-fprintf','-fls'),
+        'git': ('--output','-o')
+    }
+    specs = {
+        'read_file': ("read a text file, or some of its lines",
+                      {'path': {'type': 'string','description': "file path, relative to the project folder"},
+                       'start': {'type': 'integer','description': "first line to read (from 1)"},
+                       'lines': {'type': 'integer','description': "how many lines to read, default 400"}},['path']),
+        'list_dir': ("list a folder: subfolders end in /, files show their size",
+                     {'path': {'type': 'string','description': "folder path, relative to the project folder, default ."}},[]),
+        'grep': ("search files under a folder for a regular expression, returns file:line: text",
+                 {'pattern': {'type': 'string','description': "python regular expression"},
+                  'path': {'type': 'string','description': "folder or file to search, default ."}},['pattern']),
+        'run_command': ("run a command (no shell, so no pipes or redirects) in the project folder and get its output",
+                        {'command': {'type': 'string','description': "the command line, e.g. git log -5 --oneline"}},['command'])
+    }
+
+    def __init__(self,root,commands=None,auto=None):
+        self.root = os.path.realpath(os.path.expanduser(root))
+        commands = commands if commands is not None else os.environ.get('SHELLLLM_TOOL_COMMANDS',self.default_commands)
+        self.commands = [c.split() for c in commands.split(',') if c.strip()]
+        auto = auto if auto is not None else os.environ.get('SHELLLLM_TOOLS_AUTO','read_file,list_dir,grep')
+        self.auto = {name.strip() for name in auto.split(',') if name.strip()}
+        self.pool = None
+
+    def executor(self):
+        if self.pool is None:
+            import concurrent.futures
+            self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=4,thread_name_prefix='shellLLM-tool')
+        return self.pool
+
+    def schemas(self):
+        return [{"type": "function","function": {"name": name,"description": desc,
+                 "parameters": {"type": "object","properties": props,"required": req}}}
+                for name,(desc,props,req) in self.specs.items()]
+
+    def prepare(self,call):
+        # (arguments, error) for a streamed call
+        if call['name'] not in self.specs:
+            return {},f"unknown tool {call['name']}"
+        try:
+            args = json.loads(call['arguments'] or '{}')
+        except ValueError:
+            return {},"the arguments aren't valid json"
+        if not isinstance(args,dict):
+            return {},"the arguments should be an object"
+        return args,None
+
+    def needs_confirm(self,name):
+        return name not in self.auto
+
+    def label(self,name,args):
+        # shown before the call runs and in the y/n question, so never shortened: a command
+        # is shown as the exact argv it runs as
+        if name == 'run_command':
+            import shlex
+            try:
+                return f"{name} {shlex.join(shlex.split(str(args.get('command',''))))}"
+            except ValueError:
+                return f"{name} {args.get('command','')!r}"
+        text = " ".join(str(val) for val in args.values())
+        return f"{name} {' '.join(text.split())}".strip()
+
+    def path(self,rel):
+        full = os.path.realpath(os.path.join(self.root,os.path.expanduser(rel or '.')))
+        if full != self.root and not full.startswith(self.root + os.sep):
+            raise ValueError(f"{rel} is outside {self.root}")
+        return full
+
+    def run(self,name,args):
+        # runs on a pool thread. errors go back to the model as text, it can usually recover
+        try:
+            out = getattr(self,f"tool_{name}")(**args)
+        except TypeError as e:
+            out = f"error: bad arguments ({e})"
+        except Exception as e:
+            out = f"error: {e}"
+        if len(out) > self.max_output:
+            out = out[:self.max_output] + f"\n... ({len(out) - self.max_output} more characters cut)"
+        return out
+
+    def tool_read_file(self,path,start=1,lines=400):
+        with open(self.path(path),'r',encoding='utf-8',errors='replace') as f:
+            text = f.read().split('\n')
+        start = max(1,int(start))
+        part = text[start - 1:start - 1 + max(1,int(lines))]
+        return f"{path} lines {start}-{start + len(part) - 1} of {len(text)}:\n" + "\n".join(part)
+
+    def tool_list_dir(self,path='.'):
+        full = self.path(path)
+        out = []
+        for name in sorted(os.listdir(full))[:500]:
+            sub = os.path.join(full,name)
+            if os.path.isdir(sub):
+                out.append(name + "/")
+            else:
+                try:
+                    out.append(f"{name} ({os.path.getsize(sub)} bytes)")
+                except OSError:
+                    out.append(name)
+        return "\n".join(out) or "(empty)"
+
+    def tool_grep(self,pattern,path='.'):
+        import re
+        regex = re.compile(pattern)
+        full = self.path(path)
+        if os.path.isfile(full):
+            files = [full]
+        else:
+            files = []
+            for dirpath,dirnames,filenames in os.walk(full):
+                dirnames[:] = sorted(d for d in dirnames if not d.startswith('.') and d not in self.skip_dirs)
+                files.extend(os.path.join(dirpath,name) for name in sorted(filenames))
+        hits = []
+        for file in files:
+            try:
+                self.path(file) # symlinks out of the folder are skipped
+                if os.path.getsize(file) > 2 * 1024 * 1024:
+                    continue
+                with open(file,'rb') as f:
+                    data = f.read()
+            except (OSError,ValueError):
+                continue
+            if b'\0' in data[:1024]:
+                continue
+            for n,line in enumerate(data.decode('utf-8','replace').split('\n'),1):
+                if regex.search(line):
+                    hits.append(f"{os.path.relpath(file,self.root)}:{n}: {line.strip()[:200]}")
+                    if len(hits) >= 200:
+                        return "\n".join(hits) + "\n... (stopped at 200 matches)"
+        return "\n".join(hits) or "no matches"
+
+    def check_argv(self,argv):
+        if not any(argv[:len(allowed)] == allowed for allowed in self.commands):
+            raise ValueError(f"not allowed, commands have to start with one of: {', '.join(' '.join(c) for c in self.commands)}")
+        blocked = self.blocked_opts.get(os.path.basename(argv[0]),())
+        for arg in argv[1:]:
+            opt = arg.split('=',1)[0]
+            # git takes unambiguous prefixes of long options, so --out= is --output=
+            if opt in blocked or any(opt.startswith('--') and len(opt) > 3 and b.startswith(opt) for b in blocked):
+                raise ValueError(f"{opt} isn't allowed")
+            # no reaching outside the folder through arguments either: plain ones, --opt=value
+            # and -fvalue (a value given as the next argument is a plain one)
+            values = [arg]
+            if arg.startswith('--') and '=' in arg:
+                values.append(arg.split('=',1)[1])
+            elif arg.startswith('-') and not arg.startswith('--') and len(arg) > 2:
+                values.extend(arg[i:] for i in range(2,len(arg)))
+            for val in values:
+                # (anything that exists is checked too: it may be a symlink out)
+                if '/' in val or val.startswith('~') or val == '..' or os.path.lexists(os.path.join(self.root,val)):
+                    self.path(val)
+
+    def tool_run_command(self,command):
+        import shlex,subprocess
+        argv = shlex.split(command)
+        self.check_argv(argv)
+        res = subprocess.run(argv,cwd=self.root,capture_output=True,text=True,errors='replace',timeout=30,stdin=subprocess.DEVNULL)
+        return f"exit code {res.returncode}\n{res.stdout}{res.stderr}"
+
+
+def make_server(host='127.0.0.1',port=8484):
+    # local http api over the same chats.json + engine the TUI uses. every request but
+    # /health needs "Authorization: Bearer <token>" (SHELLLLM_SERVER_TOKEN, or a new one
+    # written to server.token), a Host of this machine, and POSTs a json body, so web pages
+    # can't reach it through the browser. "attach" paths have to be inside SHELLLLM_WORKSPACE:
+    #   GET  /chats                  list chats
+    #   GET  /chats/<id>             one chat with its messages
+    #   GET  /search?q=...           search titles and messages
+    #   POST /chats                  new chat
+    #   POST /chats/<id>/messages    append a message {"content": ..., "role": "user"}
+    #   POST /chats/<id>/reply       stream the AI's reply as SSE {"content"?, "model"?, "attach"?: [paths], "continue"?: true}
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    from urllib.parse import urlparse, parse_qs
+    import hmac, secrets
+
+    load_env()
+    api_key = os.environ.get("API_KEY")
+    if not api_key:
+        raise ValueError("api key not found, is the API key in .env?")
+    token = os.environ.get('SHELLLLM_SERVER_TOKEN')
+    token_path = None
+    if not token:
+        token = secrets.token_urlsafe(24)
+        token_path = data_path('server.token')
+        fd = os.open(token_path,os.O_WRONLY | os.O_CREAT | os.O_TRUNC,0o600)
+        with os.fdopen(fd,'w') as f:
+            f.write(token + "\n")
+    hosts = {host.lower(),'localhost','127.0.0.1','[::1]'}
+    workspace = os.environ.get('SHELLLLM_WORKSPACE')
+    attach_root = os.path.realpath(os.path.expanduser(workspace)) if workspace else None
+    tracer = perfTracer()
+    chat_mgr = chatMgr(tracer=tracer)
+    session = make_session(pool_size=32) # one upstream pool shared by every client
+    chat_mgr.compactor = chatCompactor(chat_mgr,api_key,DEFAULT_BASE_URL,tracer=tracer,session=session)
+    chat_mgr.titler = chatTitler(chat_mgr,api_key,DEFAULT_BASE_URL,tracer=tracer,session=session)
+    catalog = modelCatalog(api_key,DEFAULT_BASE_URL)
+    catalog.start()
+    catalog.refresh()
+    if os.environ.get('SHELLLLM_SEMANTIC','1') != '0':
+        chat_mgr.index = chatIndex(chat_mgr,api_key,DEFAULT_BASE_URL,session=session)
+        chat_mgr.index.start()
+
+    class apiHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self,fmt,*args):
+            pass
+
+        def send_json(self,obj,status=200):
+            body = json.dumps(obj,default=json_default).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type','application/json')
+            self.send_header('Content-Length',str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def refused(self,post=False):
+            # None when the request may go ahead, else (status, why)
+            host = (self.headers.get('Host') or '').lower()
+            host = host[:host.find(']') + 1] if host.startswith('[') else host.split(':')[0]
+            if host not in hosts:
+                return 421,'unexpected Host header'
+            if urlparse(self.path).path.strip('/') == 'health':
+                return None
+            if not hmac.compare_digest(self.headers.get('Authorization','').encode(),f"Bearer {token}".encode()):
+                return 401,'missing or wrong token'
+            if post and int(self.headers.get('Content-Length') or 0) and self.headers.get_content_type() != 'application/json':
+                return 415,'send the body as application/json'
+            return None
+
+        def attach_path(self,path):
+            # the real path of an attachment, None if it's outside the workspace
+            if attach_root is None:
+                return None
+            real = os.path.realpath(os.path.join(attach_root,os.path.expanduser(path)))
+            return real if os.path.commonpath([attach_root,real]) == attach_root else None
+
+        def read_json(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            if not length:
+                return {}
+            try:
+                return json.loads(self.rfile.read(length))
+            except json.JSONDecodeError:
+                return None
+
+        def chat_summary(self,idx,chat):
+            return {'id': chat['id'], 'idx': idx, 'title': chat.get('title','New Chat'), 'timestamp': chat.get('timestamp'), 'messages': chat_msg_count(chat), 'archived': bool(chat.get('archived'))}
+
+        def do_GET(self):
+            refused = self.refused()
+            if refused:
+                return self.send_json({'error': refused[1]},refused[0])
+            chat_mgr.poll_changes() # pick up saves from a TUI running on the same chats.json
+            url = urlparse(self.path)
+            parts = [p for p in url.path.split('/') if p]
+            if parts == ['chats']:
+                self.send_json([self.chat_summary(i,c) for i,c in enumerate(list(chat_mgr.chats))])
+            elif len(parts) == 2 and parts[0] == 'chats':
+                idx,chat = chat_mgr.find_chat(parts[1])
+                if chat is None:
+                    return self.send_json({'error': 'no such chat'},404)
+                chat_mgr.ensure_loaded(chat)
+                self.send_json(chat)
+            elif parts == ['search']:
+                query = parse_qs(url.query).get('q',[''])[0]
+                if not query:
+                    return self.send_json({'error': 'missing ?q='},400)
+                results = [dict(self.chat_summary(i,chat_mgr.chats[i]),snippet=snip) for i,snip in chat_mgr.search(query,semantic=True)]
+                self.send_json(results)
+            elif parts == ['health']:
+                self.send_json({'ok': True})
+            else:
+                self.send_json({'error': 'not found'},404)
+
+        def do_POST(self):
+            refused = self.refused(post=True)
+            if refused:
+                self.close_connection = True # the body wasn't read
+                return self.send_json({'error': refused[1]},refused[0])
+            parts = [p for p in urlparse(self.path).path.split('/') if p]
+            body = self.read_json()
+            if body is None:
+                return self.send_json({'error': 'invalid json'},400)
+            if parts == ['chats']:
+                chat = chat_mgr.blank_chat()
+                with chat_mgr.data_lock:
+                    chat_mgr.chats.insert(0,chat)
+                    chat_mgr.cur_chat_idx = min(chat_mgr.cur_chat_idx + 1,len(chat_mgr.chats) - 1)
+                chat_mgr.save_chats()
+                return self.send_json(self.chat_summary(0,chat),201)
+            if len(parts) != 3 or parts[0] != 'chats' or parts[2] not in ('messages','reply'):
+                return self.send_json({'error': 'not found'},404)
+            idx,chat = chat_mgr.find_chat(parts[1])
+            if chat is None:
+                return self.send_json({'error': 'no such chat'},404)
+            chat_mgr.ensure_loaded(chat)
+            if parts[2] == 'messages':
+                if not body.get('content'):
+                    return self.send_json({'error': 'missing content'},400)
+                with chat_mgr.chat_lock(chat['id']):
+                    msgs = list(chat.get('messages',[]))
+                    msgs.append(chatMsg(body.get('role','user'),body['content']))
+                    chat_mgr.upd_chat(chat,msgs)
+                return self.send_json(self.chat_summary(idx,chat),201)
+            self.stream_reply(chat,body)
+
+        def stream_reply(self,chat,body):
+            chat_ai = mainChat(api_key,model=body.get('model','openai/gpt-5.1'),tracer=tracer,session=session)
+            chat_ai.catalog = catalog
+            for path in body.get('attach',[]):
+                real = self.attach_path(path)
+                if real is None:
+                    why = "outside the workspace" if attach_root else "attachments need SHELLLLM_WORKSPACE"
+                    return self.send_json({'error': f"{path}: {why}"},403)
+                ok,message = chat_ai.attach_file(real)
+                if not ok:
+                    return self.send_json({'error': f"{path}: {message}"},400)
+            # the chat lock is held for the whole reply so two clients can't interleave turns in one chat
+            with chat_mgr.chat_lock(chat['id']):
+                chat_ai.open(chat)
+                chat_ai.convo_history = list(chat.get('messages',[]))
+                if body.get('continue'):
+                    gen = chat_ai.continue_last()
+                    if gen is None:
+                        return self.send_json({'error': 'the last reply is complete'},400)
+                elif body.get('content'):
+                    gen = chat_ai.send_msg(body['content'])
+                elif chat_ai.convo_history and chat_ai.convo_history[-1]['role'] == 'user':
+                    gen = chat_ai._stream_res()
+                else:
+                    return self.send_json({'error': 'nothing to reply to'},400)
+                self.send_response(200)
+                self.send_header('Content-Type','text/event-stream')
+                self.send_header('Cache-Control','no-cache')
+                self.send_header('Connection','close')
+                self.end_headers()
+                self.close_connection = True
+                try:
+                    for chunk in gen:
+                        self.wfile.write(f"data: {json.dumps({'content': chunk})}\n\n".encode('utf-8'))
+                        self.wfile.flush()
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    self.wfile.flush()
+                except (BrokenPipeError,ConnectionResetError):
+                    pass # client went away, closing gen below cancels the upstream request
+                except Exception as e:
+                    try:
+                        self.wfile.write(f"data: {json.dumps({'error': str(e),'incomplete': chat_ai.can_continue()})}\n\n".encode('utf-8'))
+                        self.wfile.flush()
+                    except OSError:
+                        pass
+                finally:
+                    gen.close()
+                if chat_ai.convo_history and chat_ai.convo_history[-1]['role'] == 'assistant':
+                    chat_mgr.upd_chat(chat,chat_ai.convo_history,chat_ai.model)
+
+    server = ThreadingHTTPServer((host,port),apiHandler)
+    server.daemon_threads = True
+    server.chat_mgr = chat_mgr
+    server.token_path = token_path
+    return server
+
+def run_server(host='127.0.0.1',port=8484):
+    server = make_server(host,port)
+    print(f"shellLLM serving {len(server.chat_mgr.chats)} chats on http://{host}:{port} (ctrl+c to stop)")
+    if server.token_path:
+        print(f"send 'Authorization: Bearer <token>' with each request, the token is in {server.token_path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def run_export(args):
+    chat_mgr = chatMgr()
+    if chat_mgr.load_error:
+        raise ValueError(chat_mgr.load_error)
+    if args.file in (None,'-'):
+        count = chat_mgr.export_chats(sys.stdout,args.since,args.until,args.model,args.query)
+    else:
+        if args.file.endswith('.gz'):
+            import gzip
+            out = gzip.open(args.file,'wt',encoding='utf-8')
+        else:
+            out = open(args.file,'w',encoding='utf-8')
+        with out:
+            count = chat_mgr.export_chats(out,args.since,args.until,args.model,args.query)
+    print(f"exported {count} chat(s)",file=sys.stderr)
+
+def run_import(args):
+    chat_mgr = chatMgr()
+    if chat_mgr.load_error:
+        raise ValueError(chat_mgr.load_error)
+    total_added = total_skipped = 0
+    for path in args.files:
+        if path == '-':
+            added,skipped = chat_mgr.import_chats(sys.stdin)
+        else:
+            if path.endswith('.gz'):
+                import gzip
+                f = gzip.open(path,'rt',encoding='utf-8')
+            else:
+                f = open(path,'r',encoding='utf-8')
+            with f:
+                added,skipped = chat_mgr.import_chats(f)
+        total_added += added
+        total_skipped += skipped
+    print(f"imported {total_added} chat(s), skipped {total_skipped} duplicate/invalid")
+
+def run_replay(args):
+    tape = sessionReplay(args.file,args.speed)
+    import tempfile,shutil,atexit
+    home = tempfile.mkdtemp(prefix='shellLLM-replay-')
+    if not args.keep:
+        atexit.register(shutil.rmtree,home,True) # registered first so it runs after the exit save
+    # the session's own settings, none of yours, and everything written goes to the temp folder
+    for key in [key for key in os.environ if key.startswith('SHELLLLM_')]:
+        del os.environ[key]
+    os.environ.update(tape.header.get('env',{}))
+    os.environ['SHELLLLM_HOME'] = home
+    os.environ['API_KEY'] = 'replay'
+    with open(os.path.join(home,'chats.json'),'w') as f:
+        json.dump({'chats': tape.header['chats'],'current': tape.header.get('current',0)},f)
+    with open(os.path.join(home,'history.jsonl'),'w',encoding='utf-8') as f:
+        for text in tape.header.get('history',[]):
+            f.write(json.dumps({'text': text}) + "\n")
+    height,width = tape.header['size']
+    screen = virtualScreen(height,width,tape)
+    curses._obj = screen
+    t0 = time.perf_counter()
+    try:
+        main_tui(screen.stdscr,None,None,tape)
+    except KeyboardInterrupt:
+        pass
+    wall = time.perf_counter() - t0
+    print(tape.report(wall,data_path('trace.jsonl')))
+    print("\n--- final screen ---")
+    print(screen.text())
+    if args.keep:
+        print(f"\nreplay files kept in {home}")
+
+def main_tui(stdscr,profiler=None,bench=None,tape=None):
+    profiler = profiler or sessionProfiler()
+    if tape is not None:
+        stdscr = tape.wrap(stdscr)
     curses.curs_set(0)
     stdscr.clear()
-    load_env()
+    if tape is None or not tape.replaying:
+        load_env()
     api_key = os.environ.get("API_KEY")
+    base_url,model = DEFAULT_BASE_URL,"openai/gpt-5.1"
+    local = None
+    if (tape is None or not tape.replaying) and os.environ.get('SHELLLLM_LOCAL','auto').lower() != 'off':
+        local = localBackend()
+        if not api_key:
+            # no key, so a server on this machine is all there is to talk to: wait for the probe,
+            # and if one answers everything goes there
+            local.detect()
+            if local.available():
+                base_url,model,api_key = local.base_url,local.model,local.api_key
+            local = None
     if not api_key:
         stdscr.clear()
         stdscr.addstr(0,0,"API_KEY not found in environment or .env file", curses.A_BOLD)
@@ -1013,38 +5602,72 @@ def main_tui(stdscr):
         api_key = api_key_in
         stdscr.clear()
     try:
-        chat_mgr = chatMgr()
-        chat = mainChat(api_key, model="openai/gpt-5.1")
-        curr_chat = chat_mgr.get_cur_chat()
-        chat.convo_history = curr_chat.get('messages', [])
-        ui = UI(stdscr,chat, chat_mgr)
+        tracer = perfTracer()
+        journal = replyJournal()
+        chat_mgr = chatMgr(tracer=tracer,background=True,journal=journal)
+        chat = mainChat(api_key, base_url=base_url, model=model, tracer=tracer)
+        chat.journal = journal
+        chat.data_lock = chat_mgr.data_lock
+        chat_mgr.compactor = chatCompactor(chat_mgr,api_key,chat.base_url,tracer=tracer)
+        chat_mgr.titler = chatTitler(chat_mgr,api_key,chat.base_url,tracer=tracer)
+        chat.engine.tape = tape
+        chat.catalog = modelCatalog(api_key,chat.base_url)
+        if tape is not None and tape.replaying:
+            tape.seed_catalog(chat.catalog)
+        else:
+            chat.catalog.start()
+        if os.environ.get('SHELLLLM_SEMANTIC','1') != '0':
+            chat_mgr.index = chatIndex(chat_mgr,api_key,chat.base_url)
+            chat_mgr.index.start()
+        if os.environ.get('SHELLLLM_WORKSPACE'):
+            chat.workspace = workspaceIndex(os.environ['SHELLLLM_WORKSPACE'])
+            threading.Thread(target=chat.workspace.refresh,name='shellLLM-workspace',daemon=True).start()
+        if os.environ.get('SHELLLLM_TOOLS','0') not in ('','0'):
+            # 1 for the current folder, or a folder
+            root = os.environ['SHELLLLM_TOOLS']
+            chat.tools = toolRegistry(os.getcwd() if root == '1' else root)
+        chat.confirm_tools = True
+        chat.local = local
+        ui = UI(stdscr,chat, chat_mgr,tape)
+        profiler.attach(chat,chat_mgr)
     except Exception as e:
         stdscr.addstr(0,0,f"error: {str(e)}")
         stdscr.addstr(1,0,f"press any key to exit...")
         stdscr.getch()
         return
     ui.refresh_all()
+    if bench is not None:
+        bench['first_paint'] = time.perf_counter() - startup_t0
+        chat_mgr.wait_loaded()
+        ui.sync_loaded()
+        curses.doupdate()
+        bench['interactive'] = time.perf_counter() - startup_t0
+        bench['chats'] = len(chat_mgr.chats)
+        bench['requests_imported'] = 'requests' in sys.modules
+        return bench
+    # network lookups wait until something is on screen
+    chat.catalog.refresh()
+    if local is not None:
+        local.start()
+    if tape is not None:
+        tape.begin(ui)
+    import atexit
+    atexit.register(chat_mgr.flush_cur,0) # the selected chat is saved lazily, don't lose it on exit
     icm = False ## icm = in chat mode
+    nav_redraw = True
     while True:
         if icm:
-            ui.status_msg = "nav mode - press h for help, esc to escape"
-            ui.refresh_all()
+            if nav_redraw:
+                ui.status_msg = "nav mode - press h for help, esc to escape"
+                ui.refresh_all()
+            nav_redraw = True
             action = ui.handle_sinput()
             if action == 'switch':
-                curr_chat = chat_mgr.get_cur_chat()
-                chat.convo_history = curr_chat.get('messages',[])
-                ui.current_res = ""
-                ui.v_msg_idx = -1
-                for msg in reversed(chat.convo_history):
-                    if msg['role'] == 'assistant':
-                        ui.current_res = msg['content']
-                        break
-                ui.scroll_offset = 0
-                ui.status_msg = "switched chat"
-                ui.refresh_all()
+                ui.show_cur_chat()
+                nav_redraw = False
             elif action == 'new':
                 chat_mgr.new_chat()
-                chat.convo_history = []
+                chat.open(chat_mgr.get_cur_chat())
                 ui.current_res = ""
                 ui.scroll_offset = 0
                 ui.status_msg = "new chat created"
@@ -1052,7 +5675,7 @@ def main_tui(stdscr):
             elif action == 'delete':
                 if chat_mgr.del_cur_chat():
                     curr_chat = chat_mgr.get_cur_chat()
-                    chat.convo_history = curr_chat.get('messages',[])
+                    chat.open(curr_chat)
                     ui.current_res = ""
                     ui.scroll_offset = 0
                     ui.status_msg = "chat deleted"
@@ -1086,11 +5709,11 @@ def main_tui(stdscr):
                 if sel_chat is not None:
                     chat_mgr.cur_chat_idx = sel_chat
                     curr_chat = chat_mgr.get_cur_chat()
-                    chat.convo_history = curr_chat.get('messages',[])
+                    chat.open(curr_chat)
                     ui.current_res = ""
                     for msg in reversed(chat.convo_history):
                         if msg['role'] == 'assistant':
-                            ui.current_res = msg['content']
+                            ui.show_msg(msg)
                             break
                     ui.scroll_offset = 0
                     ui.status_msg = f"jumped to chat: {curr_chat.get('title', 'New Chat')[:30]}"
@@ -1117,15 +5740,20 @@ def main_tui(stdscr):
                     try:
                         res_gen = chat.regen_last(stream=True)
                         if res_gen:
-                            ui.show_streaming(res_gen)
+                            err = ui.show_streaming(res_gen)
                             ui.scroll_offset = 0
-                            chat_mgr.upd_cur_chat(chat.convo_history)
-                            ui.status_msg = "response generated"
+                            chat_mgr.upd_cur_chat(chat.convo_history,chat.model)
+                            if not err:
+                                ui.status_msg = "response generated"
                         else:
                             ui.status_msg = "no message to regenerate"
                     except Exception as e:
                         ui.status_msg = "no message to regenerate"
                     ui.refresh_all()
+            elif action == 'branch':
+                ui.status_msg = ui.alt_version()
+                ui.refresh_all()
+                nav_redraw = False
             elif action == 'toggle_stats':
                 ui.show_stats = True
                 ui.refresh_all()
@@ -1144,6 +5772,11 @@ def main_tui(stdscr):
             break
         if not user_input:
             continue
+        if not ui.chats_ready:
+            ui.status_msg = "loading chats\u2026"
+            ui.draw_input()
+            chat_mgr.wait_loaded()
+            ui.sync_loaded()
         if user_input.lower() in ['quit','exit']:
             break
         if user_input.lower() == '::nav':
@@ -1153,6 +5786,7 @@ def main_tui(stdscr):
             continue
         if user_input.lower() == '::clear':
             chat.clear_hist()
+            chat_mgr.upd_cur_chat(chat.convo_history,chat.model)
             ui.current_res = ""
             ui.scroll_offset = 0
             ui.status_msg = "history cleared"
@@ -1160,7 +5794,7 @@ def main_tui(stdscr):
             continue
         if user_input.lower() == '::n':
             chat_mgr.new_chat()
-            chat.convo_history = []
+            chat.open(chat_mgr.get_cur_chat())
             ui.current_res = ""
             ui.scroll_offset = 0
             ui.status_msg = "new chat created"
@@ -1169,7 +5803,7 @@ def main_tui(stdscr):
         if user_input.lower() == '::d':
             if chat_mgr.del_cur_chat():
                 curr_chat = chat_mgr.get_cur_chat()
-                chat.convo_history = curr_chat.get('messages',[])
+                chat.open(curr_chat)
                 ui.current_res = ""
                 ui.scroll_offset = 0
                 ui.status_msg = "chat deleted"
@@ -1201,11 +5835,11 @@ def main_tui(stdscr):
             if sel_chat is not None:
                 chat_mgr.cur_chat_idx = sel_chat
                 curr_chat = chat_mgr.get_cur_chat()
-                chat.convo_history = curr_chat.get('messages',[])
+                chat.open(curr_chat)
                 ui.current_res = ""
                 for msg in reversed(chat.convo_history):
                     if msg['role'] == 'assistant':
-                        ui.current_res = msg['content']
+                        ui.show_msg(msg)
                         break
                 ui.scroll_offset = 0
                 ui.status_msg = f"jumped to chat: {curr_chat.get('title', 'New Chat')[:30]}"
@@ -1225,6 +5859,37 @@ def main_tui(stdscr):
                 ui.status_msg = "file attachment cancelled"
             ui.refresh_all()
             continue
+        if user_input.lower().startswith('::workspace'):
+            folder = user_input[len('::workspace'):].strip()
+            if folder.lower() == 'off':
+                chat.workspace = None
+                ui.status_msg = "workspace off"
+            elif folder and os.path.isdir(os.path.expanduser(folder)):
+                chat.workspace = workspaceIndex(folder)
+                threading.Thread(target=chat.workspace.refresh,name='shellLLM-workspace',daemon=True).start()
+                ui.status_msg = f"workspace: {chat.workspace.root} (indexing in the background)"
+            elif folder:
+                ui.status_msg = f"not a folder: {folder}"
+            else:
+                ui.status_msg = f"workspace: {chat.workspace.root}" if chat.workspace else "no workspace, use '::workspace <folder>'"
+            ui.refresh_all()
+            continue
+        if user_input.lower().startswith('::tools'):
+            arg = user_input[len('::tools'):].strip()
+            if arg.lower() == 'off':
+                chat.tools = None
+                ui.status_msg = "tools off"
+            elif arg.lower() == 'on' or (arg and os.path.isdir(os.path.expanduser(arg))):
+                chat.tools = toolRegistry(os.getcwd() if arg.lower() == 'on' else arg)
+                ui.status_msg = f"tools on in {chat.tools.root}"
+                if chat.catalog and chat.catalog.tools(chat.model) is False:
+                    ui.status_msg += f" ({chat.model} doesn't list tool support, so they won't be sent)"
+            elif arg:
+                ui.status_msg = f"not a folder: {arg}"
+            else:
+                ui.status_msg = f"tools on in {chat.tools.root}" if chat.tools else "tools off, use '::tools on' or '::tools <folder>'"
+            ui.refresh_all()
+            continue
         if user_input.lower() == '::clear-attach':
             chat.clear_attch()
             ui.status_msg = "cleared all attachments"
@@ -1232,12 +5897,37 @@ def main_tui(stdscr):
             continue
         if user_input.lower() == '::help':
             ui.show_help = True
+            ui.help_scroll = 0
             ui.refresh_all()
             ui.stdscr.nodelay(False)
-            ui.stdscr.getch()
+            while True:
+                key = ui.stdscr.getch()
+                if key in (ord('j'),curses.KEY_DOWN):
+                    ui.scroll_help(1)
+                elif key in (ord('k'),curses.KEY_UP):
+                    ui.scroll_help(-1)
+                else:
+                    break
+                ui.draw_help()
             ui.show_help = False 
             ui.refresh_all()
             continue
+        if user_input.lower() == '::compact':
+            if len(chat.convo_history) > chat_mgr.compactor.keep + 1 and chat_mgr.compactor.consider(chat_mgr.get_cur_chat(),force=True):
+                ui.status_msg = f"summarising older messages in the background with {chat_mgr.compactor.model}..."
+            else:
+                ui.status_msg = "nothing to summarise yet"
+            ui.refresh_all()
+            continue
+        if user_input.lower() == '::profile':
+            if profiler.active:
+                path = profiler.stop()
+                ui.status_msg = f"profile written to {path}"
+            else:
+                profiler.start()
+                ui.status_msg = "profiling on - type '::profile' again to stop and write the report"
+            ui.refresh_all()
+            continue
         if user_input.lower() == '::regen':
             if len(chat.convo_history) >= 2:
                 ui.status_msg = "regenerating..."
@@ -1245,10 +5935,11 @@ def main_tui(stdscr):
                 try:
                     res_gen = chat.regen_last(stream=True)
                     if res_gen:
-                        ui.show_streaming(res_gen)
+                        err = ui.show_streaming(res_gen)
                         ui.scroll_offset = 0
-                        chat_mgr.upd_cur_chat(chat.convo_history)
-                        ui.status_msg = "response regenerated"
+                        chat_mgr.upd_cur_chat(chat.convo_history,chat.model)
+                        if not err:
+                            ui.status_msg = "response regenerated, '::alt' switches back to the old one"
                     else:
                         ui.status_msg = "no message to regenerate"
                 except Exception as e:
@@ -1257,6 +5948,50 @@ def main_tui(stdscr):
                 ui.status_msg = "no message to regenerate"
             ui.refresh_all()
             continue
+        if user_input.lower().startswith('::edit'):
+            arg = user_input[len('::edit'):].strip()
+            prompts = [i for i,msg in enumerate(chat.convo_history) if msg['role'] == 'user']
+            if not prompts:
+                ui.status_msg = "no prompt to edit"
+            elif arg and not (arg.isdigit() and 1 <= int(arg) <= len(prompts)):
+                ui.status_msg = f"pick a prompt from 1 to {len(prompts)}"
+            else:
+                idx = prompts[int(arg) - 1] if arg else prompts[-1]
+                new_text = ui.get_input(prompt_text(chat.convo_history[idx]['content']))
+                if new_text and new_text.strip():
+                    try:
+                        err = ui.show_streaming(chat.edit_msg(idx,new_text,stream=True))
+                        ui.scroll_offset = 0
+                        ui.v_msg_idx = -1
+                        if not err:
+                            ui.status_msg = "prompt changed, the old version is kept - '::alt' to switch back"
+                    except Exception as e:
+                        ui.status_msg = f"error: {str(e)}"
+                    finally:
+                        # the history was cut and forked before the request went out
+                        chat_mgr.upd_cur_chat(chat.convo_history,chat.model)
+                else:
+                    ui.status_msg = "edit cancelled"
+            ui.refresh_all()
+            continue
+        if user_input.lower().startswith('::alt'):
+            arg = user_input[len('::alt'):].strip()
+            if arg and not arg.isdigit():
+                ui.status_msg = "usage: '::alt' or '::alt <prompt number>'"
+            else:
+                ui.status_msg = ui.alt_version(int(arg) if arg else None)
+            ui.refresh_all()
+            continue
+        if user_input.lower() == '::continue':
+            if chat.can_continue():
+                partial = chat.convo_history[-1]['content']
+                ui.show_streaming(chat.continue_last(stream=True),prefix=partial)
+                ui.scroll_offset = 0
+                chat_mgr.upd_cur_chat(chat.convo_history,chat.model)
+            else:
+                ui.status_msg = "nothing to continue, the last reply finished"
+            ui.refresh_all()
+            continue
         if user_input.lower() == '::stats':
             ui.show_stats = True
             ui.refresh_all()
@@ -1267,23 +6002,83 @@ def main_tui(stdscr):
             continue
         try:
             res_gen = chat.send_msg(user_input,stream=True)
-            ui.show_streaming(res_gen)
+            ui.show_streaming(res_gen) # errors end up in the status line, a partial reply is kept
             ui.scroll_offset = 0
             ui.v_msg_idx = -1
-            chat_mgr.upd_cur_chat(chat.convo_history)
+            chat_mgr.upd_cur_chat(chat.convo_history,chat.model)
             ui.refresh_all()
         except Exception as e:
             ui.status_msg = f"error: {str(e)}"
             ui.draw_input()
             curses.napms(2000)
 
+def parse_args(argv):
+    import argparse
+    parser = argparse.ArgumentParser(prog='main.py',description="shellLLM - talk to an AI from your terminal")
+    parser.add_argument('--profile',action='store_true',help="profile the session and write a report on exit")
+    parser.add_argument('--startup-bench',action='store_true',help="print time to first paint / interactive and exit")
+    parser.add_argument('--record',metavar='FILE',help="record keys and replies to FILE so the session can be replayed")
+    sub = parser.add_subparsers(dest='cmd')
+    serve = sub.add_parser('serve',help="serve your chats over a local HTTP API instead of opening the UI")
+    serve.add_argument('--host',default='127.0.0.1')
+    serve.add_argument('--port',type=int,default=8484)
+    export = sub.add_parser('export',help="write chats as JSONL, one chat per line")
+    export.add_argument('file',nargs='?',help="output file (.jsonl or .jsonl.gz), default stdout")
+    export.add_argument('--since',help="only chats last used on/after this date (YYYY-MM-DD)")
+    export.add_argument('--until',help="only chats last used on/before this date (YYYY-MM-DD)")
+    export.add_argument('--model',help="only chats that used a model matching this")
+    export.add_argument('--query',help="only chats containing this text")
+    imp = sub.add_parser('import',help="add chats from JSONL exports, skipping ones you already have")
+    imp.add_argument('files',nargs='+',help="export files (.jsonl or .jsonl.gz), or - for stdin")
+    replay = sub.add_parser('replay',help="play a --record session back offline and report UI timings")
+    replay.add_argument('file',help="session tape written by --record")
+    replay.add_argument('--speed',type=float,default=1.0,help="playback speed, 0 = no waiting (default 1)")
+    replay.add_argument('--keep',action='store_true',help="keep the replay's temporary folder (chats, trace.jsonl)")
+    return parser.parse_args(argv)
+
 def main():
+    args = parse_args(sys.argv[1:])
+    if args.cmd == 'serve':
+        try:
+            run_server(args.host,args.port)
+        except (ValueError,OSError) as e:
+            print_c(f"error: {e}",Colours.RED)
+        return
+    if args.cmd in ('export','import'):
+        try:
+            run_export(args) if args.cmd == 'export' else run_import(args)
+        except (ValueError,OSError) as e:
+            print_c(f"error: {e}",Colours.RED)
+        return
+    if args.cmd == 'replay':
+        try:
+            run_replay(args)
+        except (ValueError,OSError) as e:
+            print_c(f"error: {e}",Colours.RED)
+        return
     # lil fix to stop a delay from switching from nav mode to normal mode
     os.environ.setdefault('ESCDELAY', '25')
+    profiler = sessionProfiler()
+    if args.profile:
+        profiler.start()
+    bench = {} if args.startup_bench else None
+    tape = sessionRecorder(args.record) if args.record and not bench else None
     try:
-        curses.wrapper(main_tui)
+        curses.wrapper(main_tui,profiler,bench,tape)
     except KeyboardInterrupt:
         pass
+    if tape is not None:
+        tape.close()
+        print(f"session recorded to {tape.path}")
+    if bench:
+        print(f"time to first paint: {bench['first_paint'] * 1000:.1f}ms")
+        print(f"time to interactive: {bench['interactive'] * 1000:.1f}ms ({bench['chats']} chats loaded)")
+        print(f"requests imported during startup: {'yes' if bench['requests_imported'] else 'no'}")
+        return
+    if profiler.active:
+        profiler.stop()
+    for path in profiler.reports:
+        print(f"profile report: {path}")
     print("\nexiting shellLLM...")
 
 if __name__ == "__main__":
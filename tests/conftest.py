@@ -0,0 +1,14 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def shellllm_home(tmp_path,monkeypatch):
+    # everything main.py writes (chats.json, traces, indexes) goes to a throwaway folder
+    monkeypatch.setenv('SHELLLLM_HOME',str(tmp_path))
+    monkeypatch.setenv('SHELLLLM_TRACE','off')
+    return tmp_path
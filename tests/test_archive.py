@@ -0,0 +1,53 @@
+import main
+
+
+def msgs(*pairs):
+    return [main.chatMsg(role,text) for role,text in pairs]
+
+
+def old_chats(n):
+    # n chats nobody has touched in a long time, plus a current one
+    mgr = main.chatMgr()
+    for i in range(n):
+        mgr.new_chat()
+        mgr.upd_chat(mgr.chats[0],msgs(('user',f"question {i}"),('assistant',f"answer {i}")))
+        mgr.chats[0]['timestamp'] = "2020-01-01T00:00:00"
+    mgr.new_chat()
+    mgr.save_chats()
+    return mgr
+
+
+def records(mgr):
+    return [c['id'] for c in mgr.archive.iter_chats()]
+
+
+def test_opening_archived_chats_doesnt_pile_up_copies():
+    old_chats(3)
+    for session in range(6):
+        mgr = main.chatMgr() # archives anything old on load
+        for idx,chat in enumerate(mgr.chats):
+            if chat.get('archived'):
+                assert mgr.switch_chat(idx) # opened, so it comes back
+                assert not chat.get('archived') and len(chat['messages']) == 2
+        mgr.cur_chat_idx = 0
+        mgr.save_chats()
+    assert len(records(main.chatMgr())) <= 3
+
+
+def test_reopened_chat_is_newer_than_its_archived_copy():
+    old_chats(1)
+    mgr = main.chatMgr()
+    idx = next(i for i,c in enumerate(mgr.chats) if c.get('archived'))
+    version = mgr.chats[idx]['version']
+    mgr.switch_chat(idx)
+    assert mgr.chats[idx]['version'] > version
+    assert mgr.chats[idx]['timestamp'] > "2020"
+
+
+def test_rewrite_keeps_the_newest_copy_of_each_chat():
+    mgr = old_chats(0)
+    chat = {'id': 'c1','version': 2,'messages': [{'role': 'user','content': "old"}]}
+    mgr.archive.append([chat,dict(chat,messages=[{'role': 'user','content': "new"}]),dict(chat,id='c2')])
+    assert mgr.archive.rewrite(lambda c: True) == 2
+    kept = {c['id']: c['messages'][0]['content'] for c in mgr.archive.iter_chats()}
+    assert kept == {'c1': "new",'c2': "old"}
@@ -0,0 +1,90 @@
+import json
+
+import main
+
+
+def make_chat(tmp_path,*files):
+    chat = main.mainChat(api_key='k',base_url='https://example.invalid/v1',model='m')
+    for name,text in files:
+        path = tmp_path / name
+        path.write_text(text)
+        ok,message = chat.attach_file(str(path))
+        assert ok, message
+    return chat
+
+
+def test_typed_text_that_looks_like_an_attachment_is_left_alone():
+    text = "--- a yaml doc\nkey: 1\n --- \nand a question"
+    msgs = [main.chatMsg('user',text)]
+    assert main.prompt_text(msgs[0]['content']) == text
+    assert main.chat_title(msgs,limit=100) == " ".join(text.split())
+
+
+def test_attached_files_stay_parts_of_their_own(tmp_path):
+    chat = make_chat(tmp_path,('a.txt',"alpha"),('b.txt',"bravo"))
+    chat._add_user_msg("--- what differs? --- \nplease")
+    msg = chat.convo_history[-1]
+    assert [p.get('attach') for p in msg['content']] == ['file: b.txt','file: a.txt',None]
+    assert main.prompt_text(msg['content']) == "--- what differs? --- \nplease"
+    # on the wire it's the one string it always was: the files (last attached first), then the question
+    wire = main.wire_msg(msg)['content']
+    assert wire == ("\n\n--- file: b.txt --- \nbravo\n--- end of b.txt --- \n"
+                    "\n\n--- file: a.txt --- \nalpha\n--- end of a.txt --- \n"
+                    "--- what differs? --- \nplease")
+    assert main.msg_text(msg['content']) == wire
+    stored = json.loads(json.dumps(msg,default=main.json_default))
+    back = main.chatMsg.from_json(stored)
+    assert back == msg and isinstance(back['content'][0],main.attachRef)
+    assert main.wire_msg(stored)['content'] == wire
+    assert 'attach' not in json.dumps(main.responses_input([msg]))
+
+
+def test_images_go_first_with_one_text_part(tmp_path):
+    chat = make_chat(tmp_path,('notes.md',"notes"))
+    chat.attached_files.append({'type': 'image','content': "AAAA",'mime_type': 'image/png','name': 'x.png','filepath': 'x.png'})
+    chat._add_user_msg("what's in it")
+    wire = main.wire_msg(chat.convo_history[-1])['content']
+    assert wire == [{'type': 'image_url','image_url': {'url': "data:image/png;base64,AAAA"}},
+                    {'type': 'text','text': "\n\n--- file: notes.md --- \nnotes\n--- end of notes.md --- \nwhat's in it"}]
+
+
+def test_edit_keeps_the_attachments(tmp_path):
+    chat = make_chat(tmp_path,('a.txt',"alpha"))
+    chat._add_user_msg("--- first --- \nversion")
+    chat.convo_history.append(main.chatMsg('assistant',"reply"))
+    chat.edit_msg(0,"second version")
+    msg = chat.convo_history[-1]
+    assert len(chat.convo_history) == 1
+    assert main.prompt_text(msg['content']) == "second version"
+    assert [p.get('attach') for p in msg['content']] == ['file: a.txt',None]
+
+
+def test_stored_dicts_read_like_the_loaded_message(tmp_path):
+    chat = make_chat(tmp_path,('a.txt',"alpha"))
+    chat._add_user_msg("question")
+    msg = chat.convo_history[-1]
+    stored = json.loads(json.dumps(msg,default=main.json_default))
+    assert main.msg_text(stored['content']) == main.msg_text(msg['content'])
+    assert main.msg_low(stored) == msg.low
+    assert main.prompt_text(stored['content']) == "question"
+
+
+class fakeWorkspace:
+    def context(self,query):
+        return f"\n\n--- workspace: src/app.py (lines 1-2) --- \nabout {query}\n--- end of src/app.py --- \n"
+
+
+def test_workspace_text_only_goes_with_its_own_turn(tmp_path):
+    chat = make_chat(tmp_path,('a.txt',"alpha"))
+    chat.workspace = fakeWorkspace()
+    chat._add_user_msg("first")
+    assert [p.get('attach') for p in chat.convo_history[-1]['content']] == ['file: a.txt',None] # not stored
+    sent = chat.wire_messages({})[-1]['content']
+    assert sent.index("--- file: a.txt") < sent.index("about first") < sent.index("first",sent.index("end of src"))
+    chat.convo_history.append(main.chatMsg('assistant',"reply"))
+    chat._add_user_msg("second")
+    wire = chat.wire_messages({})
+    assert wire[0]['content'].endswith("alpha\n--- end of a.txt --- \nfirst") # the earlier prompt, without its lookup
+    assert "about second" in wire[-1]['content'] and "about first" not in json.dumps(wire)
+    chat.open({'messages': chat.convo_history})
+    assert "about" not in json.dumps(chat.wire_messages({}))
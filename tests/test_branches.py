@@ -0,0 +1,91 @@
+import main
+
+
+def msgs(*pairs):
+    return [main.chatMsg(role,text) for role,text in pairs]
+
+
+def chat_with(*pairs):
+    return {'id': 'c1','title': "t",'messages': msgs(*pairs),'version': 1}
+
+
+def texts(chat):
+    return [m['content'] for m in chat['messages']]
+
+
+def test_fork_keeps_only_the_tail():
+    chat = chat_with(('user','q1'),('assistant','a1'),('user','q2'),('assistant','a2'))
+    assert main.fork_chat(chat,3)
+    (branch,) = chat['branches']
+    assert branch['at'] == 3
+    assert branch['messages'][0] is chat['messages'][3] # shared, not copied
+    assert not main.fork_chat(chat,4) # nothing after the end to keep
+
+
+def test_switch_cycles_through_versions_in_place():
+    chat = chat_with(('user','q1'),('assistant','a1'))
+    held = chat['messages']
+    for reply in ('a2','a3'):
+        main.fork_chat(chat,1)
+        chat['messages'][1:] = msgs(('assistant',reply))
+    assert main.chat_forks(chat) == {1: 3}
+    seen = []
+    for _ in range(3):
+        assert main.switch_branch(chat,1)
+        seen.append(texts(chat)[1])
+    assert seen == ['a1','a2','a3']
+    assert chat['messages'] is held
+    assert main.chat_forks(chat) == {1: 3}
+
+
+def test_nested_forks_travel_with_their_branch():
+    chat = chat_with(('user','q1'),('assistant','a1'),('user','q2'),('assistant','a2'))
+    main.fork_chat(chat,3) # another reply to q2
+    chat['messages'][3:] = msgs(('assistant','a2b'))
+    main.fork_chat(chat,1) # then a1 regenerated: q2 and both its replies go into that branch
+    chat['messages'][1:] = msgs(('assistant','a1b'))
+    assert main.chat_forks(chat) == {1: 2}
+    assert main.switch_branch(chat,1)
+    assert texts(chat) == ['q1','a1','q2','a2b']
+    assert main.chat_forks(chat) == {1: 2,3: 2}
+    assert main.switch_branch(chat,3)
+    assert texts(chat) == ['q1','a1','q2','a2']
+
+
+def test_switch_refuses_branches_that_no_longer_fit():
+    chat = chat_with(('user','q1'),('assistant','a1'),('user','q2'),('assistant','a2'))
+    main.fork_chat(chat,3)
+    chat['messages'][3:] = msgs(('assistant','a2b'))
+    chat['messages'][:] = msgs(('user','other'))
+    assert main.chat_forks(chat) == {}
+    assert not main.switch_branch(chat,3)
+    chat['messages'][:] = msgs(('user','changed'),('assistant','a1'),('user','q2'))
+    assert not main.switch_branch(chat,3) # long enough, but not the prefix it was forked from
+    assert texts(chat) == ['changed','a1','q2']
+
+
+def test_clearing_drops_branches_and_summary():
+    mgr = main.chatMgr()
+    chat = mgr.chats[0]
+    mgr.upd_chat(chat,msgs(('user','q1'),('assistant','a1'),('user','q2'),('assistant','a2')))
+    main.fork_chat(chat,3)
+    chat['messages'][3:] = msgs(('assistant','a2b'))
+    chat['summary'] = {'upto': 2,'hash': main.chat_hash(chat['messages'][:2]),'content': "old notes"}
+    mgr.upd_chat(chat,chat['messages'])
+    assert 'branches' in chat and 'summary' in chat # same list, kept
+    mgr.upd_chat(chat,[])
+    assert 'branches' not in chat and 'summary' not in chat
+    assert not main.switch_branch(chat,3)
+    assert chat['messages'] == []
+
+
+def test_replacing_keeps_only_what_still_fits():
+    mgr = main.chatMgr()
+    chat = mgr.chats[0]
+    mgr.upd_chat(chat,msgs(('user','q1'),('assistant','a1'),('user','q2'),('assistant','a2')))
+    main.fork_chat(chat,3)
+    chat['messages'][3:] = msgs(('assistant','a2b'))
+    mgr.upd_chat(chat,list(chat['messages']) + msgs(('user','q3'))) # a copy that goes on
+    assert main.chat_forks(chat) == {3: 2}
+    mgr.upd_chat(chat,msgs(('user','new'),('assistant','x'),('user','y'),('assistant','z')))
+    assert 'branches' not in chat
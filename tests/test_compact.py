@@ -0,0 +1,99 @@
+import io
+import json
+
+import main
+
+
+def msgs(*texts):
+    return [main.chatMsg("user" if i % 2 == 0 else "assistant",t) for i,t in enumerate(texts)]
+
+
+def texts(messages):
+    return [m['content'] for m in messages]
+
+
+def summarise(mgr,chat,upto,content="notes"):
+    return mgr.set_summary(chat,{'content': content,'upto': upto,'hash': main.chat_hash(chat['messages'][:upto])})
+
+
+def long_chat(n=10):
+    mgr = main.chatMgr()
+    mgr.upd_chat(mgr.chats[0],msgs(*(f"m{i}" for i in range(n))))
+    return mgr,mgr.chats[0]
+
+
+def test_summarised_turns_leave_the_hot_file():
+    mgr,chat = long_chat()
+    held = chat['messages']
+    assert summarise(mgr,chat,6)
+    assert held is chat['messages'] and texts(held) == ['m6','m7','m8','m9'] # in place
+    assert chat['summary']['folded'] == 6
+    with open(mgr.chats_file) as f:
+        saved = json.load(f)['chats'][0]
+    assert texts(saved['messages']) == ['m6','m7','m8','m9']
+    assert [texts(rec['messages']) for rec in mgr.cold.iter_chats()] == [[f"m{i}" for i in range(6)]]
+
+
+def test_requests_send_the_summary_and_whats_left():
+    mgr,chat = long_chat()
+    summarise(mgr,chat,6)
+    ai = main.mainChat(api_key='k',base_url='https://example.invalid/v1',model='m')
+    ai.open(chat)
+    sent = ai.context_msgs()
+    assert "notes" in sent[0]['content'] and texts(sent[1:]) == ['m6','m7','m8','m9']
+    reloaded = main.chatMgr().chats[0]
+    assert main.apply_summary(reloaded['messages'],reloaded['summary'])[0]['role'] == 'system'
+
+
+def test_export_has_the_whole_chat():
+    mgr,chat = long_chat()
+    summarise(mgr,chat,4)
+    mgr.upd_chat(chat,chat['messages'] + msgs("m10"))
+    summarise(mgr,chat,4,"more notes")
+    assert chat['summary']['folded'] == 8
+    out = io.StringIO()
+    assert mgr.export_chats(out) == 1
+    rec = json.loads(out.getvalue())
+    assert texts(rec['messages']) == [f"m{i}" for i in range(10)] + ["m10"]
+    assert rec['summary']['upto'] == 8 and rec['summary']['hash'] == main.chat_hash(rec['messages'][:8])
+    assert mgr.import_chats(out.getvalue().splitlines()) == (0,1) # already here
+
+
+def test_only_turns_before_the_first_fork_move():
+    mgr,chat = long_chat()
+    main.fork_chat(chat,5)
+    chat['messages'][5:] = msgs("other")
+    summarise(mgr,chat,6)
+    assert chat['summary']['folded'] == 5 and chat['summary']['upto'] == 1
+    (branch,) = chat['branches']
+    assert branch['at'] == 0 and main.branch_fits(chat,branch)
+    assert main.switch_branch(chat,0) and texts(chat['messages']) == ['m5','m6','m7','m8','m9']
+
+
+def test_a_copy_from_before_the_fold_isnt_doubled():
+    mgr,chat = long_chat()
+    before = list(chat['messages'])
+    summarise(mgr,chat,6)
+    mgr.upd_chat(chat,before + msgs("late")) # e.g. a server reply that started earlier
+    assert texts(chat['messages']) == ['m6','m7','m8','m9','late']
+    assert 'summary' in chat
+
+
+def test_another_instance_folding_merges_cleanly():
+    a,chat = long_chat()
+    b = main.chatMgr()
+    summarise(a,chat,6)
+    b.upd_chat(b.chats[0],b.chats[0]['messages'] + [main.chatMsg("user","from b")])
+    merged = b.chats[0]
+    assert texts(merged['messages']) == ['m6','m7','m8','m9','from b']
+    assert merged['summary']['folded'] == 6
+
+
+def test_cold_turns_of_deleted_chats_are_dropped():
+    mgr,chat = long_chat()
+    summarise(mgr,chat,6)
+    mgr.new_chat()
+    mgr.cur_chat_idx = mgr.find_chat(chat['id'])[0]
+    mgr.del_cur_chat()
+    main.chatMgr() # compacts on load
+    assert list(main.chatMgr().cold.iter_chats()) == []
@@ -0,0 +1,67 @@
+import random
+
+import main
+
+
+def test_matches_a_plain_string_under_random_edits():
+    rng = random.Random(7)
+    buf = main.gapBuffer("start")
+    text,pos = "start",5
+    for _ in range(5000):
+        op = rng.random()
+        if op < 0.35:
+            piece = "".join(rng.choice("ab \n") for _ in range(rng.choice((1,1,2,100))))
+            buf.insert(piece)
+            text,pos = text[:pos] + piece + text[pos:],pos + len(piece)
+        elif op < 0.5:
+            n = rng.randint(1,3)
+            buf.backspace(n)
+            n = min(n,pos)
+            text,pos = text[:pos - n] + text[pos:],pos - n
+        elif op < 0.65:
+            n = rng.randint(1,3)
+            buf.delete(n)
+            text = text[:pos] + text[pos + n:]
+        else:
+            target = rng.randint(-2,len(text) + 2)
+            buf.move_to(target)
+            pos = max(0,min(target,len(text)))
+        assert buf.cursor == pos and len(buf) == len(text)
+        if rng.random() < 0.1:
+            assert buf.text() == text
+    assert buf.text() == text
+
+
+def test_text_is_cached_until_an_edit():
+    buf = main.gapBuffer("hello")
+    first = buf.text()
+    buf.move_to(2)
+    assert buf.text() is first # moving the cursor doesn't change the text
+    buf.backspace(0)
+    buf.delete(0)
+    assert buf.text() is first
+    buf.insert("X")
+    assert buf.text() == "heXllo"
+
+
+def test_words_and_lines():
+    buf = main.gapBuffer("one two-three\nfour five\nsix")
+    buf.move_to(len("one two-thr"))
+    assert buf.word_left() == len("one two-")
+    assert buf.word_right() == len("one two-three")
+    assert (buf.line_start(),buf.line_end()) == (0,len("one two-three"))
+    assert buf.move_line(1) and buf.cursor == len("one two-three\nfour five") # column clamped to the shorter line
+    assert buf.move_line(1) and buf.cursor == len(buf.text())
+    assert not buf.move_line(1)
+    buf.move_to(len("one two-three\nfo"))
+    assert buf.move_line(-1) and buf.cursor == 2
+    assert not buf.move_line(-1)
+
+
+def test_set_replaces_everything():
+    buf = main.gapBuffer("draft")
+    buf.move_to(1)
+    buf.set("new text")
+    assert buf.text() == "new text" and buf.cursor == len("new text")
+    buf.insert("!")
+    assert buf.text() == "new text!"
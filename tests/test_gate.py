@@ -0,0 +1,122 @@
+import asyncio
+import time
+
+import pytest
+
+import main
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro,5))
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_stream_limit_and_priority():
+    async def go():
+        gate = main.requestGate(2,per_min=6000)
+        await gate.acquire()
+        await gate.acquire()
+        order = []
+
+        async def wait_turn(name,priority):
+            await gate.acquire(priority)
+            order.append(name)
+
+        tasks = [asyncio.create_task(wait_turn('summary',1)),asyncio.create_task(wait_turn('user',0))]
+        await settle()
+        assert order == [] and gate.active == 2 # both slots taken
+        gate.release()
+        await settle()
+        assert order == ['user'] # queued later, but the user's own turn goes first
+        gate.release()
+        await asyncio.gather(*tasks)
+        assert order == ['user','summary'] and gate.active == 2
+    run(go())
+
+
+def test_cancelled_waiters_give_their_place_back():
+    async def go():
+        gate = main.requestGate(1,per_min=6000)
+        await gate.acquire()
+        waiter = asyncio.create_task(gate.acquire())
+        await settle()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        gate.release()
+        assert gate.active == 0
+        await gate.acquire() # the slot's free, not held by the cancelled waiter
+        assert gate.active == 1
+    run(go())
+
+
+def test_token_bucket_spaces_requests_out():
+    async def go():
+        gate = main.requestGate(10,per_min=600,burst=2) # 10 a second after a burst of 2
+        t0 = time.monotonic()
+        for _ in range(4):
+            await gate.acquire()
+            gate.release()
+        return time.monotonic() - t0
+    assert 0.15 <= run(go()) < 1
+
+
+def test_backing_off_and_recovering():
+    gate = main.requestGate(4,per_min=600)
+    gate.note(429,{'retry-after': '2'})
+    assert gate.rate == pytest.approx(5) and gate.strikes == 1
+    assert gate.paused_until == pytest.approx(time.monotonic() + 2,abs=0.5)
+    gate.note(429,{})
+    assert gate.rate == pytest.approx(2.5) and gate.strikes == 2 # no header: 1s, 2s, 4s...
+    for _ in range(50):
+        gate.note(200,{})
+    assert gate.rate == pytest.approx(10) and gate.strikes == 0 # back up, never past the limit
+    gate.note(200,{'x-ratelimit-limit-requests': '120'})
+    assert gate.ceiling == pytest.approx(2) and gate.rate == pytest.approx(2)
+    gate.paused_until = 0
+    gate.note(200,{'x-ratelimit-remaining-requests': '0','x-ratelimit-reset-requests': '6m0s'})
+    assert gate.paused_until == pytest.approx(time.monotonic() + 360,abs=1)
+
+
+def test_pause_holds_requests_back():
+    async def go():
+        gate = main.requestGate(4,per_min=6000)
+        gate.paused_until = time.monotonic() + 0.2
+        t0 = time.monotonic()
+        await gate.acquire()
+        return time.monotonic() - t0
+    assert run(go()) >= 0.15
+
+
+def test_one_timer_however_often_it_pumps():
+    async def go():
+        loop = asyncio.get_running_loop()
+        armed = []
+        call_later = loop.call_later
+        loop.call_later = lambda *args: armed.append(call_later(*args)) or armed[-1]
+        gate = main.requestGate(4,per_min=6000)
+        gate.paused_until = time.monotonic() + 0.1
+        tasks = [asyncio.create_task(gate.acquire()) for _ in range(3)]
+        await settle()
+        gate.active += 1
+        gate.release() # pumps again while they wait
+        assert [h.cancelled() for h in armed] == [True,True,True,False]
+        await asyncio.gather(*tasks)
+        assert gate.active == 3 and len(armed) == 4 # the one left woke them all
+    run(go())
+
+
+@pytest.mark.parametrize('value,seconds',[('7',7),('1.5',1.5),('6m0s',360),('20ms',0.02),('1h2m',3720)])
+def test_header_wait(value,seconds):
+    assert main.header_wait(value) == pytest.approx(seconds)
+
+
+def test_header_wait_absolute_times():
+    assert main.header_wait(str(time.time() + 30)) == pytest.approx(30,abs=1)
+    assert main.header_wait(str(int((time.time() + 30) * 1000))) == pytest.approx(30,abs=1)
+    assert main.header_wait("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+    assert main.header_wait("soon") is None
@@ -0,0 +1,114 @@
+import os
+import sys
+
+import pytest
+
+import main
+
+
+def msgs(*pairs):
+    return [main.chatMsg(role,text) for role,text in pairs]
+
+
+@pytest.fixture(params=['numpy','python'])
+def index(request,monkeypatch):
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setitem(sys.modules,'numpy',None) # import fails, plain python scoring
+    mgr = main.chatMgr()
+    idx = main.chatIndex(mgr)
+    idx.load()
+    return idx
+
+
+def add_chat(index,*pairs):
+    mgr = index.chat_mgr
+    mgr.new_chat()
+    chat = mgr.chats[0]
+    mgr.upd_chat(chat,msgs(*pairs))
+    index.index_chat(chat)
+    return chat
+
+
+def hits(index,text):
+    return [(chat_id,m) for score,chat_id,m,off in index.query(text)]
+
+
+def live_rows(index):
+    return sum(row is not None for row in index.rows)
+
+
+def test_edited_text_stops_matching(index):
+    chat = add_chat(index,('user',"nginx proxy_read_timeout keeps firing"),('assistant',"raise the upstream timeout"))
+    assert hits(index,"nginx proxy timeout") == [(chat['id'],0)]
+    chat['messages'][0] = main.chatMsg('user',"postgres vacuum is slow on big tables")
+    index.index_chat(chat)
+    assert hits(index,"postgres vacuum slow") == [(chat['id'],0)]
+    assert all(m != 0 for chat_id,m in hits(index,"nginx proxy_read_timeout firing"))
+    assert live_rows(index) == 2
+
+
+def test_moved_text_keeps_its_vector(index,monkeypatch):
+    chat = add_chat(index,('user',"first question about kubernetes ingress"),('assistant',"use an ingress controller"),
+                    ('user',"second question about terraform state locking"))
+    embedded = []
+    embed = index.embed
+    monkeypatch.setattr(index,'embed',lambda texts: embedded.extend(texts) or embed(texts))
+    del chat['messages'][:2]
+    index.index_chat(chat)
+    assert embedded == [] # nothing new to embed, only rows to move
+    assert hits(index,"terraform state locking") == [(chat['id'],0)]
+    assert live_rows(index) == 1
+
+
+def test_switching_branches_reindexes_the_tail(index):
+    chat = add_chat(index,('user',"how do I rotate logs"),('assistant',"logrotate with a daily cron"))
+    main.fork_chat(chat,1)
+    chat['messages'][1:] = msgs(('assistant',"journald keeps rotating by size"))
+    index.index_chat(chat)
+    assert hits(index,"journald rotating size") == [(chat['id'],1)]
+    assert main.switch_branch(chat,1)
+    index.index_chat(chat)
+    assert hits(index,"logrotate daily cron") == [(chat['id'],1)]
+    assert (chat['id'],1) not in hits(index,"journald rotating size")
+
+
+def test_deleted_chat_loses_its_rows(index):
+    keep = add_chat(index,('user',"rust borrow checker lifetimes"))
+    gone = add_chat(index,('user',"docker layer caching in ci"))
+    index.drop(gone['id'])
+    assert hits(index,"docker layer caching") == []
+    assert hits(index,"rust borrow checker") == [(keep['id'],0)]
+
+
+def test_other_processes_follow_along_and_compaction(index):
+    chat = add_chat(index,('user',"alpha bravo charlie"))
+    other = main.chatIndex(index.chat_mgr) # another shellLLM on the same files
+    other.load()
+    assert hits(other,"alpha bravo") == [(chat['id'],0)]
+    for i in range(300):
+        chat['messages'][0] = main.chatMsg('user',f"edit number {i} of the zebra question")
+        index.index_chat(chat)
+    size = os.path.getsize(index.vec_path)
+    index.compact()
+    assert os.path.getsize(index.vec_path) < size // 100
+    assert index.dead == 0 and len(index.rows) == 1
+    with main.store_lock(other.vec_path,exclusive=False):
+        other.sync_meta()
+    assert other.rows == index.rows and other.gen == index.gen
+    assert hits(other,"zebra question edit 299") == [(chat['id'],0)]
+    again = main.chatIndex(index.chat_mgr)
+    again.load()
+    assert hits(again,"zebra question edit 299") == [(chat['id'],0)]
+
+
+def test_startup_pass_drops_chats_that_are_gone(index):
+    chat = add_chat(index,('user',"gone before the next start"))
+    mgr = index.chat_mgr
+    mgr.chats.remove(chat)
+    mgr.save_chats()
+    fresh = main.chatIndex(main.chatMgr())
+    fresh.start()
+    assert fresh.ready.wait(5)
+    assert hits(fresh,"gone before the next start") == []
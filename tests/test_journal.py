@@ -0,0 +1,125 @@
+import os
+
+import pytest
+
+import main
+
+
+def msgs(*pairs):
+    return [main.chatMsg(role,text) for role,text in pairs]
+
+
+@pytest.fixture
+def journal(tmp_path):
+    j = main.replyJournal(folder=str(tmp_path / 'inflight'))
+    j.every = {'tokens': 1.0,'ms': 0.0} # write every chunk
+    return j
+
+
+def crash(journal,chat_id,history,chunks,cont=False,route='remote'):
+    # a reply that streamed `chunks` and never got to end() / a save
+    at = len(history) - 1 if cont else len(history)
+    journal.begin(chat_id,history,at,cont,route)
+    for chunk in chunks:
+        journal.add(chat_id,chunk)
+    journal._close(chat_id) # the process is gone, so is its lock
+
+
+def files(journal):
+    return sorted(os.listdir(journal.folder))
+
+
+def test_reply_goes_back_into_its_chat(journal):
+    history = msgs(('user','q1'),('assistant','a1'),('user','q2'))
+    crash(journal,'c1',history,["partial ","reply"])
+    chat = {'id': 'c1','messages': history[:2],'version': 3} # q2 wasn't saved either
+    assert journal.recover([chat]) == 1
+    assert [m['content'] for m in chat['messages']] == ['q1','a1','q2','partial reply']
+    assert chat['messages'][-1]['incomplete']
+    assert chat['version'] == 4
+    assert files(journal) == []
+
+
+def test_continued_reply_and_route(journal):
+    history = msgs(('user','q1'),('assistant','half'))
+    history[1]['incomplete'] = True
+    crash(journal,'c1',history,[" and more"],cont=True,route='local')
+    chat = {'id': 'c1','messages': msgs(('user','q1'),('assistant','half'))}
+    chat['messages'][1]['incomplete'] = True
+    assert journal.recover([chat]) == 1
+    last = chat['messages'][1]
+    assert last['content'] == 'half and more'
+    assert last['incomplete'] and last['route'] == 'local'
+
+
+def test_never_saved_chat_comes_back_as_a_new_one(journal):
+    crash(journal,'fresh',msgs(('user','hello there')),["hi"])
+    chats = [{'id': 'other','messages': []}]
+    assert journal.recover(chats) == 1
+    assert chats[0]['id'] == 'fresh'
+    assert [m['content'] for m in chats[0]['messages']] == ['hello there','hi']
+    assert chats[0]['title'] == main.chat_title(chats[0]['messages'])
+
+
+def test_already_saved_reply_is_just_deleted(journal):
+    history = msgs(('user','q1'))
+    crash(journal,'c1',history,["the whole ","reply"])
+    chat = {'id': 'c1','messages': msgs(('user','q1'),('assistant','the whole reply'))}
+    assert journal.recover([chat]) == 0
+    assert [m['content'] for m in chat['messages']] == ['q1','the whole reply']
+    assert files(journal) == []
+
+
+def test_reply_that_no_longer_fits_is_kept_aside(journal):
+    history = msgs(('user','q1'))
+    crash(journal,'c1',history,["lost reply"])
+    chat = {'id': 'c1','messages': msgs(('user','something else'),('assistant','x'))}
+    assert journal.recover([chat]) == 0
+    assert [m['content'] for m in chat['messages']] == ['something else','x']
+    assert files(journal) == ['c1.jsonl.bad']
+    crash(journal,'gone',msgs(('user','q'),('assistant','a'),('user','q2')),["text"])
+    assert journal.recover([]) == 0 # its chat was deleted
+    assert files(journal) == ['c1.jsonl.bad','gone.jsonl.bad']
+
+
+def test_cut_off_last_line_is_ignored(journal):
+    crash(journal,'c1',msgs(('user','q1')),["kept"])
+    with open(os.path.join(journal.folder,'c1.jsonl'),'a') as f:
+        f.write('{"d": "half writ')
+    chat = {'id': 'c1','messages': msgs(('user','q1'))}
+    assert journal.recover([chat]) == 1
+    assert chat['messages'][-1]['content'] == 'kept'
+
+
+def test_reply_still_streaming_is_left_alone(journal):
+    journal.begin('c1',msgs(('user','q1')),1,False)
+    journal.add('c1',"streaming")
+    chat = {'id': 'c1','messages': msgs(('user','q1'))}
+    if main.replyJournal.try_lock(open(os.devnull)): # no flock here (windows), nothing to test
+        assert journal.recover([chat]) == 0
+        assert files(journal) == ['c1.jsonl']
+    journal._close('c1')
+
+
+def test_saved_removes_only_ended_replies(journal):
+    journal.begin('c1',msgs(('user','q1')),1,False)
+    journal.add('c1',"a")
+    ended = journal.ended_now()
+    journal.saved(ended)
+    assert files(journal) == ['c1.jsonl'] # still streaming when that save started
+    journal.end('c1')
+    journal.saved(journal.ended_now())
+    assert files(journal) == []
+
+
+def test_chat_mgr_recovers_on_load(journal):
+    mgr = main.chatMgr()
+    mgr.upd_chat(mgr.chats[0],msgs(('user','q1')))
+    chat_id = mgr.chats[0]['id']
+    crash(journal,chat_id,mgr.chats[0]['messages'],["partial"])
+    again = main.chatMgr(journal=journal)
+    assert again.recovered == 1
+    assert again.chats[0]['messages'][-1]['content'] == 'partial'
+    assert files(journal) == []
+    third = main.chatMgr() # and it was saved
+    assert third.chats[0]['messages'][-1]['content'] == 'partial'
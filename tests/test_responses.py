@@ -0,0 +1,47 @@
+import main
+
+
+def make_chat(monkeypatch,*texts):
+    monkeypatch.setenv('SHELLLLM_CAPS','responses=1')
+    chat = main.mainChat(api_key='k',base_url='https://example.invalid/v1',model='remote/model')
+    rec = {'id': 'c1','messages': [main.chatMsg("user" if i % 2 == 0 else "assistant",t) for i,t in enumerate(texts)]}
+    chat.open(rec)
+    return chat,rec
+
+
+def test_input_uses_the_pinned_summary(monkeypatch):
+    chat,rec = make_chat(monkeypatch,"q1","a1","q2","a2","q3")
+    rec['summary'] = {'upto': 4,'hash': main.chat_hash(rec['messages'][:4]),'content': "notes"}
+    url,data,mode = chat.build_request()
+    assert mode == 'responses' and url == "https://example.invalid/v1/responses"
+    assert data['model'] == 'remote/model'
+    assert [item['role'] for item in data['input']] == ['system','user']
+    assert "notes" in data['input'][0]['content']
+
+
+def test_input_is_trimmed_to_the_context(monkeypatch):
+    chat,rec = make_chat(monkeypatch,"x" * 4000,"a1","q2")
+
+    class catalog:
+        def context(self,model):
+            return 500
+
+        def tools(self,model):
+            return None
+
+    chat.catalog = catalog()
+    url,data,mode = chat.build_request()
+    assert [item['content'] for item in data['input']] == ["a1","q2"]
+
+
+def test_previous_response_only_sends_whats_new(monkeypatch):
+    chat,rec = make_chat(monkeypatch,"q1","a1")
+    sent = chat.context_msgs()
+    chat.resp_state = {'id': 'resp_1','model': 'remote/model','upto': len(sent),'hash': main.chat_hash(sent)}
+    rec['messages'].append(main.chatMsg("user","q2"))
+    url,data,mode = chat.build_request()
+    assert data['previous_response_id'] == 'resp_1'
+    assert [item['content'] for item in data['input']] == ["q2"]
+    chat.model = 'other/model' # the state belongs to the model that made it
+    url,data,mode = chat.build_request()
+    assert 'previous_response_id' not in data and len(data['input']) == 3
@@ -0,0 +1,40 @@
+import main
+
+
+def make_chat(monkeypatch):
+    monkeypatch.setenv('SHELLLLM_LOCAL','auto')
+    chat = main.mainChat(api_key='k',base_url='https://example.invalid/v1',model='remote/model')
+    local = main.localBackend(urls=['http://127.0.0.1:9/v1'],model='local/model')
+    local.base_url = local.urls[0] # as if detect() had found it
+    chat.local = local
+    return chat
+
+
+def test_short_prompts_go_local(monkeypatch):
+    chat = make_chat(monkeypatch)
+    chat.convo_history.append(main.chatMsg("user","hi"))
+    assert chat.pick_route() == 'local'
+    url,data,mode = chat.build_request('local')
+    assert url == "http://127.0.0.1:9/v1/chat/completions"
+    assert data['model'] == 'local/model'
+    chat.convo_history.append(main.chatMsg("user","x" * 1000))
+    assert chat.pick_route() == 'remote'
+
+
+def test_continue_stays_on_the_route_that_started_it(monkeypatch):
+    chat = make_chat(monkeypatch)
+    chat.convo_history.append(main.chatMsg("user","hi"))
+    chat.keep_reply("partial from the local model",cont=False,done=False,route='local')
+    last = chat.convo_history[-1]
+    assert last['route'] == 'local'
+    assert 'route' not in main.wire_msg(last) and 'incomplete' not in main.wire_msg(last)
+    chat.tools = main.toolRegistry('.') # would send a new prompt remote, not a continuation
+    assert chat.pick_route() == 'local'
+    chat.keep_reply(" and the rest",cont=True,done=True,route='local')
+    assert 'route' not in last and 'incomplete' not in last
+
+    chat.convo_history.append(main.chatMsg("user","hi again"))
+    chat.keep_reply("partial from the remote model",cont=False,done=False,route='remote')
+    assert 'route' not in chat.convo_history[-1]
+    chat.tools = None
+    assert chat.pick_route() == 'remote'
@@ -0,0 +1,72 @@
+import http.client
+import json
+import os
+import threading
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def server(monkeypatch,tmp_path):
+    monkeypatch.setenv('API_KEY','k')
+    monkeypatch.setenv('SHELLLLM_SEMANTIC','0')
+    monkeypatch.setenv('SHELLLLM_WORKSPACE',str(tmp_path / 'ws'))
+    (tmp_path / 'ws').mkdir()
+    (tmp_path / 'ws' / 'notes.txt').write_text("inside")
+    (tmp_path / 'secret.txt').write_text("outside")
+    srv = main.make_server('127.0.0.1',0)
+    threading.Thread(target=srv.serve_forever,daemon=True).start()
+    with open(srv.token_path) as f:
+        srv.token = f.read().strip()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def call(srv,method,path,body=None,headers=None,token=True):
+    conn = http.client.HTTPConnection('127.0.0.1',srv.server_address[1],timeout=5)
+    hdrs = {'Content-Type': 'application/json'}
+    if token:
+        hdrs['Authorization'] = f"Bearer {srv.token}"
+    hdrs.update(headers or {})
+    data = json.dumps(body).encode() if isinstance(body,dict) else body
+    conn.request(method,path,body=data,headers=hdrs)
+    res = conn.getresponse()
+    out = res.status,json.loads(res.read() or b'null')
+    conn.close()
+    return out
+
+
+def test_token_file_is_private(server):
+    assert os.stat(server.token_path).st_mode & 0o077 == 0
+
+
+def test_needs_the_token(server):
+    assert call(server,'GET','/chats',token=False)[0] == 401
+    assert call(server,'GET','/chats',headers={'Authorization': 'Bearer nope'})[0] == 401
+    assert call(server,'GET','/chats')[0] == 200
+    assert call(server,'GET','/health',token=False)[0] == 200
+
+
+def test_other_hosts_are_refused(server):
+    # a page on evil.example whose name now points at 127.0.0.1
+    assert call(server,'GET','/chats',headers={'Host': 'evil.example:8484'})[0] == 421
+    assert call(server,'GET','/health',headers={'Host': 'evil.example'})[0] == 421
+    assert call(server,'GET','/chats',headers={'Host': 'localhost:8484'})[0] == 200
+
+
+def test_posts_must_be_json(server):
+    status,body = call(server,'POST','/chats',body=b'{}',headers={'Content-Type': 'text/plain'})
+    assert status == 415
+    assert call(server,'POST','/chats',body={})[0] == 201
+
+
+def test_attachments_stay_in_the_workspace(server):
+    status,chat = call(server,'POST','/chats',body={})
+    for path in ('../secret.txt',str(server.token_path),'/etc/passwd'):
+        status,body = call(server,'POST',f"/chats/{chat['id']}/reply",body={'content': "hi",'attach': [path]})
+        assert status == 403 and 'outside the workspace' in body['error']
+    handler = server.RequestHandlerClass
+    assert handler.attach_path(None,'notes.txt') == os.path.realpath(os.path.join(os.environ['SHELLLLM_WORKSPACE'],'notes.txt'))
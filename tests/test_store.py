@@ -0,0 +1,121 @@
+import main
+
+
+def msgs(*pairs):
+    return [main.chatMsg(role,text) for role,text in pairs]
+
+
+def texts(chat):
+    return [m['content'] for m in chat['messages']]
+
+
+def two_instances():
+    # two shellLLMs sharing one chats.json
+    a = main.chatMgr()
+    a.upd_chat(a.chats[0],msgs(('user','q1'),('assistant','a1')))
+    b = main.chatMgr()
+    return a,b
+
+
+def by_id(mgr,chat_id):
+    return mgr.find_chat(chat_id)[1]
+
+
+def test_both_sides_of_a_concurrent_edit_are_kept():
+    a,b = two_instances()
+    chat_id = a.chats[0]['id']
+    a.upd_chat(a.chats[0],a.chats[0]['messages'] + msgs(('user','from a'),('assistant','ra')))
+    held = b.chats[0]['messages']
+    b.upd_chat(b.chats[0],held + msgs(('user','from b'),('assistant','rb')))
+    merged = by_id(b,chat_id)
+    assert texts(merged) == ['q1','a1','from a','ra','from b','rb']
+    assert merged['version'] > by_id(a,chat_id)['version']
+    assert main.chatMgr().chats[0]['messages'] == merged['messages'] # and that's what got saved
+
+
+def test_their_change_lands_in_the_list_we_hold():
+    a,b = two_instances()
+    held = b.chats[0]['messages'] # e.g. mainChat.convo_history
+    a.upd_chat(a.chats[0],a.chats[0]['messages'] + msgs(('user','q2')))
+    a.set_title(a.chats[0],"renamed")
+    assert b.poll_changes(min_interval=0)
+    assert held is b.chats[0]['messages'] and texts(b.chats[0]) == ['q1','a1','q2']
+    assert b.chats[0]['title'] == "renamed"
+    assert not b.poll_changes(min_interval=0) # nothing new since
+
+
+def test_new_and_deleted_chats_travel():
+    a,b = two_instances()
+    first = a.chats[0]['id']
+    a.new_chat()
+    a.upd_chat(a.chats[0],msgs(('user','other chat')))
+    second = a.chats[0]['id']
+    b.save_chats() # merges before it writes
+    assert {c['id'] for c in b.chats} == {first,second}
+    a.cur_chat_idx = a.find_chat(first)[0]
+    assert a.del_cur_chat()
+    assert b.poll_changes(min_interval=0)
+    assert [c['id'] for c in b.chats] == [second]
+
+
+def test_a_chat_deleted_elsewhere_survives_if_we_changed_it():
+    a,b = two_instances()
+    a.new_chat()
+    chat_id = b.chats[0]['id']
+    a.cur_chat_idx = a.find_chat(chat_id)[0]
+    a.del_cur_chat()
+    b.upd_chat(b.chats[0],b.chats[0]['messages'] + msgs(('user','still here')))
+    assert texts(by_id(b,chat_id))[-1] == 'still here'
+    assert by_id(main.chatMgr(),chat_id) is not None
+
+
+def test_deleting_here_wins_over_their_edit():
+    a,b = two_instances()
+    chat_id = a.chats[0]['id']
+    b.new_chat()
+    a.upd_chat(a.chats[0],a.chats[0]['messages'] + msgs(('user','late edit')))
+    b.cur_chat_idx = b.find_chat(chat_id)[0]
+    assert b.del_cur_chat()
+    assert by_id(b,chat_id) is None
+    assert by_id(main.chatMgr(),chat_id) is None
+
+
+
+
+
+def test_saving_while_another_thread_changes_chats():
+    import threading
+    mgr = main.chatMgr()
+    chat = mgr.chats[0]
+    writing,renamed = threading.Event(),threading.Event()
+
+    class slowMsg(main.chatMsg):
+        __slots__ = ()
+
+        def to_json(self):
+            # the save is halfway through this chat when the title changes
+            writing.set()
+            renamed.wait(1)
+            return super().to_json()
+
+    with mgr.chat_lock(chat['id']):
+        chat['messages'].append(slowMsg("user","q1"))
+    errors = []
+
+    def save():
+        try:
+            mgr.save_chats()
+        except Exception as e:
+            errors.append(e)
+
+    saver = threading.Thread(target=save)
+    saver.start()
+    writing.wait(1)
+    renamer = threading.Thread(target=mgr.set_title,args=(chat,"named")) # adds 'titled'
+    renamer.start()
+    renamer.join(0.2)
+    renamed.set()
+    saver.join()
+    renamer.join()
+    assert errors == []
+    assert main.chatMgr().chats[0]['title'] == "named"
@@ -0,0 +1,156 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import main
+
+
+class sseHandler(BaseHTTPRequestHandler):
+    # a chat completions endpoint that streams "w0 w1 ... w19" one word at a time
+    protocol_version = 'HTTP/1.1'
+    open_streams = 0
+    most_open = 0
+    counts = threading.Lock()
+
+    def log_message(self,*args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.send_response(200)
+        self.send_header('Content-Type','text/event-stream')
+        self.send_header('Transfer-Encoding','chunked')
+        self.end_headers()
+
+        def send(line):
+            data = line.encode() + b"\n\n"
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data),data))
+            self.wfile.flush()
+
+        def done():
+            with self.counts:
+                sseHandler.open_streams -= 1
+
+        with self.counts:
+            sseHandler.open_streams += 1
+            sseHandler.most_open = max(sseHandler.most_open,sseHandler.open_streams)
+        try:
+            for i in range(20):
+                send("data: " + json.dumps({'choices': [{'delta': {'content': f"w{i} "}}]}))
+                time.sleep(0.02)
+        except OSError:
+            done() # the client hung up
+            return
+        done() # before the client can see the end and send the next request
+        try:
+            send("data: [DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+        except OSError:
+            pass
+
+
+class quietServer(ThreadingHTTPServer):
+    def handle_error(self,request,client_address):
+        pass # resets from clients that hang up mid-stream are the point of these tests
+
+
+@pytest.fixture
+def server():
+    srv = quietServer(('127.0.0.1',0),sseHandler)
+    threading.Thread(target=srv.serve_forever,daemon=True).start()
+    yield f"http://127.0.0.1:{srv.server_address[1]}/v1"
+    srv.shutdown()
+
+
+def test_full_reply(server):
+    chat = main.mainChat(api_key='k',base_url=server,model='m')
+    assert chat.send_msg("hi",stream=False).split() == [f"w{i}" for i in range(20)]
+    assert 'incomplete' not in chat.convo_history[-1]
+
+
+def test_closing_the_stream_keeps_the_partial_reply(server):
+    chat = main.mainChat(api_key='k',base_url=server,model='m')
+    gen = chat.send_msg("hi",stream=True)
+    got = [next(gen) for _ in range(3)]
+    gen.close()
+    last = chat.convo_history[-1]
+    assert last['role'] == 'assistant' and last['incomplete']
+    assert last['content'].startswith("".join(got))
+    assert chat.can_continue()
+
+
+def test_async_reply(server):
+    chat = main.mainChat(api_key='k',base_url=server,model='m')
+
+    async def go():
+        return [chunk async for chunk in chat.asend_msg("hi")]
+    assert "".join(asyncio.run(go())).split() == [f"w{i}" for i in range(20)]
+    assert 'incomplete' not in chat.convo_history[-1]
+
+
+def test_cancelling_the_async_reply_keeps_the_partial_reply(server):
+    chat = main.mainChat(api_key='k',base_url=server,model='m')
+    got = []
+
+    async def read():
+        async for chunk in chat.asend_msg("hi"):
+            got.append(chunk)
+
+    async def go():
+        task = asyncio.create_task(read())
+        while len(got) < 3:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+    asyncio.run(go())
+    last = chat.convo_history[-1]
+    assert last['role'] == 'assistant' and last['incomplete']
+    assert last['content'].startswith("".join(got))
+    assert chat.can_continue()
+
+
+def test_async_replies_wait_for_a_free_stream(server):
+    engine = main.chatEngine(max_streams=2)
+    chats = [main.mainChat(api_key='k',base_url=server,model='m',engine=engine) for _ in range(4)]
+    sseHandler.most_open = 0
+
+    async def reply(chat):
+        return "".join([chunk async for chunk in chat.asend_msg("hi")])
+
+    async def go():
+        return await asyncio.gather(*(reply(chat) for chat in chats))
+    replies = asyncio.run(go())
+    assert all(len(r.split()) == 20 for r in replies)
+    assert sseHandler.most_open == 2
+
+
+def test_async_continue_and_regenerate(server):
+    chat = main.mainChat(api_key='k',base_url=server,model='m')
+    chat.convo_history.append(main.chatMsg("user","hi"))
+    chat.convo_history.append(main.chatMsg("assistant","w0 ",incomplete=True))
+
+    async def drain(agen):
+        return "".join([chunk async for chunk in agen])
+
+    asyncio.run(drain(chat.acontinue_last()))
+    last = chat.convo_history[-1]
+    assert last['content'].startswith("w0 w0 w1") and 'incomplete' not in last
+    assert chat.acontinue_last() is None # nothing left to finish
+    assert asyncio.run(drain(chat.aregen_last())).split() == [f"w{i}" for i in range(20)]
+    assert [m['role'] for m in chat.convo_history] == ['user','assistant']
+
+
+def test_profile_sees_the_streaming_thread(server,tmp_path):
+    chat = main.mainChat(api_key='k',base_url=server,model='m')
+    prof = main.sessionProfiler(out_dir=str(tmp_path))
+    prof.start()
+    chat.send_msg("hi",stream=False)
+    with open(prof.stop()) as f:
+        hot = f.read().split("== top 25")[0]
+    for name in ('_astream_round','post_lines','(loads)'):
+        assert name in hot
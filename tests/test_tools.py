@@ -0,0 +1,107 @@
+import os
+import shutil
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def project(tmp_path):
+    root = tmp_path / 'project'
+    (root / 'src').mkdir(parents=True)
+    (root / 'src' / 'app.py').write_text("def main():\n    return 1\n")
+    (root / 'notes.txt').write_text("hello\n")
+    (tmp_path / 'outside.txt').write_text("secret\n")
+    os.symlink(tmp_path / 'outside.txt',root / 'link.txt')
+    return root
+
+
+@pytest.fixture
+def tools(project):
+    return main.toolRegistry(str(project),commands="ls,cat,grep,wc,git diff,git log",auto="read_file,list_dir,grep")
+
+
+def test_path_stays_inside_root(tools,project):
+    assert tools.path('src/app.py') == str(project / 'src' / 'app.py')
+    assert tools.path('.') == str(project)
+    for rel in ('..','../outside.txt','/etc/passwd','src/../../outside.txt','~/x','link.txt'):
+        with pytest.raises(ValueError):
+            tools.path(rel)
+
+
+def test_read_file_and_grep(tools):
+    assert "return 1" in tools.run('read_file',{'path': 'src/app.py'})
+    assert tools.run('read_file',{'path': '../outside.txt'}).startswith("error:")
+    assert "src/app.py:1: def main():" in tools.run('grep',{'pattern': 'def main'})
+    assert "secret" not in tools.run('grep',{'pattern': 'secret'})
+
+
+@pytest.mark.parametrize('argv',[
+    ['rm','-rf','.'],
+    ['git','status'], # not in this registry's list
+    ['cat','/etc/passwd'],
+    ['cat','../outside.txt'],
+    ['cat','link.txt'],
+    ['grep','-f/etc/passwd','x'],
+    ['grep','-rf/etc/passwd','x'],
+    ['grep','--file=/etc/passwd','x'],
+    ['grep','-f','../outside.txt','x'],
+    ['grep','-f..','x'],
+    ['git','diff','--no-index','--output=/tmp/x','a','b'],
+    ['git','diff','--output=inside.txt'],
+    ['git','diff','--out=inside.txt'],
+    ['git','log','-o','x'],
+])
+def test_check_argv_refuses(tools,argv):
+    with pytest.raises(ValueError):
+        tools.check_argv(argv)
+
+
+@pytest.mark.parametrize('argv',[
+    ['ls','-la'],
+    ['cat','src/app.py'],
+    ['grep','-rn','def','src'],
+    ['wc','-l','notes.txt'],
+    ['git','log','--format=%h/%s','-3'],
+])
+def test_check_argv_allows(tools,argv):
+    tools.check_argv(argv)
+
+
+def test_find_is_not_allowed_by_default(project):
+    tools = main.toolRegistry(str(project),commands=None)
+    assert ['find'] not in tools.commands
+    with pytest.raises(ValueError):
+        tools.check_argv(['find','.','-maxdepth','0','-exec','sh','-c','id',';'])
+
+
+def test_find_actions_refused_when_allowed(project):
+    tools = main.toolRegistry(str(project),commands="find")
+    tools.check_argv(['find','.','-name','*.py'])
+    for opt in ('-exec','-execdir','-ok','-okdir','-delete','-fprint','-fls'):
+        with pytest.raises(ValueError):
+            tools.check_argv(['find','.',opt,'x'])
+
+
+@pytest.mark.skipif(shutil.which('ls') is None,reason="needs ls")
+def test_run_command_runs_in_root(tools):
+    out = tools.run('run_command',{'command': 'ls'})
+    assert out.startswith("exit code 0")
+    assert "notes.txt" in out
+    assert tools.run('run_command',{'command': 'cat ../outside.txt'}).startswith("error:")
+
+
+def test_label_shows_the_whole_command(tools):
+    cmd = "grep -rn 'a b' " + "x" * 200
+    label = tools.label('run_command',{'command': cmd})
+    assert label.endswith("x" * 200)
+    assert "'a b'" in label
+
+
+def test_prepare_and_confirm(tools):
+    assert tools.prepare({'name': 'nope','arguments': '{}'})[1]
+    assert tools.prepare({'name': 'grep','arguments': '{bad'})[1]
+    assert tools.prepare({'name': 'grep','arguments': '{"pattern": "x"}'}) == ({'pattern': 'x'},None)
+    assert tools.needs_confirm('run_command')
+    assert not tools.needs_confirm('read_file')
@@ -0,0 +1,33 @@
+import time
+
+import pytest
+
+import main
+
+
+def streamed(n):
+    span = main.traceSpan('chat')
+    for _ in range(n):
+        time.sleep(0.01)
+        span.chunk()
+    return span
+
+
+def test_chunks_arent_reported_as_tokens():
+    span = streamed(3)
+    rec = span.finish()
+    assert rec['chunks'] == 3 and rec['chunk_s'] > 0
+    assert 'tok_s' not in rec and 'tokens' not in rec # the server never said how many tokens
+    tracer = main.perfTracer('off')
+    tracer.last = span
+    assert "chunks/s" in tracer.summary() and "tok/s" not in tracer.summary()
+
+
+def test_token_rate_comes_from_the_reported_usage():
+    span = streamed(3)
+    span.rec['completion_tokens'] = 30 # several tokens per chunk
+    rec = span.finish()
+    assert rec['tok_s'] == pytest.approx(15 * rec['chunk_s'],rel=0.01)
+    tracer = main.perfTracer('off')
+    tracer.last = span
+    assert "tok/s" in tracer.summary()
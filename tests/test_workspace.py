@@ -0,0 +1,54 @@
+import os
+import time
+
+import main
+
+
+def write(path,text):
+    os.makedirs(os.path.dirname(path),exist_ok=True)
+    with open(path,'w') as f:
+        f.write(text)
+
+
+def files_hit(ws,query):
+    return [rel for score,rel,first,last in ws.search(query)]
+
+
+def settle(ws):
+    # waits out the background refresh a search started
+    deadline = time.monotonic() + 5
+    while (ws.checked == 0 or ws.refreshing.locked()) and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_first_search_indexes_then_changes_come_from_the_background(tmp_path):
+    root = tmp_path / 'proj'
+    write(str(root / 'src' / 'server.py'),"def handle_upload(request):\n    return save_blob(request)\n")
+    write(str(root / 'node_modules' / 'x.js'),"handle_upload everywhere")
+    ws = main.workspaceIndex(str(root))
+    assert files_hit(ws,"handle_upload") == [os.path.join('src','server.py')]
+
+    write(str(root / 'docs.md'),"how handle_upload stores blobs")
+    ws.checked = 0 # the refresh gap is up
+    files_hit(ws,"handle_upload") # answered from what's indexed, kicks off a refresh
+    settle(ws)
+    assert set(files_hit(ws,"handle_upload")) == {'docs.md',os.path.join('src','server.py')}
+
+    os.remove(str(root / 'docs.md'))
+    ws.checked = 0
+    files_hit(ws,"handle_upload")
+    settle(ws)
+    assert files_hit(ws,"handle_upload") == [os.path.join('src','server.py')]
+
+
+def test_search_never_waits_for_a_walk(tmp_path):
+    root = tmp_path / 'proj'
+    write(str(root / 'a.txt'),"retry budget for the uploader")
+    ws = main.workspaceIndex(str(root))
+    ws.refresh()
+    ws.checked = 0
+    with ws.refreshing: # a walk that's taking its time
+        t0 = time.monotonic()
+        assert files_hit(ws,"retry budget") == ['a.txt']
+        assert time.monotonic() - t0 < 1
+